@@ -0,0 +1,161 @@
+# bench/harness.py
+"""
+Measurement helpers and offline stubs for the benchmark suite.
+
+Everything here is deliberately dependency-free: latencies come from
+time.perf_counter, peak RSS from resource.getrusage.
+"""
+
+import json
+import os
+import platform
+import resource
+import smtplib
+import subprocess
+import sys
+import tempfile
+import time
+
+# fixed keys so benchmark runs never touch the OS keyring
+BENCH_FERNET_KEY = b"bWluaV9oaWRzX2JlbmNobWFya19rZXlfMDAwMDAwMDA="
+BENCH_MASTER_KEY = "bWluaV9oaWRzX2JlbmNobWFya19tYXN0ZXJfMDAwMDA="
+
+
+class _FakeSMTP:
+    """Drop-in for smtplib.SMTP that accepts everything and sends nothing."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def starttls(self, *args, **kwargs):
+        pass
+
+    def login(self, *args, **kwargs):
+        pass
+
+    def sendmail(self, *args, **kwargs):
+        return {}
+
+    def quit(self):
+        pass
+
+
+def install_stubs(workdir):
+    """
+    Point storage at a scratch DB and stub keyring + SMTP.
+    Must run before workloads touch storage.db / utils.emailer.
+    """
+    import keyring
+    import config
+    import utils.emailer as emailer
+    import storage.db as db
+
+    secrets = {config.FERNET_KEY_NAME: BENCH_FERNET_KEY.decode(),
+               config.MASTER_KEY_NAME: BENCH_MASTER_KEY}
+    keyring.get_password = lambda service, name: secrets.get(name)
+    keyring.set_password = lambda service, name, value: secrets.__setitem__(name, value)
+    smtplib.SMTP = _FakeSMTP
+    emailer.SMTP_USER = "bench"
+    emailer.SMTP_PASS = "bench"
+    emailer.FROM_ADDR = "bench@localhost"
+    emailer.TO_ADDRS = ["bench@localhost"]
+
+    db.set_storage_root(workdir)
+    db.init_db()
+    return workdir
+
+
+def peak_rss_kb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+class Recorder:
+    """Collects per-operation latencies for one workload."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.t_start = None
+        self.t_end = None
+        self.extra = {}
+
+    def time(self, fn, *args):
+        """Run one measured op. Wall time spans first to last op, so setup is excluded."""
+        t0 = time.perf_counter()
+        r = fn(*args)
+        t1 = time.perf_counter()
+        self.latencies.append(t1 - t0)
+        if self.t_start is None:
+            self.t_start = t0
+        self.t_end = t1
+        return r
+
+    def result(self):
+        lat = sorted(self.latencies)
+        wall = (self.t_end - self.t_start) if self.t_start is not None else 0.0
+        n = len(lat)
+        out = {
+            "workload": self.name,
+            "ops": n,
+            "wall_seconds": round(wall, 6),
+            "throughput_ops_per_sec": round(n / wall, 2) if wall > 0 else 0.0,
+            "p50_us": round(percentile(lat, 0.50) * 1e6, 2),
+            "p99_us": round(percentile(lat, 0.99) * 1e6, 2),
+            "max_us": round((lat[-1] if lat else 0.0) * 1e6, 2),
+            "peak_rss_kb": peak_rss_kb(),
+        }
+        out.update(self.extra)
+        return out
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+
+def run_metadata(args):
+    return {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_rev": git_rev(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "scale": args.scale,
+    }
+
+
+def scratch_dir():
+    return tempfile.mkdtemp(prefix="mini_hids_bench_")
+
+
+def write_results(path, results):
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare(old, new):
+    """Print throughput / p99 deltas between two result files."""
+    old_by = {r["workload"]: r for r in old.get("results", [])}
+    print(f"{'workload':<18}{'ops/s old':>14}{'ops/s new':>14}{'delta':>9}{'p99 old':>11}{'p99 new':>11}")
+    for r in new.get("results", []):
+        o = old_by.get(r["workload"])
+        if not o:
+            continue
+        a, b = o["throughput_ops_per_sec"], r["throughput_ops_per_sec"]
+        delta = ((b - a) / a * 100.0) if a else 0.0
+        print(f"{r['workload']:<18}{a:>14.1f}{b:>14.1f}{delta:>8.1f}%{o['p99_us']:>11.1f}{r['p99_us']:>11.1f}")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+bench/run_bench.py
+
+Reproducible benchmark suite for mini_hids.
+
+Replays seeded synthetic workloads through the real ingest, detection and
+storage code paths, fully offline (keyring and SMTP are stubbed, storage
+goes to a scratch directory). Each workload runs in its own child process
+so peak RSS is per workload.
+
+Usage:
+    python -m bench.run_bench                        # all workloads
+    python -m bench.run_bench -w auth_ingest db_add  # a subset
+    python -m bench.run_bench --out bench/results/after.json --compare bench/results/before.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+from bench import harness
+from bench.workloads import WORKLOADS
+
+DEFAULT_OUT = os.path.join("bench", "results", "latest.json")
+
+
+def run_one(name, seed, scale):
+    """Run a single workload in this process and return its result dict."""
+    workdir = harness.scratch_dir()
+    try:
+        harness.install_stubs(workdir)
+        rng = random.Random(f"{seed}:{name}")
+        rec = harness.Recorder(name)
+        WORKLOADS[name](rec, rng, scale)
+        return rec.result()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_child(name, args):
+    cmd = [sys.executable, "-m", "bench.run_bench", "--child", name,
+           "--seed", str(args.seed), "--scale", str(args.scale)]
+    out = subprocess.run(cmd, capture_output=True, text=True)
+    if out.returncode != 0:
+        return {"workload": name, "error": (out.stderr or out.stdout).strip()[-2000:]}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def print_table(results):
+    print(f"{'workload':<18}{'ops':>9}{'ops/s':>13}{'p50 us':>10}{'p99 us':>10}{'peak RSS MB':>13}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['workload']:<18}  ERROR: {r['error'].splitlines()[-1]}")
+            continue
+        print(f"{r['workload']:<18}{r['ops']:>9}{r['throughput_ops_per_sec']:>13.1f}"
+              f"{r['p50_us']:>10.1f}{r['p99_us']:>10.1f}{r['peak_rss_kb'] / 1024.0:>13.1f}")
+    sized = [r for r in results if "stored_bytes_per_event" in r]
+    if sized:
+        print(f"\n{'workload':<18}{'encryption':>12}{'plain B/ev':>12}{'stored B/ev':>13}{'overhead':>10}")
+        for r in sized:
+            plain = r["plaintext_bytes_per_event"] or 1.0
+            print(f"{r['workload']:<18}{r['encryption']:>12}{plain:>12.1f}{r['stored_bytes_per_event']:>13.1f}"
+                  f"{(r['stored_bytes_per_event'] / plain - 1) * 100:>9.1f}%")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="mini_hids benchmark suite")
+    ap.add_argument("-w", "--workloads", nargs="*", default=list(WORKLOADS), choices=list(WORKLOADS))
+    ap.add_argument("--seed", type=int, default=1337)
+    ap.add_argument("--scale", type=int, default=1, help="multiplier for workload sizes")
+    ap.add_argument("--out", default=DEFAULT_OUT, help="JSON results file")
+    ap.add_argument("--compare", help="previous results JSON to diff against")
+    ap.add_argument("--inprocess", action="store_true", help="run all workloads in this process")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_one(args.child, args.seed, args.scale)))
+        return 0
+
+    results = []
+    for name in args.workloads:
+        r = run_one(name, args.seed, args.scale) if args.inprocess else run_child(name, args)
+        results.append(r)
+
+    doc = {"meta": harness.run_metadata(args), "results": results}
+    harness.write_results(args.out, doc)
+    print_table(results)
+    print(f"\nresults written to {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        print()
+        harness.compare(old, doc)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+bench/startup_profile.py
+
+Cold-start profile for mini_hids.
+
+For each entry module, imports it in fresh interpreters with
+`-X importtime` and reports the median wall time, the slowest imports
+(cumulative, like `python -X importtime` sorted), and which heavy
+dependencies were pulled in at import time. With --bring-up it also
+times HIDS() construction and HIDS.start() in a scratch store with
+keyring/SMTP stubbed.
+
+Usage:
+    python -m bench.startup_profile                         # start_hids, monitor.monitor_core, mini_hids
+    python -m bench.startup_profile -m start_hids --top 30
+    python -m bench.startup_profile --bring-up --json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = ["start_hids", "monitor.monitor_core", "mini_hids"]
+HEAVY = ["watchdog", "psutil", "cryptography", "keyring", "nacl", "smtplib", "email.mime", "http.server"]
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from -X importtime output."""
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        out.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return out
+
+
+def profile_module(module, runs):
+    walls, imports = [], None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True)
+        walls.append(time.perf_counter() - t0)
+        if proc.returncode != 0:
+            return {"module": module, "error": proc.stderr.strip().splitlines()[-1:]}
+        imports = parse_importtime(proc.stderr)
+    loaded = {name for name, _, _ in imports}
+    return {
+        "module": module,
+        "wall_ms_median": round(statistics.median(walls) * 1000, 1),
+        "import_ms": round(max((c for _, _, c in imports), default=0) / 1000, 1),
+        "heavy_loaded": [h for h in HEAVY if h in loaded],
+        "slowest": sorted(imports, key=lambda r: -r[2]),
+    }
+
+
+def bring_up_child():
+    """Time HIDS() and HIDS.start() in this process (scratch store, stubs)."""
+    from bench import harness
+    workdir = harness.scratch_dir()
+    try:
+        t0 = time.perf_counter()
+        harness.install_stubs(workdir)
+        from monitor.monitor_core import HIDS
+        t1 = time.perf_counter()
+        h = HIDS(email_alerts=False)
+        t2 = time.perf_counter()
+        h.start()
+        t3 = time.perf_counter()
+        h.stop()
+        return {"import_ms": round((t1 - t0) * 1000, 1), "init_ms": round((t2 - t1) * 1000, 1),
+                "start_ms": round((t3 - t2) * 1000, 1)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="mini_hids startup profile")
+    ap.add_argument("-m", "--modules", nargs="*", default=DEFAULT_MODULES)
+    ap.add_argument("--runs", type=int, default=5, help="fresh interpreters per module")
+    ap.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    ap.add_argument("--bring-up", action="store_true", help="also time HIDS() and HIDS.start()")
+    ap.add_argument("--json", action="store_true")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(bring_up_child()))
+        return 0
+
+    report = {"python": sys.version.split()[0], "modules": [profile_module(m, args.runs) for m in args.modules]}
+    if args.bring_up:
+        proc = subprocess.run([sys.executable, "-m", "bench.startup_profile", "--child"],
+                              capture_output=True, text=True)
+        lines = proc.stdout.strip().splitlines()
+        report["bring_up"] = json.loads(lines[-1]) if proc.returncode == 0 and lines else \
+            {"error": proc.stderr.strip()[-500:]}
+
+    for m in report["modules"]:
+        m["slowest"] = m.get("slowest", [])[:args.top]
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    for m in report["modules"]:
+        if "error" in m:
+            print(f"{m['module']}: ERROR {m['error']}")
+            continue
+        print(f"{m['module']}: {m['wall_ms_median']} ms wall (median of {args.runs}), "
+              f"{m['import_ms']} ms importing")
+        print(f"    heavy deps loaded at import: {', '.join(m['heavy_loaded']) or 'none'}")
+        print(f"    {'cumulative us':>14} {'self us':>9}  module")
+        for name, self_us, cum_us in m["slowest"]:
+            print(f"    {cum_us:>14} {self_us:>9}  {name}")
+    if "bring_up" in report:
+        b = report["bring_up"]
+        if "error" in b:
+            print(f"bring-up: ERROR {b['error']}")
+        else:
+            print(f"bring-up: import {b['import_ms']} ms, HIDS() {b['init_ms']} ms, start() {b['start_ms']} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
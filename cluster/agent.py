@@ -0,0 +1,219 @@
+# cluster/agent.py
+"""
+Agent side of multi-host mode: ships this host's events to a collector.
+
+The local segment store is the durable buffer. The agent keeps no queue
+of its own; it reads committed rows after the last id the collector has
+acknowledged (db.iter_rows(after_id=...)), so events written while the
+collector is down or while this host was restarted are shipped on the
+next connection. The collector tells the agent where to resume in its
+welcome message, which makes shipping idempotent across reconnects.
+
+The hello carries a random store id (AGENT_STORE_ID_FILE, created with
+the store) and the store's highest row id, so the collector notices a
+wiped or replaced store whose ids start again from 1 (see
+cluster/collector.py, epochs).
+
+Batches of up to CLUSTER_BATCH_EVENTS rows are compressed and encrypted
+(cluster/protocol.py) and sent over one persistent TCP connection. At
+most CLUSTER_WINDOW batches may be unacknowledged; when the collector
+falls behind the agent stops reading, and the backlog simply stays in
+the local store. Local retention still applies, so a collector outage
+longer than the retention window loses the oldest events.
+"""
+
+import os
+import socket
+import threading
+import time
+
+from config import (CLUSTER_AGENT_ID, CLUSTER_BATCH_EVENTS, CLUSTER_WINDOW,
+                    CLUSTER_RECONNECT_MAX)
+import storage.db as db
+from cluster.protocol import Channel, ProtocolError, load_cluster_key
+from utils.helpers import now_iso, ensure_dir
+from utils import metrics
+
+AGENT_STORE_ID_FILE = "agent_store_id"   # in the store directory
+
+
+def parse_addr(addr, default_port=7514):
+    host, _, port = addr.rpartition(":")
+    if not host:
+        return addr, default_port
+    return host.strip("[]"), int(port)
+
+
+def store_id(root=None):
+    """Random id of this store, created on first use; a new store gets a new id."""
+    path = os.path.join(root or db.store_dir(), AGENT_STORE_ID_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            sid = f.read().strip()
+        if sid:
+            return sid
+    except OSError:
+        pass
+    sid = os.urandom(16).hex()
+    ensure_dir(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(sid + "\n")
+    return sid
+
+
+class Agent:
+    def __init__(self, collector, agent_id=None, batch_events=CLUSTER_BATCH_EVENTS,
+                 window=CLUSTER_WINDOW, key=None):
+        self.addr = parse_addr(collector) if isinstance(collector, str) else collector
+        self.agent_id = agent_id or CLUSTER_AGENT_ID or socket.gethostname()
+        self.host = socket.gethostname()
+        self.batch_events = int(batch_events)
+        self.window = max(1, int(window))
+        self.key = key
+        self.acked_id = None
+        self.sent_batches = 0
+        self._inflight = []            # last_id of each unacked batch, in send order
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._chan = None
+
+    def _on_rows(self, rows):
+        # commit path: just wake the shipper
+        self._wake.set()
+
+    # connection
+
+    def _connect(self):
+        sock = socket.create_connection(self.addr, timeout=10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(None)
+        chan = Channel(sock, self.key)
+        chan.send({"t": "hello", "agent_id": self.agent_id, "host": self.host,
+                   "store_id": store_id(), "last_id": db.last_row_id()})
+        welcome = chan.recv()
+        if not welcome or welcome.get("t") != "welcome":
+            chan.close()
+            raise ProtocolError("collector did not accept the connection")
+        self.acked_id = int(welcome.get("resume_after") or 0)
+        self._inflight = []
+        return chan
+
+    def _read_acks(self, chan, stop_event):
+        try:
+            while not stop_event.is_set():
+                msg = chan.recv()
+                if msg is None:
+                    break
+                if msg.get("t") != "ack":
+                    continue
+                last = int(msg["last_id"])
+                with self._cond:
+                    self.acked_id = max(self.acked_id or 0, last)
+                    self._inflight = [i for i in self._inflight if i > last]
+                    self._cond.notify_all()
+        except (OSError, ProtocolError, ValueError):
+            pass
+        finally:
+            with self._cond:
+                self._chan = None
+                self._cond.notify_all()
+
+    # shipping
+
+    def _ship(self, chan, stop_event):
+        cursor = self.acked_id
+        while not stop_event.is_set():
+            self._wake.clear()
+            batch = []
+            for rid, ts, _, ev in self._rows_after(cursor):
+                batch.append([rid, ts, ev])
+                if len(batch) >= self.batch_events:
+                    cursor = self._send(chan, batch, stop_event)
+                    batch = []
+                    if cursor is None:
+                        return
+            if batch:
+                cursor = self._send(chan, batch, stop_event)
+                if cursor is None:
+                    return
+            if self._chan is None:
+                return
+            self._wake.wait(1.0)
+
+    def _rows_after(self, cursor):
+        decrypt = db.row_decryptor()
+        for rid, ts, etype, enc in db.iter_rows(newest_first=False, after_id=cursor):
+            ev = decrypt(enc)
+            if "type" not in ev and etype:
+                ev["type"] = etype
+            yield rid, ts, etype, ev
+
+    def _send(self, chan, batch, stop_event):
+        """Send one batch once the window allows it; returns the new cursor, None if disconnected."""
+        last_id = batch[-1][0]
+        with self._cond:
+            while len(self._inflight) >= self.window and self._chan is not None and not stop_event.is_set():
+                self._cond.wait(1.0)
+            if self._chan is None or stop_event.is_set():
+                return None
+            self._inflight.append(last_id)
+        with metrics.timed("hids_cluster_send_seconds"):
+            chan.send({"t": "batch", "last_id": last_id, "events": batch})
+        self.sent_batches += 1
+        metrics.inc("hids_cluster_batches_total", labels={"result": "sent"})
+        metrics.inc("hids_cluster_events_shipped_total", len(batch))
+        return last_id
+
+    def run_loop(self, stop_event):
+        if self.key is None:
+            try:
+                self.key = load_cluster_key()
+            except Exception as e:
+                # runs as a daemon thread: record why, nothing would see a traceback
+                metrics.inc("hids_cluster_batches_total", labels={"result": "agent_failed"})
+                try:
+                    db.add_event({"ts": now_iso(), "type": "cluster_agent_failed",
+                                  "collector": f"{self.addr[0]}:{self.addr[1]}", "error": str(e)})
+                except Exception:
+                    pass
+                return
+        db.subscribe(self._on_rows)
+        backoff = 1
+        try:
+            while not stop_event.is_set():
+                try:
+                    chan = self._connect()
+                except (OSError, ProtocolError) as e:
+                    metrics.inc("hids_cluster_batches_total", labels={"result": "connect_error"})
+                    try:
+                        db.add_event({"ts": now_iso(), "type": "cluster_connect_failed",
+                                      "collector": f"{self.addr[0]}:{self.addr[1]}", "error": str(e)})
+                    except Exception:
+                        pass
+                    stop_event.wait(backoff)
+                    backoff = min(backoff * 2, CLUSTER_RECONNECT_MAX)
+                    continue
+                backoff = 1
+                self._chan = chan
+                reader = threading.Thread(target=self._read_acks, args=(chan, stop_event), daemon=True)
+                reader.start()
+                try:
+                    self._ship(chan, stop_event)
+                except (OSError, ProtocolError):
+                    pass
+                finally:
+                    if stop_event.is_set():
+                        self._drain(1.0)
+                    chan.close()
+                    reader.join(timeout=2)
+                    self._chan = None
+        finally:
+            db.unsubscribe(self._on_rows)
+
+    def _drain(self, timeout):
+        """On shutdown give outstanding acks a moment to arrive."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._inflight and self._chan is not None and time.time() < deadline:
+                self._cond.wait(0.1)
@@ -0,0 +1,271 @@
+# cluster/collector.py
+"""
+Collector side of multi-host mode.
+
+Accepts agent connections (cluster/protocol.py), ingests their batches
+into this process's segmented store and runs alerting once, centrally.
+Each stored event is the agent's event plus:
+
+    host            hostname reported by the agent
+    agent_id        agent identity (defaults to the hostname)
+    agent_event_id  row id in the agent's local store
+    agent_epoch     see below
+
+A batch is acknowledged only after it has been committed (db.flush), and
+the last acknowledged id per agent is kept in collector_state.db next to
+the store. Agents resume from that id, so a batch resent after a dropped
+connection is not stored twice.
+
+All agents share the cluster key, so an agent_id is only a claim. Each
+agent_id is therefore bound to the store id its agent reports
+(cluster/agent.py) and ids are tracked per epoch: when the store id
+changes, the agent's highest id is below the acknowledged one (store
+wiped), or a batch's ids go backwards, the collector starts a new epoch
+for that agent (acknowledged id back to 0) and records
+cluster_agent_new_epoch instead of dropping the events as duplicates.
+Stored events carry agent_epoch, so (agent_id, agent_epoch,
+agent_event_id) identifies a row.
+
+The collector listens on CLUSTER_LISTEN, loopback by default; accepting
+agents from other hosts means setting a routable address explicitly.
+
+Alerting runs on its own thread behind a bounded queue so a slow SMTP
+server never stalls ingestion; when the queue is full, alerts are
+counted and dropped (the events themselves are stored).
+"""
+
+import os
+import queue
+import socketserver
+import sqlite3
+import threading
+
+from config import CLUSTER_LISTEN
+import storage.db as db
+from cluster.agent import parse_addr
+from cluster.protocol import Channel, ProtocolError, load_cluster_key
+from utils.helpers import now_iso
+from utils import metrics
+
+_STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS agents (
+    agent_id TEXT PRIMARY KEY,
+    host TEXT,
+    acked_id INTEGER NOT NULL DEFAULT 0,
+    events INTEGER NOT NULL DEFAULT 0,
+    last_seen TEXT,
+    store_id TEXT,
+    epoch INTEGER NOT NULL DEFAULT 0
+)
+'''
+_STATE_COLUMNS = (("store_id", "TEXT"), ("epoch", "INTEGER NOT NULL DEFAULT 0"))
+
+ALERT_QUEUE_SIZE = 10000
+
+
+def default_alerter():
+    """The same alert policy as start_hids.py, applied to every ingested event."""
+    from monitor.monitor_core import HIDS
+    from start_hids import is_high_priority_event, is_whitelisted_event
+    h = HIDS(email_alerts=True)
+
+    def alert(ev):
+        if is_high_priority_event(ev) and not is_whitelisted_event(ev):
+            h.alert(ev)
+    return alert
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        col = self.server.collector
+        chan = Channel(self.request, col.key)
+        agent_id = None
+        try:
+            hello = chan.recv()
+            if not hello or hello.get("t") != "hello" or not hello.get("agent_id"):
+                return
+            agent_id = str(hello["agent_id"])
+            host = str(hello.get("host") or agent_id)
+            last_id = hello.get("last_id")
+            acked, epoch = col.agent_connected(agent_id, host, self.client_address[0], hello.get("store_id"),
+                                               int(last_id) if last_id is not None else None)
+            chan.send({"t": "welcome", "resume_after": acked})
+            while True:
+                msg = chan.recv()
+                if msg is None:
+                    break
+                if msg.get("t") != "batch":
+                    continue
+                acked, epoch = col.ingest(agent_id, host, acked, msg.get("events") or [], epoch)
+                chan.send({"t": "ack", "last_id": acked})
+        except (OSError, ProtocolError, ValueError) as e:
+            if agent_id:
+                db.add_event({"ts": now_iso(), "type": "cluster_agent_error", "agent_id": agent_id, "error": str(e)})
+        finally:
+            chan.close()
+            if agent_id:
+                col.agent_disconnected(agent_id)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Collector:
+    def __init__(self, listen=CLUSTER_LISTEN, root="storage/collector", alert=None, key=None):
+        self.addr = parse_addr(listen) if isinstance(listen, str) else listen
+        self.root = root
+        self.key = key
+        self.alert = alert
+        self.connected = {}
+        self._state_lock = threading.Lock()
+        self._alerts = queue.Queue(ALERT_QUEUE_SIZE)
+        self._srv = None
+        self._state = None
+
+    # per-agent state
+
+    def _open_state(self):
+        os.makedirs(self.root, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.root, "collector_state.db"), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_STATE_SCHEMA)
+        for col, decl in _STATE_COLUMNS:   # state DBs from before epochs
+            try:
+                conn.execute(f"ALTER TABLE agents ADD COLUMN {col} {decl}")
+            except sqlite3.OperationalError:
+                pass
+        conn.commit()
+        return conn
+
+    def _new_epoch(self, agent_id, reason, **info):
+        """Reset the agent's acknowledged id under a new epoch (caller holds _state_lock); returns the epoch."""
+        self._state.execute("UPDATE agents SET acked_id=0, epoch=epoch+1 WHERE agent_id=?", (agent_id,))
+        if info.get("store_id"):
+            self._state.execute("UPDATE agents SET store_id=? WHERE agent_id=?", (info["store_id"], agent_id))
+        self._state.commit()
+        epoch = self._state.execute("SELECT epoch FROM agents WHERE agent_id=?", (agent_id,)).fetchone()[0]
+        metrics.inc("hids_cluster_agent_epochs_total", labels={"reason": reason})
+        db.add_event(dict({"ts": now_iso(), "type": "cluster_agent_new_epoch", "agent_id": agent_id,
+                           "reason": reason, "epoch": epoch}, **info))
+        return epoch
+
+    def agent_connected(self, agent_id, host, peer, store_id=None, last_id=None):
+        """(id to resume after, epoch) for an agent's hello."""
+        with self._state_lock:
+            row = self._state.execute("SELECT acked_id, store_id, epoch FROM agents WHERE agent_id=?",
+                                      (agent_id,)).fetchone()
+            if row is None:
+                self._state.execute("INSERT INTO agents (agent_id, host, last_seen, store_id) VALUES (?, ?, ?, ?)",
+                                    (agent_id, host, now_iso(), store_id))
+                self._state.commit()
+                acked, epoch = 0, 0
+            else:
+                acked, known_store, epoch = row
+                reason = None
+                if store_id and known_store and store_id != known_store:
+                    reason = "store_changed"
+                elif last_id is not None and last_id < acked:
+                    reason = "ids_went_backwards"
+                if reason:
+                    epoch = self._new_epoch(agent_id, reason, previous_acked_id=acked, agent_last_id=last_id,
+                                            store_id=store_id, previous_store_id=known_store, peer=peer)
+                    acked = 0
+                elif store_id and not known_store:
+                    self._state.execute("UPDATE agents SET store_id=? WHERE agent_id=?", (store_id, agent_id))
+                    self._state.commit()
+            self.connected[agent_id] = peer
+        metrics.set_gauge("hids_cluster_agents", len(self.connected))
+        db.add_event({"ts": now_iso(), "type": "cluster_agent_connected", "agent_id": agent_id,
+                      "host": host, "peer": peer, "resume_after": acked, "epoch": epoch})
+        return acked, epoch
+
+    def agent_disconnected(self, agent_id):
+        with self._state_lock:
+            self.connected.pop(agent_id, None)
+        metrics.set_gauge("hids_cluster_agents", len(self.connected))
+        db.add_event({"ts": now_iso(), "type": "cluster_agent_disconnected", "agent_id": agent_id})
+
+    # ingestion
+
+    def ingest(self, agent_id, host, acked, events, epoch=0):
+        """Store one batch; returns (new acknowledged id, epoch) for this agent."""
+        fresh = []
+        last = acked
+        for rid, ts, ev in events:
+            rid = int(rid)
+            if rid <= last:
+                # agents resume after the acknowledged id, so this is a reset store, not a resend
+                with self._state_lock:
+                    epoch = self._new_epoch(agent_id, "ids_went_backwards", previous_acked_id=last,
+                                            agent_event_id=rid)
+            last = rid
+            if not isinstance(ev, dict):
+                continue
+            ev = dict(ev)
+            ev.setdefault("ts", ts)
+            ev["host"] = host
+            ev["agent_id"] = agent_id
+            ev["agent_event_id"] = rid
+            ev["agent_epoch"] = epoch
+            fresh.append(ev)
+        with metrics.timed("hids_cluster_ingest_seconds"):
+            for ev in fresh:
+                db.add_event(ev, dedup=False)   # agents fold their own repeats
+            db.flush()
+        if events:
+            with self._state_lock:
+                self._state.execute("UPDATE agents SET acked_id=?, host=?, events=events+?, last_seen=? WHERE agent_id=?",
+                                    (last, host, len(fresh), now_iso(), agent_id))
+                self._state.commit()
+        metrics.inc("hids_cluster_events_ingested_total", len(fresh), labels={"agent": agent_id})
+        if self.alert is not None:
+            for ev in fresh:
+                try:
+                    self._alerts.put_nowait(ev)
+                except queue.Full:
+                    metrics.inc("hids_cluster_alerts_dropped_total")
+        return last, epoch
+
+    def _alert_loop(self):
+        while True:
+            ev = self._alerts.get()
+            if ev is None:
+                return
+            try:
+                self.alert(ev)
+            except Exception as e:
+                try:
+                    db.add_event({"ts": now_iso(), "type": "alert_send_exception", "error": str(e), "event": ev})
+                except Exception:
+                    pass
+
+    # lifecycle
+
+    def start(self):
+        if self.key is None:
+            self.key = load_cluster_key()
+        db.set_storage_root(self.root)
+        db.init_db()
+        self._state = self._open_state()
+        if self.alert is not None:
+            threading.Thread(target=self._alert_loop, daemon=True).start()
+        self._srv = _Server(self.addr, _Handler)
+        self._srv.collector = self
+        self.addr = self._srv.server_address[:2]
+        threading.Thread(target=self._srv.serve_forever, daemon=True).start()
+        db.add_event({"ts": now_iso(), "type": "cluster_collector_started", "listen": f"{self.addr[0]}:{self.addr[1]}"})
+        return self
+
+    def stop(self):
+        if self._srv is not None:
+            self._srv.shutdown()
+            self._srv.server_close()
+            self._srv = None
+        if self.alert is not None:
+            self._alerts.put(None)
+        db.flush()
+        if self._state is not None:
+            self._state.close()
+            self._state = None
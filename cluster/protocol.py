@@ -0,0 +1,89 @@
+# cluster/protocol.py
+"""
+Wire format between agents and the collector.
+
+Every message is one frame:
+
+    u32 length | nonce (12) | AES-GCM(cluster key, zlib(JSON message))
+
+The cluster key is a shared 256-bit secret (MINI_HIDS_CLUSTER_KEY as
+urlsafe base64, or the keyring entry CLUSTER_KEY_NAME). A peer without
+it cannot read or forge frames.
+
+Messages:
+    agent -> collector  {"t": "hello", "agent_id": ..., "host": ..., "store_id": ..., "last_id": N}
+    collector -> agent  {"t": "welcome", "resume_after": <last acked id>}
+    agent -> collector  {"t": "batch", "last_id": N, "events": [[id, ts, event], ...]}
+    collector -> agent  {"t": "ack", "last_id": N}
+"""
+
+import base64
+import json
+import os
+import struct
+import zlib
+
+from config import CLUSTER_KEY_NAME
+from utils.crypto_utils import aead, new_data_key
+
+MAX_FRAME = 16 * 1024 * 1024
+AAD = b"mini_hids-cluster-v1"
+_LEN = struct.Struct(">I")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def load_cluster_key():
+    raw = os.environ.get("MINI_HIDS_CLUSTER_KEY")
+    if not raw:
+        import keyring
+        raw = keyring.get_password("mini_hids", CLUSTER_KEY_NAME)
+    if not raw:
+        raise ProtocolError("no cluster key: set MINI_HIDS_CLUSTER_KEY or the keyring entry "
+                            f"'{CLUSTER_KEY_NAME}' (python mini_hids.py cluster-key)")
+    key = base64.urlsafe_b64decode(raw.encode())
+    if len(key) != 32:
+        raise ProtocolError("cluster key must be 32 bytes")
+    return key
+
+
+def new_cluster_key():
+    return base64.urlsafe_b64encode(new_data_key()).decode()
+
+
+class Channel:
+    """Framed, encrypted, compressed message channel over a connected socket."""
+
+    def __init__(self, sock, key):
+        self.sock = sock
+        self.aead = aead(key)
+        self.rfile = sock.makefile("rb")
+
+    def send(self, msg):
+        nonce = os.urandom(12)
+        body = nonce + self.aead.encrypt(nonce, zlib.compress(json.dumps(msg, default=str).encode(), 6), AAD)
+        self.sock.sendall(_LEN.pack(len(body)) + body)
+
+    def recv(self):
+        head = self.rfile.read(4)
+        if len(head) < 4:
+            return None
+        (n,) = _LEN.unpack(head)
+        if n > MAX_FRAME or n < 28:
+            raise ProtocolError(f"bad frame length {n}")
+        body = self.rfile.read(n)
+        if len(body) < n:
+            return None
+        try:
+            raw = self.aead.decrypt(body[:12], body[12:], AAD)
+        except Exception:
+            raise ProtocolError("frame authentication failed")
+        return json.loads(zlib.decompress(raw))
+
+    def close(self):
+        try:
+            self.rfile.close()
+        finally:
+            self.sock.close()
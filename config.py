@@ -7,10 +7,153 @@ MONITOR_PATHS = [
     os.path.expanduser("~/Desktop")
 ]
 
+# Content signature scanning of created/modified files (monitor/content_scan.py)
+CONTENT_SCAN = {
+    "enabled": True,
+    "workers": 2,           # scanner threads (stat, cache, report)
+    "processes": 2,         # processes that read and match cache misses; 0 = match in the threads
+    "max_file_mb": 16,      # only this much of a file is scanned
+    "chunk_kb": 1024,       # read size; the automaton state carries across chunks
+    "cache_size": 20000,    # (device, inode, size, mtime) -> result, least recently used evicted
+    "queue_size": 10000,    # paths waiting to be scanned; beyond this they are dropped
+}
+
+# Executable hashes of new processes (monitor/exe_hash.py)
+EXE_HASH = {
+    "enabled": True,
+    "cache_path": "storage/exe_hash_cache.json",   # (device, inode, mtime, ctime, size) -> sha256, kept between runs
+    "cache_size": 50000,
+    "max_mb": 256,              # larger binaries are not hashed
+    "save_interval": 300,       # seconds between cache saves while running
+    "known_bad_files": [],      # extra hash lists, one sha256 per line
+    "known_good_files": [],
+}
+
+# Process baseline: rare / frequent (user, name, parent, exe) starts (monitor/baseline.py)
+PROC_BASELINE = {
+    "enabled": True,
+    "file": "process_baseline.cms",   # saved in the event store's directory
+    "width": 8192,              # count-min sketch: depth x width float counters (256 KB)
+    "depth": 4,
+    "half_life_days": 7,        # counts halve this often
+    "warmup_starts": 2000,      # no verdicts until this many starts were seen
+    "rare_below": 1.0,          # earlier starts (decayed) -> process_rare
+    "frequent_above": 50.0,     # earlier starts as this user -> folded into process_start_summary
+    "summary_interval": 900,    # seconds between summary rows
+    "summary_max_keys": 5000,
+    "save_interval": 300,
+}
+
+# Port-scan / connection-fanout detection (monitor/scan_detect.py)
+SCAN_DETECT = {
+    "enabled": True,
+    "window": 60,           # seconds
+    "buckets": 6,           # sliding window steps
+    "precision": 8,         # HyperLogLog registers = 2**precision bytes per bucket
+    "port_threshold": 20,   # distinct ports from one local process to one host -> port_scan
+    "inbound_port_threshold": 6,   # distinct local ports one remote host connected to -> port_scan
+    "source_threshold": 200,       # distinct remote hosts on one local port -> connection_fanin
+    "host_threshold": 50,   # distinct remote hosts from one process -> connection_fanout
+    "max_keys": 2048,       # tracked sources, least recently seen evicted
+    "suppress_flows": True, # don't store per-connection rows of a flagged flow (counted instead)
+}
+
+# Listener inventory: exposed (proto, addr, port, exe) services (monitor/listeners.py)
+LISTENERS = {
+    "enabled": True,
+    "approved_file": "listeners_approved.json",   # in the event store's directory
+    "grace": 30,            # seconds a service may have no socket (restart) before it counts as removed
+    "udp": False,           # also inventory bound UDP sockets
+    "checkpoint_interval": 10,   # min seconds between saves of the exposure checkpoint
+}
+
+# Folding of repeated events at ingest (storage/dedup.py)
+DEDUP = {
+    "enabled": os.getenv("MINI_HIDS_DEDUP", "1") == "1",
+    "window": 60,               # seconds; repeats within it become one row with count / first_ts / last_ts
+    "max_keys": 20000,          # open fingerprints; the oldest window is closed early when full
+    "keys": {                   # event type -> fields that identify a repeat (dotted = nested)
+        "file_modified": ["path"],
+        "net_connection": ["pid", "status", "local", "remote"],
+        "alert_received": ["event_type"],
+        "alert_filtered_out": ["event.type", "event.user", "event.name", "event.path", "event.remote"],
+    },
+}
+
+# `mini_hids query` aggregations (storage/query.py)
+QUERY = {
+    "top_capacity": 1000,       # counters kept per top-N summary (at least 10 x N)
+    "exact_distinct": 100000,   # distinct values counted exactly before switching to HyperLogLog
+    "hll_precision": 14,        # 16 KB of registers, ~0.8% error
+}
+
+# Monitor state checkpoints, diffed against on restart (storage/state.py)
+CHECKPOINT = {
+    "enabled": True,
+    "dir": "state",             # under the event store's directory
+    "interval": 30,             # seconds between checkpoints while running
+    "max_age_hours": 168,       # older checkpoints are ignored
+    "auth_catchup_mb": 64,      # at most this much missed auth log is read on restart
+}
+
+# Login check (monitor/auth_monitor.py)
+AUTH_CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "auth_credentials.json")
+AUTH_THROTTLE = {
+    "free_attempts": 3,     # failures per user / per IP before delays start
+    "base_delay": 1.0,      # seconds, doubled on every further failure
+    "max_delay": 300.0,
+    "table_size": 4096,     # tracked users + IPs; least recently seen are evicted
+}
+AUTH_QUEUE_SIZE = 1000      # failed-attempt events waiting for the background writer
+
+# Alert severity and prioritisation (monitor/severity.py, monitor/alerting.py)
+SEVERITY = {
+    "types": {
+        "suspicious_process": 85,
+        "suspicious_connection": 80,
+        "suspicious_listen": 75,
+        "login_throttled": 65,
+        "sudo_failed": 60,
+        "login_suspicious_ip": 60,
+        "auth_invalid_user": 50,
+        "gui_login_attempt": 50,
+        "auth_failed": 45,
+        "login_failed": 45,
+        "known_bad_executable": 95,
+        "port_scan": 70,
+        "listener_drift": 55,
+        "process_rare": 40,
+        "connection_fanout": 65,
+        "connection_fanin": 50,
+        "file_signature_match": 85,
+        "file_deleted": 45,
+        "file_created": 35,
+        "file_modified": 25,
+    },
+    "default": 10,
+    "reputation_bonus": 20,     # per match against rules.json (process, port, filename, bad_ips)
+    "correlation_window": 300,  # seconds
+    "correlation_step": 5,      # per earlier event from the same ip / user / process
+    "correlation_max": 25,
+    "correlation_actors": 4096,
+}
+ALERT_MIN_SEVERITY = int(os.environ.get("MINI_HIDS_ALERT_MIN_SEVERITY", "20"))   # below this: logged, never alerted
+ALERT_QUEUE_SIZE = 1000         # pending alerts; the lowest severity is evicted when full
+ALERT_BUDGETS = {               # per level: (alerts per hour, burst); None = unlimited
+    "info": (6, 2),
+    "low": (12, 5),
+    "medium": (30, 10),
+    "high": (120, 30),
+    "critical": None,
+}
+
+# Whitelist / identity policy (monitor/policy.py)
+POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "policy.json")
+
 # Files to maintain baseline hashes 
 BASELINE_FILE = "storage/baseline_hashes.json"
 
-# Database path
+# Legacy single-file database (still read; new events go to SEGMENT_DIR)
 DB_PATH = "storage/logs_encrypted.db"
 
 # Email (SMTP) 
@@ -31,4 +174,68 @@ PROCESS_MEM_THRESHOLD = 60.0
 
 # Encryption key location 
 FERNET_KEY_NAME = "mini_hids_fernet_key"
+MASTER_KEY_NAME = "mini_hids_master_key"   # wraps per-file / per-batch AES-GCM data keys
+
+
+# Self-instrumentation (off by default, MINI_HIDS_METRICS=1 to enable)
+METRICS_ENABLED = os.getenv("MINI_HIDS_METRICS", "0") == "1"
+METRICS_PORT = int(os.getenv("MINI_HIDS_METRICS_PORT", "9464"))   # localhost only
+METRICS_STATS_INTERVAL = 60   # seconds between hids_stats events
+
+# Event store retention (storage/retention.py)
+SEGMENT_DIR = "storage/segments"   # one sqlite file per UTC day
+RETENTION = {
+    "default_days": 90,            # whole segments older than this are dropped
+    "type_days": {                 # shorter TTLs for high-volume / bookkeeping types
+        "process_start": 14,
+        "net_connection": 7,
+        "listening_port": 30,
+        "file_modified": 30,
+        "alert_received": 3,
+        "alert_filtered_out": 3,
+        "alert_whitelisted_ignored": 3,
+        "alert_email_disabled": 3,
+        "auth_whitelisted_ignored": 3,
+        "process_ignored_teacher": 3,
+        "email_rate_limited_or_failed": 7,
+        "hids_stats": 7,
+    },
+    "max_total_mb": 2048,          # oldest segments dropped first above this
+    "check_interval": 3600,        # seconds between background passes
+    "vacuum_pages": 2000,          # pages released per segment per pass
+    "archive_after_days": 7,       # older segments are rolled into storage/archive/*.hca
+    "archive_days": None,          # archives older than this are deleted (None = default_days)
+}
+
+# Storage encryption: "envelope" = batched AES-GCM with per-batch data keys
+# wrapped by the keyring master key, "fernet" = one Fernet token per event
+STORAGE_ENCRYPTION = os.getenv("MINI_HIDS_STORAGE_ENCRYPTION", "envelope")
+BATCH_SIZE = 256          # events per sealed batch
+BATCH_MAX_DELAY = 0.5     # seconds an event may wait in the buffer before flush
+
+# Fallback spool (storage/spool.py) for events the store cannot take right now
+SPOOL_MAX_MB = 64         # pre-sized memory-mapped file; events beyond this are dropped
+SPOOL_HIGH_WATER = 8      # batches buffered behind a busy writer before spilling to the spool
+
+# Tamper-evident hash chain (storage/chain.py)
+CHAIN_SIGNING_KEY_NAME = "mini_hids_chain_signing_key"   # Ed25519 seed in the OS keyring
+CHAIN_CHECKPOINT_INTERVAL = 300   # seconds between signed checkpoints
+
+# Live event stream (storage/stream.py)
+STREAM_ENABLED = True
+STREAM_SOCKET = "storage/hids_stream.sock"   # Unix socket, owner-only permissions
+STREAM_CLIENT_BUFFER = 10000                 # events buffered per client before dropping oldest
+
+# Multi-host agent/collector mode (cluster/)
+CLUSTER_KEY_NAME = "mini_hids_cluster_key"                # shared AES key in the OS keyring
+CLUSTER_COLLECTOR = os.getenv("MINI_HIDS_COLLECTOR", "")  # "host:port" -> run as agent; empty = standalone
+CLUSTER_AGENT_ID = os.getenv("MINI_HIDS_AGENT_ID", "")    # defaults to the hostname
+# collector address; loopback unless exposed on purpose (e.g. MINI_HIDS_COLLECTOR_LISTEN=0.0.0.0:7514)
+CLUSTER_LISTEN = os.getenv("MINI_HIDS_COLLECTOR_LISTEN", "127.0.0.1:7514")
+CLUSTER_BATCH_EVENTS = 500   # events per shipped batch
+CLUSTER_WINDOW = 8           # unacked batches in flight before the agent waits
+CLUSTER_RECONNECT_MAX = 30   # seconds, cap of the reconnect backoff
 
+# Offline replay / forensic mode (monitor/replay.py)
+REPLAY_CHUNK_MB = 8          # plain-text logs and JSONL exports are split into chunks of this size
+REPLAY_TOP_ALERTS = 50       # highest-severity alerts kept in the report
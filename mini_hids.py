@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+mini_hids.py
+
+Command line tools for the mini_hids event store.
+
+    python mini_hids.py verify        # check the hash chain and signed checkpoints
+    python mini_hids.py checkpoint    # write a signed checkpoint now
+    python mini_hids.py tail          # follow live events from a running HIDS
+    python mini_hids.py collector     # receive events from agents on other hosts
+    python mini_hids.py agent         # ship this host's stored events to a collector
+    python mini_hids.py cluster-key   # create the shared agent/collector key
+    python mini_hids.py set-password  # set the trusted login password (stored hashed)
+    python mini_hids.py migrate-credentials  # hash a plaintext password left in teacher_creds.json
+    python mini_hids.py replay FILE.. # re-run detection over old auth logs / snapshots / exports
+    python mini_hids.py snapshot      # save process + socket snapshots for later replay
+    python mini_hids.py listeners     # services this host exposes (--approve to accept them)
+    python mini_hids.py query counts  # aggregations over the whole history (counts / top / distinct)
+"""
+
+import argparse
+import csv
+import json
+import sys
+
+
+def cmd_verify(args):
+    from storage import chain
+    ok, report = chain.verify_all(args.checkpoints)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for seg in report["segments"]:
+            status = "OK" if not seg["errors"] else "FAILED"
+            extra = f", {seg['unchained_rows']} unchained (pre-chain) rows" if seg["unchained_rows"] else ""
+            print(f"segment {seg['segment']}: {status} - {seg['rows']} rows, {seg['links']} links{extra}")
+            for pr in seg.get("prunes", []):
+                state = "signed" if pr["signed"] else "UNSIGNED"
+                why = "justified" if pr["justified"] else "NOT JUSTIFIED"
+                types = ", ".join(f"{t}={n}" for t, n in sorted((pr["types"] or {}).items())) or "?"
+                print(f"    prune at link {pr['seq']}: {pr['rows']} rows ({types}), {state}, {why}")
+            for e in seg["errors"][:20]:
+                print(f"    {e}")
+            if len(seg["errors"]) > 20:
+                print(f"    ... {len(seg['errors']) - 20} more")
+        cps = report["checkpoints"]
+        print(f"checkpoints: {cps['checkpoints']} checked, {len(cps['errors'])} problems")
+        for e in cps["errors"][:20]:
+            print(f"    {e}")
+        if cps["segments_dropped"]:
+            print(f"    segments no longer present (retention/archive): {', '.join(cps['segments_dropped'])}")
+        print("INTEGRITY OK" if ok else "INTEGRITY CHECK FAILED")
+    return 0 if ok else 1
+
+
+def cmd_checkpoint(args):
+    from storage import chain
+    from storage.db import flush
+    flush()
+    for cp in chain.checkpoint(args.checkpoints, force=True):
+        print(f"segment {cp['segment']}: seq {cp['seq']} head {cp['head'][:16]}...")
+    return 0
+
+
+def cmd_tail(args):
+    from storage.stream import stream_events
+    since = args.since
+    try:
+        for msg in stream_events(types=args.types, since=since):
+            if msg.get("type") == "stream_gap":
+                print(f"-- {msg['dropped']} events dropped (slow consumer); resume with --since {msg['last_id']}",
+                      file=sys.stderr)
+                continue
+            print(json.dumps(msg) if args.json else f"{msg['id']:>8}  {msg['ts']}  {msg['event']}")
+            sys.stdout.flush()
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("no running HIDS stream socket found", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _run_until_interrupted(stop_event):
+    import signal
+    signal.signal(signal.SIGTERM, lambda *a: stop_event.set())
+    try:
+        while not stop_event.is_set():
+            stop_event.wait(0.5)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+
+def cmd_collector(args):
+    import threading
+    from cluster.collector import Collector, default_alerter
+    from config import CLUSTER_LISTEN
+    from storage import db
+    db.set_storage_root(args.root)   # before HIDS() in default_alerter initializes a store
+    col = Collector(args.listen or CLUSTER_LISTEN, root=args.root,
+                    alert=None if args.no_alerts else default_alerter())
+    col.start()
+    print(f"collector listening on {col.addr[0]}:{col.addr[1]}, store {args.root}")
+    if col.addr[0] in ("127.0.0.1", "::1", "localhost"):
+        print("loopback only: pass --listen 0.0.0.0:7514 (or set MINI_HIDS_COLLECTOR_LISTEN) to accept remote agents")
+    _run_until_interrupted(threading.Event())
+    col.stop()
+    return 0
+
+
+def cmd_agent(args):
+    import threading
+    from cluster.agent import Agent
+    from cluster.protocol import ProtocolError, load_cluster_key
+    from storage import db
+    try:
+        key = load_cluster_key()
+    except ProtocolError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    if args.root:
+        db.set_storage_root(args.root)
+    db.init_db()
+    stop_event = threading.Event()
+    agent = Agent(args.collector, agent_id=args.agent_id, key=key)
+    t = threading.Thread(target=agent.run_loop, args=(stop_event,), daemon=True)
+    t.start()
+    print(f"shipping to {args.collector} as {agent.agent_id}")
+    _run_until_interrupted(stop_event)
+    t.join(timeout=5)
+    return 0
+
+
+def cmd_cluster_key(args):
+    import keyring
+    from config import CLUSTER_KEY_NAME
+    from cluster.protocol import new_cluster_key
+    key = args.key or keyring.get_password("mini_hids", CLUSTER_KEY_NAME)
+    if not key:
+        key = new_cluster_key()
+    keyring.set_password("mini_hids", CLUSTER_KEY_NAME, key)
+    print(key)
+    return 0
+
+
+def cmd_set_password(args):
+    import getpass
+    from monitor.auth_monitor import set_password
+    from monitor.policy import load_teacher_user
+    user = args.user or load_teacher_user()
+    if not user:
+        print("no username given and none in assets/teacher_creds.json", file=sys.stderr)
+        return 1
+    pw = getpass.getpass(f"New password for {user}: ")
+    if not pw or pw != getpass.getpass("Repeat: "):
+        print("passwords empty or do not match", file=sys.stderr)
+        return 1
+    set_password(user, pw)
+    print(f"password for {user} updated")
+    return 0
+
+
+def cmd_migrate_credentials(args):
+    from monitor.auth_monitor import migrate_credentials
+    user = migrate_credentials()
+    if not user:
+        print("no plaintext password in assets/teacher_creds.json, nothing to migrate")
+        return 0
+    print(f"password for {user} hashed into assets/auth_credentials.json and removed from teacher_creds.json")
+    return 0
+
+
+def cmd_replay(args):
+    import os
+    from config import SEGMENT_DIR
+    from monitor.replay import replay
+    if args.out and os.path.realpath(args.out) == os.path.realpath(os.path.dirname(SEGMENT_DIR)):
+        print("--out must not be the live store", file=sys.stderr)
+        return 1
+    opts = {k: v for k, v in (("chunk_mb", args.chunk_mb), ("top", args.top)) if v is not None}
+    report = replay(args.files, out_root=args.out, jobs=args.jobs, **opts)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{report['records']} records from {len(report['inputs'])} inputs in {report['tasks']} tasks "
+          f"({report['jobs']} workers): {report['elapsed_s']} s, {report['records_per_s']} records/s")
+    print(f"{report['events']} events, {report['alerts']} alerts "
+          f"({', '.join(f'{k} {v}' for k, v in report['alerts_by_level'].items()) or 'none'})")
+    for etype, n in report["events_by_type"].items():
+        print(f"    {n:>8}  {etype}")
+    if report["top_alerts"]:
+        print("top alerts:")
+        for ev in report["top_alerts"][:20]:
+            print(f"    [{ev['severity']:>3}] {ev.get('ts')}  {ev.get('type')}  "
+                  f"{ev.get('user') or ev.get('name') or ''} {ev.get('ip') or ev.get('remote') or ev.get('path') or ''}")
+    if args.out:
+        print(f"events written to {args.out}")
+    return 0
+
+
+def cmd_snapshot(args):
+    from monitor.replay import capture_snapshots
+    capture_snapshots(args.out, count=args.count, interval=args.interval)
+    print(f"{args.count} snapshot(s) appended to {args.out}")
+    return 0
+
+
+def cmd_listeners(args):
+    from monitor.listeners import current_exposure, load_approved, save_approved
+    services, saved_at = current_exposure()
+    if services is None:
+        print("no listener inventory yet (is the HIDS running with LISTENERS enabled?)", file=sys.stderr)
+        return 1
+    if args.approve:
+        save_approved({(s["proto"], s["addr"], s["port"], s["exe"] or "") for s in services})
+        print(f"{len(services)} service(s) approved (a running HIDS picks this up on its next scan)")
+        return 0
+    approved = load_approved() or set()
+    for s in services:
+        s["approved"] = (s["proto"], s["addr"], s["port"], s["exe"] or "") in approved
+    if args.json:
+        print(json.dumps({"saved_at": saved_at, "services": services}, indent=2))
+        return 0
+    for s in services:
+        mark = " " if s["approved"] else "!"
+        print(f"{mark} {s['proto']:<4} {s['addr'] + ':' + str(s['port']):<28} {s['exe'] or '?'}  "
+              f"pids {','.join(map(str, s['pids'])) or '-'}")
+    unapproved = sum(1 for s in services if not s["approved"])
+    print(f"{len(services)} service(s), {unapproved} not approved")
+    return 0
+
+
+def cmd_query(args):
+    from storage.query import query, parse_bucket
+    spec = {"agg": args.agg, "since": args.since, "until": args.until, "types": args.types or None}
+    if args.agg == "counts":
+        spec["bucket"] = parse_bucket(args.bucket)
+    else:
+        if not args.field:
+            print(f"query {args.agg} needs --field (e.g. user, ip, name, remote)", file=sys.stderr)
+            return 1
+        spec["field"] = args.field
+        spec["n"] = args.n
+    report = query(spec, jobs=args.jobs)
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(report, out, indent=2)
+            out.write("\n")
+        elif args.format == "csv":
+            rows = report.get("rows") or [{"field": report["field"], "distinct": report["distinct"],
+                                           "exact": report["exact"]}]
+            w = csv.DictWriter(out, fieldnames=list(rows[0]) if rows else ["value", "count"])
+            w.writeheader()
+            w.writerows(rows)
+        elif args.agg == "distinct":
+            print(f"{report['distinct']} distinct {report['field']}"
+                  f"{'' if report['exact'] else ' (estimated)'}", file=out)
+        else:
+            for r in report["rows"]:
+                if args.agg == "counts":
+                    print(f"{r['bucket']}  {r['count']:>10}  {r['type']}", file=out)
+                else:
+                    print(f"{r['count']:>10}  {r['value']}", file=out)
+            if report.get("max_error"):
+                print(f"(counts may be low by up to {report['max_error']})", file=out)
+    finally:
+        if args.out:
+            out.close()
+    sc = report["scanned"]
+    print(f"{sc['segments']} segment(s), {sc['archives']} archive(s), {sc['jobs']} worker(s): "
+          f"{report['elapsed_s']} s", file=sys.stderr)
+    for f in sc["failed"]:
+        print(f"incomplete {f['kind']} {f['path']}: {f['error']}", file=sys.stderr)
+    if sc["failed"]:
+        print(f"{len(sc['failed'])} file(s) not fully read: results are partial", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="mini_hids", description="mini_hids tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("verify", help="verify event log integrity")
+    p.add_argument("--checkpoints", help="checkpoint file (default storage/chain_checkpoints.jsonl)")
+    p.add_argument("--json", action="store_true", help="print the full report as JSON")
+    p.set_defaults(func=cmd_verify)
+
+    p = sub.add_parser("checkpoint", help="write a signed checkpoint of all segments")
+    p.add_argument("--checkpoints", help="checkpoint file (default storage/chain_checkpoints.jsonl)")
+    p.set_defaults(func=cmd_checkpoint)
+
+    p = sub.add_parser("tail", help="follow live events from a running HIDS")
+    p.add_argument("-t", "--types", nargs="*", help="only these event types")
+    p.add_argument("--since", type=int, help="replay stored events after this id first")
+    p.add_argument("--json", action="store_true", help="print raw JSON messages")
+    p.set_defaults(func=cmd_tail)
+
+    p = sub.add_parser("collector", help="receive and store events from agents")
+    p.add_argument("--listen", default=None, help="host:port (default CLUSTER_LISTEN, loopback only; 0.0.0.0:7514 to accept remote agents)")
+    p.add_argument("--root", default="storage/collector", help="store directory for collected events")
+    p.add_argument("--no-alerts", action="store_true", help="store only, do not run the alert policy")
+    p.set_defaults(func=cmd_collector)
+
+    p = sub.add_parser("agent", help="ship stored events to a collector")
+    p.add_argument("--collector", required=True, help="collector host:port")
+    p.add_argument("--agent-id", help="agent identity (default hostname)")
+    p.add_argument("--root", help="store directory to ship from (default storage/)")
+    p.set_defaults(func=cmd_agent)
+
+    p = sub.add_parser("cluster-key", help="create (or set) the shared agent/collector key in the keyring")
+    p.add_argument("--key", help="existing key to install (urlsafe base64, 32 bytes) instead of a new one")
+    p.set_defaults(func=cmd_cluster_key)
+
+    p = sub.add_parser("set-password", help="set the trusted login password (scrypt hash)")
+    p.add_argument("--user", help="username (default: the one in assets/teacher_creds.json)")
+    p.set_defaults(func=cmd_set_password)
+
+    p = sub.add_parser("migrate-credentials", help="hash a plaintext password left in assets/teacher_creds.json")
+    p.set_defaults(func=cmd_migrate_credentials)
+
+    p = sub.add_parser("replay", help="re-run detection over historic logs, snapshots or exported events (no emails)")
+    p.add_argument("files", nargs="+", help="auth logs (.gz ok), snapshot files or event exports")
+    p.add_argument("--out", help="store replayed events in this directory (a separate store)")
+    p.add_argument("--report", help="write the JSON report to this file")
+    p.add_argument("-j", "--jobs", type=int, help="worker processes (default: all cores)")
+    p.add_argument("--chunk-mb", type=float, default=None, help="split size for plain-text inputs")
+    p.add_argument("--top", type=int, default=None, help="highest-severity alerts to keep in the report")
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    p.set_defaults(func=cmd_replay)
+
+    p = sub.add_parser("snapshot", help="append process/socket snapshots to a file for replay")
+    p.add_argument("-o", "--out", required=True, help="snapshot file (JSON lines)")
+    p.add_argument("--count", type=int, default=1)
+    p.add_argument("--interval", type=float, default=1.0, help="seconds between snapshots")
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser("listeners", help="services this host exposes, against the approved baseline")
+    p.add_argument("--approve", action="store_true", help="approve the current exposure as the baseline")
+    p.add_argument("--json", action="store_true", help="print as JSON")
+    p.set_defaults(func=cmd_listeners)
+
+    p = sub.add_parser("query", help="aggregate stored events (live segments and archives)")
+    p.add_argument("agg", choices=["counts", "top", "distinct"],
+                   help="counts: events per type per bucket; top: most frequent values; distinct: distinct values")
+    p.add_argument("-f", "--field", help="event field for top / distinct (user, ip, name, remote, event.type, ...)")
+    p.add_argument("-b", "--bucket", default="1h", help="counts bucket: 30s, 15m, 1h, 1d (default 1h)")
+    p.add_argument("-n", type=int, default=10, help="rows for top (default 10)")
+    p.add_argument("-t", "--types", nargs="*", help="only these event types")
+    p.add_argument("--since", help="ISO time, inclusive (e.g. 2024-05-01 or 2024-05-01T12:00)")
+    p.add_argument("--until", help="ISO time, exclusive")
+    p.add_argument("-j", "--jobs", type=int, help="worker processes (default: all cores)")
+    p.add_argument("--format", choices=["table", "json", "csv"], default="table")
+    p.add_argument("-o", "--out", help="write the result to this file instead of stdout")
+    p.set_defaults(func=cmd_query)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# monitor/alerting.py
+"""
+Priority queue between the sensors and the (slow) email sender.
+
+HIDS.alert() scores an event (monitor/severity.py) and pushes it here
+instead of sending inline. One worker thread always takes the
+highest-severity pending alert first, so a burst of low-severity file
+notifications can no longer delay a suspicious-process alert behind
+seconds of SMTP round trips.
+
+Each severity level has its own token-bucket budget (ALERT_BUDGETS:
+alerts per hour and burst), so low-severity noise cannot use up the
+budget of high-severity alerts. An alert over its level's budget is
+dropped (counted in hids_alerts_total{result="over_budget"}), and a
+single alert_budget_exhausted event is logged each time a budget runs
+dry. When the queue is full, the lowest-severity alert is evicted.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from config import ALERT_BUDGETS, ALERT_QUEUE_SIZE
+from monitor import severity
+from utils import metrics
+
+
+class TokenBucket:
+    def __init__(self, per_hour, burst):
+        self.rate = per_hour / 3600.0
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def take(self, now=None):
+        now = now or time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+class AlertQueue:
+    def __init__(self, sink, budgets=ALERT_BUDGETS, maxsize=ALERT_QUEUE_SIZE, on_exhausted=None):
+        self.sink = sink
+        self.maxsize = int(maxsize)
+        self.on_exhausted = on_exhausted
+        self.buckets = {lvl: (TokenBucket(*b) if b else None) for lvl, b in budgets.items()}
+        self._exhausted = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def submit(self, ev):
+        """Queue an alert; returns False if it was dropped to make room or for being lowest."""
+        s = severity.score(ev)
+        item = (-s, next(self._seq), ev)
+        with self._cond:
+            if len(self._heap) >= self.maxsize:
+                lowest = max(range(len(self._heap)), key=lambda i: (self._heap[i][0], self._heap[i][1]))
+                if self._heap[lowest][0] <= item[0]:
+                    metrics.inc("hids_alerts_total", labels={"result": "evicted"})
+                    return False
+                self._heap[lowest] = self._heap[-1]
+                self._heap.pop()
+                heapq.heapify(self._heap)
+                metrics.inc("hids_alerts_total", labels={"result": "evicted"})
+            heapq.heappush(self._heap, item)
+            metrics.set_gauge("hids_alert_queue_depth", len(self._heap))
+            self._cond.notify()
+        self._ensure_worker()
+        return True
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._cond:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, daemon=True)
+                    self._worker.start()
+
+    def _allowed(self, lvl):
+        bucket = self.buckets.get(lvl)
+        if bucket is None:
+            return True
+        if bucket.take():
+            self._exhausted.discard(lvl)
+            return True
+        if lvl not in self._exhausted:
+            self._exhausted.add(lvl)
+            if self.on_exhausted:
+                try:
+                    self.on_exhausted(lvl)
+                except Exception:
+                    pass
+        return False
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._stopping:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                neg, _, ev = heapq.heappop(self._heap)
+                metrics.set_gauge("hids_alert_queue_depth", len(self._heap))
+            lvl = severity.level(-neg)
+            if not self._allowed(lvl):
+                metrics.inc("hids_alerts_total", labels={"result": "over_budget", "level": lvl})
+                continue
+            metrics.inc("hids_alerts_total", labels={"result": "dispatched", "level": lvl})
+            try:
+                self.sink(ev)
+            except Exception:
+                pass
+
+    def drain(self, timeout=5.0):
+        """Wait for queued alerts to be dispatched (shutdown, tests)."""
+        deadline = time.time() + timeout
+        while self._heap and time.time() < deadline:
+            time.sleep(0.05)
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
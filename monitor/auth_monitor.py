@@ -1,61 +1,227 @@
-from utils.emailer import send_email
+# monitor/auth_monitor.py
+"""
+Login check for the trusted (teacher) account.
+
+- The password is stored only as a salted scrypt hash in
+  assets/auth_credentials.json (owner-only, 0600), written by
+  `mini_hids set-password`. An old install whose teacher_creds.json still
+  holds a plaintext password is converted once with
+  `mini_hids migrate-credentials`; the monitor never rewrites it itself.
+- Username and password are checked in constant time, and an unknown
+  username costs the same KDF work as a known one.
+- Failures are throttled per user and per source IP with exponential
+  delays, tracked in a bounded LRU table. A throttled attempt is rejected
+  before any hashing, logging or email.
+- Failed attempts are handed to a background worker (bounded queue), so
+  the login path never waits on the database or SMTP. Emails never
+  contain the entered password.
+- With no password set every attempt fails. That is a setup problem,
+  not an attack: auth_not_configured is logged once and nothing is
+  mailed. The store is re-read on those attempts, so a password set
+  with `mini_hids set-password` takes effect without a restart.
+"""
+
+import hmac
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from config import AUTH_CREDENTIALS_PATH, AUTH_THROTTLE, AUTH_QUEUE_SIZE
+from monitor.policy import CREDS_PATH
 from storage.db import add_event
-from utils.helpers import now_iso
+from utils.crypto_utils import hash_password, verify_password
+from utils.emailer import send_email
+from utils.helpers import now_iso, read_json, write_json, write_private_json
+from utils import metrics
+
+
+def load_credential_store(path=AUTH_CREDENTIALS_PATH):
+    """{"username": ..., "password": <hash_password record>}, or None if no password is set."""
+    store = read_json(path, default=None)
+    if store and store.get("password"):
+        return store
+    return None
+
+
+def set_password(username, password, path=AUTH_CREDENTIALS_PATH):
+    store = {"username": username, "password": hash_password(password)}
+    write_private_json(path, store)
+    return store
+
+
+def migrate_credentials(path=AUTH_CREDENTIALS_PATH, creds_path=CREDS_PATH):
+    """
+    One-off: hash a plaintext password left in teacher_creds.json and remove
+    it from that file. Returns the username migrated, or None if there was none.
+    """
+    creds = read_json(creds_path, default={}) or {}
+    user = (creds.get("username") or "").strip()
+    if not user or not creds.get("password"):
+        return None
+    set_password(user, creds.pop("password"), path)
+    write_json(creds_path, creds)
+    return user
+
+
+class Throttle:
+    """Exponential backoff per key in a bounded LRU table."""
+
+    def __init__(self, free_attempts=3, base_delay=1.0, max_delay=300.0, table_size=4096):
+        self.free = int(free_attempts)
+        self.base = float(base_delay)
+        self.max = float(max_delay)
+        self.size = int(table_size)
+        self._t = OrderedDict()   # key -> [failures, blocked_until]
+        self._lock = threading.Lock()
+
+    def blocked(self, keys, now=None):
+        """Seconds left until every key may try again (0 = allowed)."""
+        now = now or time.time()
+        wait = 0.0
+        with self._lock:
+            for k in keys:
+                e = self._t.get(k)
+                if e is not None and e[1] > now:
+                    wait = max(wait, e[1] - now)
+        return wait
+
+    def failure(self, keys, now=None):
+        """Record a failure; returns True if this started a delay for any key."""
+        now = now or time.time()
+        started = False
+        with self._lock:
+            for k in keys:
+                e = self._t.pop(k, None) or [0, 0.0]
+                e[0] += 1
+                if e[0] > self.free:
+                    e[1] = now + min(self.base * 2 ** (e[0] - self.free - 1), self.max)
+                    started = started or e[0] == self.free + 1
+                self._t[k] = e
+            while len(self._t) > self.size:
+                self._t.popitem(last=False)
+        return started
+
+    def success(self, keys):
+        with self._lock:
+            for k in keys:
+                self._t.pop(k, None)
 
-TRUSTED_USER = "teacher"        # allowed username
-TRUSTED_PASSWORD = "teacher123" # allowed password
 
 class AuthMonitor:
-    def __init__(self):
-        pass
+    def __init__(self, throttle=None):
+        self.store = load_credential_store()
+        if self.store is None:
+            add_event({"ts": now_iso(), "type": "auth_credentials_missing",
+                       "hint": "run `mini_hids set-password` (or `mini_hids migrate-credentials`)"})
+        # same KDF cost for unknown users as for the real one
+        self._dummy = hash_password("mini_hids-dummy")
+        self.throttle = throttle or Throttle(**AUTH_THROTTLE)
+        self._q = queue.Queue(AUTH_QUEUE_SIZE)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self._not_configured_logged = False
+
+    # background writer for failed attempts
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._drain, daemon=True)
+                    self._worker.start()
+
+    def _drain(self):
+        while True:
+            ev, mail = self._q.get()
+            try:
+                add_event(ev)
+                if mail:
+                    send_email(*mail[:2], rate_key=mail[2], rate_seconds=20)
+            except Exception:
+                pass
+            finally:
+                self._q.task_done()
+
+    def _submit(self, ev, mail=None):
+        self._ensure_worker()
+        try:
+            self._q.put_nowait((ev, mail))
+        except queue.Full:
+            metrics.inc("hids_auth_events_dropped_total")
+
+    def flush(self, timeout=5.0):
+        """Wait until queued attempts are written (tests, shutdown)."""
+        deadline = time.time() + timeout
+        while self._q.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _verify(self, username, password):
+        store = self.store
+        if not store:
+            store = self.store = load_credential_store()
+        if not store:
+            verify_password(password, self._dummy)
+            return False, "no_credentials"
+        user_ok = hmac.compare_digest(username.encode(), store["username"].encode())
+        pw_ok = verify_password(password, store["password"] if user_ok else self._dummy)
+        if not user_ok:
+            return False, "unknown_user"
+        return pw_ok, None if pw_ok else "wrong_password"
 
     def check_login(self, username, password, source_ip="127.0.0.1"):
         """Check login attempts and trigger alerts."""
 
         ts = now_iso()
+        keys = (("user", username), ("ip", source_ip))
 
-        # Wrong username 
-        if username != TRUSTED_USER:
-            add_event({"ts": ts, "type": "login_failed", "reason": "unknown_user", "user": username})
-            send_email(
-                "ALERT: Unknown Username Login Attempt",
-                f"Suspicious login attempt detected.\n"
-                f"User: {username}\n"
-                f"Password Entered: {password}\n"
-                f"IP: {source_ip}\n"
-                f"Time: {ts}",
-                rate_key="unknown_user_alert",
-                rate_seconds=20
-            )
+        # Throttled: reject without hashing, logging or mailing
+        if self.throttle.blocked(keys):
+            metrics.inc("hids_auth_attempts_total", labels={"result": "throttled"})
             return False
 
-        #Wrong password
-        if password != TRUSTED_PASSWORD:
-            add_event({"ts": ts, "type": "login_failed", "reason": "wrong_password", "user": username})
-            send_email(
-                "ALERT: Wrong Password Attempt",
-                f"User: {username}\n"
-                f"Wrong password entered: {password}\n"
-                f"IP: {source_ip}\n"
-                f"Time: {ts}",
-                rate_key="wrong_password_alert",
-                rate_seconds=20
-            )
+        ok, reason = self._verify(username, password)
+
+        if not ok:
+            metrics.inc("hids_auth_attempts_total", labels={"result": reason})
+            if reason == "no_credentials":
+                # nobody can log in until a password is set: say so once, no per-attempt mail
+                self.throttle.failure(keys)
+                if not self._not_configured_logged:
+                    self._not_configured_logged = True
+                    self._submit({"ts": ts, "type": "auth_not_configured", "user": username, "ip": source_ip,
+                                  "hint": "run `mini_hids set-password` (or `mini_hids migrate-credentials`)"})
+                return False
+            if self.throttle.failure(keys):
+                self._submit({"ts": ts, "type": "login_throttled", "user": username, "ip": source_ip})
+            if reason == "unknown_user":
+                mail = ("ALERT: Unknown Username Login Attempt",
+                        f"Suspicious login attempt detected.\n"
+                        f"User: {username}\n"
+                        f"IP: {source_ip}\n"
+                        f"Time: {ts}",
+                        "unknown_user_alert")
+            else:
+                mail = ("ALERT: Wrong Password Attempt",
+                        f"User: {username}\n"
+                        f"IP: {source_ip}\n"
+                        f"Time: {ts}",
+                        "wrong_password_alert")
+            self._submit({"ts": ts, "type": "login_failed", "reason": reason, "user": username, "ip": source_ip}, mail)
             return False
 
+        self.throttle.success(keys)
+        metrics.inc("hids_auth_attempts_total", labels={"result": "success"})
+
         #Suspicious login even for correct user
         if source_ip not in ["127.0.0.1", "localhost"]:
-            add_event({"ts": ts, "type": "login_suspicious_ip", "user": username, "ip": source_ip})
-            send_email(
-                "ALERT: Suspicious Login IP",
-                f"User: {username}\n"
-                f"Logged in from: {source_ip}\n"
-                f"Time: {ts}",
-                rate_key="ip_alert",
-                rate_seconds=20
-            )
+            self._submit({"ts": ts, "type": "login_suspicious_ip", "user": username, "ip": source_ip},
+                         ("ALERT: Suspicious Login IP",
+                          f"User: {username}\n"
+                          f"Logged in from: {source_ip}\n"
+                          f"Time: {ts}",
+                          "ip_alert"))
 
         # Trusted teacher login (NO EMAIL)
         add_event({"ts": ts, "type": "login_success", "user": username})
         return True
-
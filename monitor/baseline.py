@@ -0,0 +1,155 @@
+# monitor/baseline.py
+"""
+Process baseline: what normally runs on this host, and as whom.
+
+Every process start ProcNetMonitor sees is counted twice in one decaying
+count-min sketch (monitor/sketches.py):
+
+    host key   (process name, parent name, exe)
+    user key   (user, process name, parent name, exe)
+
+Counts halve every PROC_BASELINE["half_life_days"], so something that ran
+daily a month ago and never since becomes rare again. The sketch is a
+fixed few hundred KB whatever the number of distinct processes, and is
+saved next to the event store (PROC_BASELINE["file"] beside segments/)
+so the baseline survives restarts.
+
+Once the baseline has seen PROC_BASELINE["warmup_starts"] starts:
+
+- a start whose host or user count is below "rare_below" produces a
+  process_rare event (scope "host" or "user")
+- a start whose user count is at least "frequent_above" is not stored as
+  its own process_start row; it is folded into a process_start_summary
+  (count, first_ts, last_ts per combination) written every
+  "summary_interval" seconds. Cron jobs and CI runners that start the
+  same tools thousands of times a day then cost a row per interval.
+"""
+
+import os
+import time
+
+from config import PROC_BASELINE
+from monitor.sketches import CountMinSketch
+from storage import db
+from utils.helpers import now_iso, ensure_dir
+from utils import metrics
+
+RARE, FREQUENT = "rare", "frequent"
+_TOTAL = b"\0total"   # sentinel key: decayed number of starts seen
+
+
+def default_path():
+    """PROC_BASELINE["file"] in the store's directory (follows db.set_storage_root)."""
+    return os.path.join(db.store_dir(), PROC_BASELINE["file"])
+
+
+class ProcessBaseline:
+    def __init__(self, cfg=PROC_BASELINE, path=None):
+        self.cfg = cfg
+        self.path = path or default_path()
+        self.sketch = None
+        self._summary = {}   # (user, name, parent, exe) -> [count, first_ts, last_ts]
+        self._summary_since = time.time()
+        self._dirty = False
+        self._saved_at = time.time()
+        self.load()
+
+    def __len__(self):
+        return len(self._summary)
+
+    # persistence
+
+    def _new_sketch(self):
+        return CountMinSketch(self.cfg["width"], self.cfg["depth"], self.cfg["half_life_days"] * 86400.0)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                sk = CountMinSketch.from_bytes(f.read())
+            if (sk.width, sk.depth) != (self.cfg["width"], self.cfg["depth"]):
+                raise ValueError("sketch size changed")
+            sk.half_life = self.cfg["half_life_days"] * 86400.0
+            self.sketch = sk
+            return True
+        except Exception:   # missing, truncated or resized: start a fresh baseline
+            self.sketch = self._new_sketch()
+            return False
+
+    def save(self, force=False):
+        """Atomic replace of the sketch file, if anything was counted since the last save."""
+        if not (self._dirty or force):
+            return False
+        data = self.sketch.to_bytes()
+        self._dirty = False
+        ensure_dir(self.path)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+        self._saved_at = time.time()
+        return True
+
+    def maybe_save(self, interval=PROC_BASELINE["save_interval"]):
+        if self._dirty and time.time() - self._saved_at >= interval:
+            try:
+                self.save()
+            except OSError:
+                pass
+
+    # counting
+
+    def observe(self, user, name, parent, exe, now=None):
+        """Count one start; (RARE / FREQUENT / None, scope, host count, user count) as seen before it."""
+        now = now or time.time()
+        sk = self.sketch
+        name, parent, exe, user = name or "", parent or "", exe or "", user or ""
+        host_n = sk.add(f"h\0{name}\0{parent}\0{exe}", now) - 1.0
+        user_n = sk.add(f"u\0{user}\0{name}\0{parent}\0{exe}", now) - 1.0
+        total = sk.add(_TOTAL, now)
+        self._dirty = True
+        if total < self.cfg["warmup_starts"]:
+            return None, None, host_n, user_n
+        rare = self.cfg["rare_below"]
+        if host_n < rare:
+            metrics.inc("hids_proc_baseline_total", labels={"result": "rare_host"})
+            return RARE, "host", host_n, user_n
+        if user_n < rare:
+            metrics.inc("hids_proc_baseline_total", labels={"result": "rare_user"})
+            return RARE, "user", host_n, user_n
+        if user_n >= self.cfg["frequent_above"]:
+            metrics.inc("hids_proc_baseline_total", labels={"result": "frequent"})
+            return FREQUENT, None, host_n, user_n
+        return None, None, host_n, user_n
+
+    # summaries of frequent starts
+
+    def fold(self, ev):
+        """Count a frequent process_start into its summary row instead of storing it; returns flushed summaries."""
+        key = (ev.get("user") or "", ev.get("name") or "", ev.get("parent") or "", ev.get("exe") or "")
+        ts = ev.get("ts") or now_iso()
+        row = self._summary.get(key)
+        if row is None:
+            if len(self._summary) >= self.cfg["summary_max_keys"]:
+                out = self.flush()
+                self._summary[key] = [1, ts, ts]
+                return out
+            self._summary[key] = [1, ts, ts]
+        else:
+            row[0] += 1
+            row[2] = ts
+        return []
+
+    def due(self, now=None):
+        """Summary events if the summary interval has passed."""
+        now = now or time.time()
+        if now - self._summary_since < self.cfg["summary_interval"]:
+            return []
+        return self.flush(now)
+
+    def flush(self, now=None):
+        out = [{"ts": now_iso(), "type": "process_start_summary", "user": k[0], "name": k[1],
+                "parent": k[2], "exe": k[3] or None, "count": c, "first_ts": first, "last_ts": last}
+               for k, (c, first, last) in self._summary.items()]
+        self._summary = {}
+        self._summary_since = now or time.time()
+        return out
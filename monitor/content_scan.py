@@ -0,0 +1,312 @@
+# monitor/content_scan.py
+"""
+Content signature scanning for files created or changed under MONITOR_PATHS.
+
+Signatures come from rules.json "content_signatures":
+
+    {"name": "reverse_shell_bash", "string": "bash -i >& /dev/tcp/"}
+    {"name": "some_stub", "hex": "d9 ee d9 74 24 f4"}
+
+All of them are compiled once into one Aho-Corasick automaton, so a file
+is checked against every signature in a single pass. Files are read in
+chunks (CONTENT_SCAN["chunk_kb"]) and the automaton state carries across
+chunk boundaries. Only the first CONTENT_SCAN["max_file_mb"] of a file
+are scanned (the event then says truncated).
+
+file_monitor queues paths and a few worker threads take them off the
+queue. A path already waiting in the queue is not queued again, so a
+file being written does not pile up scans. Results are cached by
+(device, inode, size, mtime), so a file that has not changed since it
+was last scanned is not read again. A match is stored and alerted as a
+file_signature_match event.
+
+The automaton is pure Python and holds the GIL while it runs, so threads
+alone scan one file at a time and slow the rest of the HIDS down. Cache
+misses are therefore read and matched in a process pool
+(CONTENT_SCAN["processes"], each process builds its own automaton once).
+The threads only stat, check the cache and report. With processes = 0,
+or if the pool breaks, the threads scan the files themselves.
+"""
+
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import CONTENT_SCAN
+from monitor.rules import load_rules
+from storage.db import add_event
+from utils.helpers import now_iso
+from utils import metrics
+
+
+def load_signatures(rules=None):
+    """[(name, bytes)] from rules.json; malformed entries are skipped."""
+    out = []
+    for i, sig in enumerate((rules or load_rules())["content_signatures"]):
+        try:
+            if "hex" in sig:
+                pat = bytes.fromhex(sig["hex"])
+            else:
+                pat = sig["string"].encode("utf-8")
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+        if pat:
+            out.append((sig.get("name") or f"signature_{i}", pat))
+    return out
+
+
+class Automaton:
+    """Aho-Corasick automaton over bytes: goto tables, failure links and outputs per state."""
+
+    MAX_EDGES = 64   # resolved transitions remembered per state (bounds memory on binary input)
+
+    def __init__(self, signatures):
+        self.names = [name for name, _ in signatures]
+        goto, fail, out = [{}], [0], [()]
+        for idx, (_, pat) in enumerate(signatures):
+            s = 0
+            for b in pat:
+                nxt = goto[s].get(b)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][b] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    out.append(())
+                s = nxt
+            out[s] += (idx,)
+        q = deque(goto[0].values())
+        while q:
+            s = q.popleft()
+            for b, t in goto[s].items():
+                q.append(t)
+                f = fail[s]
+                while f and b not in goto[f]:
+                    f = fail[f]
+                fail[t] = goto[f].get(b, 0) if s else 0
+                out[t] += out[fail[t]]
+        self.goto, self.fail, self.out = goto, fail, out
+        # in the root state, skip ahead (in C) to the next byte that can start a signature
+        firsts = sorted(goto[0])
+        self._first = re.compile(b"[" + b"".join(re.escape(bytes([b])) for b in firsts) + b"]") if firsts else None
+
+    def _resolve(self, state, b):
+        """Transition via failure links; remembered on the state (turning it into a DFA lazily)."""
+        goto, fail = self.goto, self.fail
+        s = state
+        while s and b not in goto[s]:
+            s = fail[s]
+        nxt = goto[s].get(b, 0)
+        if len(goto[state]) < self.MAX_EDGES:
+            goto[state][b] = nxt
+        return nxt
+
+    def feed(self, data, state, found):
+        """Advance over data from state, adding matched signature indexes to found. Returns the new state."""
+        goto, out, first = self.goto, self.out, self._first
+        if first is None:
+            return 0
+        i, n = 0, len(data)
+        while i < n:
+            if not state:
+                m = first.search(data, i)
+                if m is None:
+                    return 0
+                i = m.start()
+            b = data[i]
+            nxt = goto[state].get(b)
+            if nxt is None:
+                nxt = self._resolve(state, b)
+            state = nxt
+            if out[state]:
+                found.update(out[state])
+            i += 1
+        return state
+
+    def scan(self, data):
+        found = set()
+        self.feed(data, 0, found)
+        return sorted(self.names[i] for i in found)
+
+
+def match_file(automaton, path, max_bytes, chunk):
+    """(sorted matched signature names, bytes read) for the first max_bytes of path."""
+    found, state, read = set(), 0, 0
+    with open(path, "rb") as f:
+        while read < max_bytes:
+            data = f.read(min(chunk, max_bytes - read))
+            if not data:
+                break
+            read += len(data)
+            state = automaton.feed(data, state, found)
+    return sorted(automaton.names[i] for i in found), read
+
+
+# scanner processes
+
+_proc = {"automaton": None}
+
+
+def _init_process(signatures):
+    _proc["automaton"] = Automaton(signatures)
+
+
+def _match_in_process(path, max_bytes, chunk):
+    return match_file(_proc["automaton"], path, max_bytes, chunk)
+
+
+def _mp_context():
+    # the HIDS is multi-threaded: do not fork it, fork a clean server process instead
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class ContentScanner:
+    def __init__(self, signatures=None, alert_callback=None, workers=CONTENT_SCAN["workers"],
+                 max_bytes=int(CONTENT_SCAN["max_file_mb"] * 1024 * 1024),
+                 chunk=CONTENT_SCAN["chunk_kb"] * 1024, cache_size=CONTENT_SCAN["cache_size"],
+                 queue_size=CONTENT_SCAN["queue_size"], processes=CONTENT_SCAN.get("processes", 0)):
+        self.signatures = load_signatures() if signatures is None else signatures
+        self.automaton = Automaton(self.signatures)
+        self.alert_callback = alert_callback
+        self.workers = int(workers)
+        self.processes = int(processes)
+        self._pool = None
+        self.max_bytes = int(max_bytes)
+        self.chunk = int(chunk)
+        self.cache_size = int(cache_size)
+        self._cache = OrderedDict()   # (dev, ino, size, mtime_ns) -> [signature names]
+        self._cache_lock = threading.Lock()
+        self._q = queue.Queue(queue_size)
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._threads = []
+
+    def __len__(self):
+        return len(self.automaton.names)
+
+    def start(self):
+        if self.processes > 0 and self.signatures:
+            from concurrent.futures import ProcessPoolExecutor
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=_mp_context(),
+                                             initializer=_init_process, initargs=(self.signatures,))
+        # one thread per process at least, so every process can have a file in flight
+        for _ in range(max(1, self.workers, self.processes if self._pool else 0)):
+            t = threading.Thread(target=self._work, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        for _ in self._threads:
+            try:
+                self._q.put_nowait(None)
+            except queue.Full:
+                pass
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _match(self, path):
+        pool = self._pool
+        if pool is not None:
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                return pool.submit(_match_in_process, path, self.max_bytes, self.chunk).result()
+            except BrokenProcessPool:
+                # a scanner process died (OOM killer, ...): carry on in the threads
+                metrics.inc("hids_content_scan_files_total", labels={"result": "pool_broken"})
+                if self._pool is pool:
+                    self._pool = None
+                    pool.shutdown(wait=False, cancel_futures=True)
+            except RuntimeError:
+                pass   # stop() shut the pool down meanwhile
+        return match_file(self.automaton, path, self.max_bytes, self.chunk)
+
+    def submit(self, path, policy_tag=None):
+        """Queue a path (no-op if it is already waiting)."""
+        with self._queued_lock:
+            if path in self._queued:
+                return False
+            self._queued.add(path)
+        try:
+            self._q.put_nowait((path, policy_tag))
+        except queue.Full:
+            with self._queued_lock:
+                self._queued.discard(path)
+            metrics.inc("hids_content_scan_files_total", labels={"result": "dropped"})
+            return False
+        return True
+
+    def join(self, timeout=10.0):
+        """Wait for queued scans to finish (tests, replay)."""
+        deadline = time.time() + timeout
+        while self._q.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def _work(self):
+        while True:
+            item = self._q.get()
+            try:
+                if item is None:
+                    return
+                path, tag = item
+                with self._queued_lock:
+                    self._queued.discard(path)
+                self._scan_and_report(path, tag)
+            except Exception:
+                metrics.inc("hids_content_scan_files_total", labels={"result": "error"})
+            finally:
+                self._q.task_done()
+
+    def scan_file(self, path):
+        """(matched signature names, stat result, truncated, cached); unchanged files come from the cache."""
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._cache_lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+        if hit is not None:
+            metrics.inc("hids_content_scan_files_total", labels={"result": "cached"})
+            return hit, st, False, True
+        t0 = time.perf_counter()
+        names, read = self._match(path)
+        metrics.observe("hids_content_scan_seconds", time.perf_counter() - t0)
+        metrics.inc("hids_content_scan_bytes_total", read)
+        metrics.inc("hids_content_scan_files_total", labels={"result": "match" if names else "clean"})
+        with self._cache_lock:
+            # another worker may have scanned the same version meanwhile (file written twice quickly)
+            cached = key in self._cache
+            self._cache[key] = names
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return names, st, st.st_size > read, cached
+
+    def _scan_and_report(self, path, tag=None):
+        try:
+            names, st, truncated, cached = self.scan_file(path)
+        except (FileNotFoundError, IsADirectoryError, PermissionError):
+            return None
+        if not names or cached:   # unchanged since it was last reported
+            return None
+        ev = {"ts": now_iso(), "type": "file_signature_match", "path": path,
+              "signatures": names, "size": st.st_size}
+        if truncated:
+            ev["truncated"] = True
+        if tag:
+            ev["policy"] = tag
+        try:
+            add_event(ev)
+        except Exception:
+            pass
+        if self.alert_callback and not tag:
+            try:
+                self.alert_callback(ev)
+            except Exception:
+                pass
+        return ev
@@ -0,0 +1,181 @@
+# monitor/exe_hash.py
+"""
+Executable hash verification for new processes.
+
+A process name is whatever the binary was called, so renaming nc
+defeats suspicious_processes. ProcNetMonitor therefore hashes the file
+behind /proc/<pid>/exe (sha256, utils.helpers.sha256_file) and checks it
+against known-bad and known-good sets:
+
+    rules.json   "known_bad_sha256": [...], "known_good_sha256": [...]
+    EXE_HASH     "known_bad_files" / "known_good_files": text files with
+                 one hash per line (threat-intel exports); '#' starts a comment
+
+The process_start event gets "exe", "sha256" and "hash_verdict"
+(known_bad / known_good / unknown). A known-bad hash also produces a
+known_bad_executable event that is alerted even if a policy rule trusts
+the path or name: the hash is stronger evidence than either.
+
+Hashes are cached by (device, inode, mtime, ctime, size) of the
+executable in a bounded LRU (EXE_HASH["cache_size"]) that is saved to
+EXE_HASH["cache_path"] and loaded on the next start, so the many
+short-lived ls/grep/... processes on a busy host cost one stat and one
+dict lookup each. A binary that is replaced or modified gets a new key
+and is hashed again. mtime can be set back with utime(), ctime cannot,
+so a rewrite that restores mtime and size still misses the cache; the
+stale entry for that inode is dropped when the new one is stored.
+Cache files written before ctime was part of the key are ignored. Binaries larger than EXE_HASH["max_mb"] are not
+hashed.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from config import EXE_HASH
+from monitor.rules import load_rules
+from utils.helpers import sha256_file, ensure_dir
+from utils import metrics
+
+KNOWN_BAD, KNOWN_GOOD, UNKNOWN = "known_bad", "known_good", "unknown"
+_PROC = os.path.isdir("/proc/self")
+
+
+def read_hash_files(paths):
+    out = set()
+    for p in paths or []:
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                for line in f:
+                    h = line.split("#", 1)[0].strip().lower()
+                    if len(h) == 64:
+                        out.add(h)
+        except OSError:
+            continue
+    return out
+
+
+class ExeHasher:
+    def __init__(self, cache_path=EXE_HASH["cache_path"], cache_size=EXE_HASH["cache_size"],
+                 max_bytes=int(EXE_HASH["max_mb"] * 1024 * 1024), rules=None):
+        self.cache_path = cache_path
+        self.cache_size = int(cache_size)
+        self.max_bytes = int(max_bytes)
+        self._cache = OrderedDict()   # (dev, ino, mtime_ns, ctime_ns, size) -> sha256
+        self._inodes = {}             # (dev, ino) -> its current cache key
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.time()
+        r = rules or load_rules()
+        self.bad = {h.lower() for h in r["known_bad_sha256"]} | read_hash_files(EXE_HASH["known_bad_files"])
+        self.good = {h.lower() for h in r["known_good_sha256"]} | read_hash_files(EXE_HASH["known_good_files"])
+        self.load()
+
+    def __len__(self):
+        return len(self._cache)
+
+    # persistence
+
+    def load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entries = data.get("entries", []) if data.get("version") == 2 else []
+        except (OSError, ValueError, AttributeError):
+            return 0
+        with self._lock:
+            for e in entries[-self.cache_size:]:
+                try:
+                    dev, ino, mtime, ctime, size, sha = e
+                except (TypeError, ValueError):
+                    continue
+                self._put((dev, ino, mtime, ctime, size), sha)
+        return len(self._cache)
+
+    def save(self, force=False):
+        """Write the cache (least recently used first) if it changed; atomic replace."""
+        if not (self._dirty or force):
+            return False
+        with self._lock:
+            entries = [[*k, v] for k, v in self._cache.items()]
+            self._dirty = False
+        ensure_dir(self.cache_path)
+        tmp = self.cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 2, "entries": entries}, f, separators=(",", ":"))
+        os.replace(tmp, self.cache_path)
+        self._saved_at = time.time()
+        return True
+
+    def maybe_save(self, interval=EXE_HASH["save_interval"]):
+        if self._dirty and time.time() - self._saved_at >= interval:
+            try:
+                self.save()
+            except OSError:
+                pass
+
+    # hashing
+
+    def _put(self, key, sha):
+        # one entry per inode: an older key for it has a stale ctime or mtime
+        old = self._inodes.get(key[:2])
+        if old is not None and old != key:
+            self._cache.pop(old, None)
+        self._inodes[key[:2]] = key
+        self._cache[key] = sha
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            k, _ = self._cache.popitem(last=False)
+            if self._inodes.get(k[:2]) == k:
+                del self._inodes[k[:2]]
+
+    def hash_path(self, path):
+        """sha256 of path, from the cache while (dev, inode, mtime, ctime, size) is unchanged; None if too large."""
+        st = os.stat(path)
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size)
+        with self._lock:
+            sha = self._cache.get(key)
+            if sha is not None:
+                self._cache.move_to_end(key)
+        if sha is not None:
+            metrics.inc("hids_exe_hash_total", labels={"result": "cache_hit"})
+            return sha
+        if st.st_size > self.max_bytes:
+            metrics.inc("hids_exe_hash_total", labels={"result": "too_large"})
+            return None
+        t0 = time.perf_counter()
+        sha = sha256_file(path)
+        metrics.observe("hids_exe_hash_seconds", time.perf_counter() - t0)
+        metrics.inc("hids_exe_hash_total", labels={"result": "hashed"})
+        with self._lock:
+            self._put(key, sha)
+            self._dirty = True
+        return sha
+
+    def verdict(self, sha):
+        if sha in self.bad:
+            return KNOWN_BAD
+        if sha in self.good:
+            return KNOWN_GOOD
+        return UNKNOWN
+
+    def check(self, pid, exe_path=None):
+        """{"exe", "sha256", "hash_verdict"} for a running process; {} if it is gone or unreadable."""
+        try:
+            if _PROC:
+                link = f"/proc/{pid}/exe"
+                exe = os.readlink(link)
+            else:
+                link = exe = exe_path
+            if not link:
+                return {}
+            # /proc/<pid>/exe still opens the binary if it was deleted after starting
+            sha = self.hash_path(link)
+        except (OSError, ValueError):
+            metrics.inc("hids_exe_hash_total", labels={"result": "error"})
+            return {}
+        if sha is None:
+            return {"exe": exe}
+        return {"exe": exe, "sha256": sha, "hash_verdict": self.verdict(sha)}
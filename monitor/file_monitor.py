@@ -1,11 +1,9 @@
 # monitor/file_monitor.py
 import os
-import time
-import threading
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 from storage.db import add_event
+from monitor import policy
 from utils.helpers import now_iso
+from config import CONTENT_SCAN
 
 # global callback to send alerts
 _alert_callback = None
@@ -15,80 +13,84 @@ def set_alert_callback(cb):
     global _alert_callback
     _alert_callback = cb
 
-class _FileHandler(FileSystemEventHandler):
-    def __init__(self):
-        super().__init__()
+class _FileHandler:
+    """
+    watchdog event handler. It implements dispatch() itself instead of
+    subclassing FileSystemEventHandler, so importing this module does not
+    import watchdog (that happens in start_file_monitor).
+    """
 
-    def on_created(self, event):
-        if event.is_directory:
-            return
+    def __init__(self, emit=None, alert_callback=None, scanner=None):
+        # offline replay (monitor/replay.py) passes its own sink and callback
+        self.emit = emit or add_event
+        self.alert_callback = alert_callback
+        self.scanner = scanner   # monitor/content_scan.py, for created/modified files
+
+    def dispatch(self, event):
+        handler = getattr(self, "on_" + event.event_type, None)
+        if handler is not None:
+            handler(event)
+
+    def _emit(self, etype, path, ts=None, user=None):
         ev = {
-            "ts": now_iso(),
-            "type": "file_created",
-            "path": event.src_path,
-            "user": os.getenv("USER") or ""
+            "ts": ts or now_iso(),
+            "type": etype,
+            "path": path,
+            "user": (os.getenv("USER") or "") if user is None else user
         }
+        action = policy.apply(ev)
+        if action == policy.SUPPRESS:
+            return
         try:
-            add_event(ev)
+            self.emit(ev)
         except Exception:
             pass
-        if _alert_callback:
+        if self.scanner and etype != "file_deleted":
+            self.scanner.submit(path, ev.get("policy"))
+        cb = self.alert_callback or _alert_callback
+        if cb and action is None:
             try:
-                _alert_callback(ev)
+                cb(ev)
             except Exception:
                 pass
 
+    def on_created(self, event):
+        if event.is_directory:
+            return
+        self._emit("file_created", event.src_path)
+
     def on_modified(self, event):
         if event.is_directory:
             return
-        ev = {
-            "ts": now_iso(),
-            "type": "file_modified",
-            "path": event.src_path,
-            "user": os.getenv("USER") or ""
-        }
-        try:
-            add_event(ev)
-        except Exception:
-            pass
-        if _alert_callback:
-            try:
-                _alert_callback(ev)
-            except Exception:
-                pass
+        self._emit("file_modified", event.src_path)
 
     def on_deleted(self, event):
         if event.is_directory:
             return
-        ev = {
-            "ts": now_iso(),
-            "type": "file_deleted",
-            "path": event.src_path,
-            "user": os.getenv("USER") or ""
-        }
-        try:
-            add_event(ev)
-        except Exception:
-            pass
-        if _alert_callback:
-            try:
-                _alert_callback(ev)
-            except Exception:
-                pass
+        self._emit("file_deleted", event.src_path)
 
 def start_file_monitor(paths):
     """
     Start monitoring the given list of paths.
-    Returns a watchdog Observer object (you can stop it later with observer.stop())
+    Returns a watchdog Observer object (you can stop it later with observer.stop();
+    observer.scanner, if not None, is the content scanner to stop with it)
     """
+    from watchdog.observers import Observer
     if not isinstance(paths, list):
         paths = [paths]
 
-    event_handler = _FileHandler()
+    scanner = None
+    if CONTENT_SCAN["enabled"]:
+        from monitor.content_scan import ContentScanner
+        scanner = ContentScanner(alert_callback=lambda ev: _alert_callback and _alert_callback(ev))
+        scanner = scanner.start() if len(scanner) else None
+
+    event_handler = _FileHandler(scanner=scanner)
     observer = Observer()
     for p in paths:
         if os.path.exists(p):
             observer.schedule(event_handler, p, recursive=True)
     observer.start()
+    observer.scanner = scanner   # stopped with the observer (scanner processes)
     return observer
 
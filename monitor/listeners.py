@@ -0,0 +1,229 @@
+# monitor/listeners.py
+"""
+Listener inventory: which services this host exposes.
+
+NetMonitor sees listening sockets as (pid, local address). Workers that
+are recycled, or a service restarting, give the same service a new pid,
+so the inventory keys services by what is exposed instead:
+
+    (proto, addr, port, exe)
+
+and counts the sockets behind each key. Sockets are added and removed
+incrementally from NetMonitor's snapshot diff. A service that loses its
+last socket is kept for LISTENERS["grace"] seconds, so a restart does not
+look like a close followed by an open. listener_drift events are emitted
+only when the set of exposed services changes:
+
+    {"type": "listener_drift", "change": "added" | "removed",
+     "proto", "addr", "port", "exe", "pids", "approved"}
+
+Services are compared with an approved baseline (LISTENERS["approved_file"]
+in the store directory). It is created from the first inventory if it
+does not exist yet and updated with `mini_hids listeners --approve`.
+Added services that are not approved are alerted. The running inventory
+stats the file on each update and reloads it when its mtime changes, so
+an approval takes effect without a restart.
+
+The current exposure is saved as the "listeners" checkpoint
+(storage/state.py) when a service is added or removed, at most once per
+LISTENERS["checkpoint_interval"] seconds. That is what `mini_hids
+listeners` reads, and what the next start diffs against to report
+services that appeared or went away while the HIDS was down.
+"""
+
+import json
+import os
+import time
+
+from config import LISTENERS
+from storage import db, state
+from monitor.scan_detect import split_addr
+from utils.helpers import now_iso, ensure_dir
+from utils import metrics
+
+
+def approved_path():
+    return os.path.join(db.store_dir(), LISTENERS["approved_file"])
+
+
+def _mtime(path):
+    # save_approved replaces the file, so the inode changes even when mtime is coarse
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def load_approved(path=None):
+    """Set of approved (proto, addr, port, exe) keys, or None if there is no baseline yet."""
+    try:
+        with open(path or approved_path(), "r", encoding="utf-8") as f:
+            return {tuple(s) for s in json.load(f)["services"]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_approved(keys, path=None):
+    path = path or approved_path()
+    ensure_dir(path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "approved_at": now_iso(), "services": sorted(map(list, keys), key=repr)},
+                  f, indent=1)
+    os.replace(tmp, path)
+
+
+def current_exposure():
+    """Exposure saved by the running HIDS: ([service dicts], saved_at) or (None, reason)."""
+    return state.load("listeners", max_age=0)
+
+
+class _Service:
+    __slots__ = ("pids", "since")
+
+    def __init__(self, since):
+        self.pids = {}    # pid -> sockets held by that pid
+        self.since = since
+
+
+class ListenerInventory:
+    def __init__(self, cfg=LISTENERS, approved=None):
+        self.grace = float(cfg["grace"])
+        self._sockets = {}    # (pid, laddr, proto) -> service key
+        self._services = {}   # (proto, addr, port, exe) -> _Service
+        self._closing = {}    # service key -> time its last socket went away
+        # an explicit baseline is fixed; otherwise follow the approved file
+        self._approved_path = approved_path() if approved is None else None
+        self._approved_mtime = None
+        self.approved = approved
+        self.reload_approved()
+        self.checkpoint_interval = float(cfg.get("checkpoint_interval", 10))
+        self.changed = False   # the set of services changed since the last checkpoint
+        self._saved_at = 0.0
+
+    def __len__(self):
+        return len(self._services)
+
+    @staticmethod
+    def key(sock, exe):
+        pid, laddr = sock[0], sock[1]
+        proto = sock[2] if len(sock) > 2 else "tcp"
+        addr, port = split_addr(laddr)
+        return (proto, addr, port, exe or "")
+
+    def reload_approved(self):
+        """Reload the approved baseline if the file changed since it was read; True if it was."""
+        if self._approved_path is None:
+            return False
+        mtime = _mtime(self._approved_path)
+        if mtime == self._approved_mtime:
+            return False
+        self._approved_mtime = mtime
+        self.approved = load_approved(self._approved_path) if mtime is not None else None
+        return True
+
+    def _drift(self, change, key, svc=None):
+        proto, addr, port, exe = key
+        approved = self.approved is not None and key in self.approved
+        metrics.inc("hids_listener_drift_total", labels={"change": change})
+        return {"ts": now_iso(), "type": "listener_drift", "change": change, "proto": proto, "addr": addr,
+                "port": port, "exe": exe or None, "pids": sorted(p for p in (svc.pids if svc else ()) if p),
+                "approved": approved}
+
+    def _add(self, sock, exe, now):
+        """New socket; the key if it opened a service that was not exposed."""
+        if sock in self._sockets:
+            return None
+        key = self.key(sock, exe)
+        self._sockets[sock] = key
+        svc = self._services.get(key)
+        new = svc is None
+        if new:
+            svc = self._services[key] = _Service(now)
+            self.changed = True
+        self._closing.pop(key, None)   # reopened within the grace period: a restart, not drift
+        svc.pids[sock[0]] = svc.pids.get(sock[0], 0) + 1
+        return key if new else None
+
+    def _remove(self, sock, now):
+        key = self._sockets.pop(sock, None)
+        if key is None:
+            return
+        svc = self._services[key]
+        n = svc.pids.get(sock[0], 0) - 1
+        if n > 0:
+            svc.pids[sock[0]] = n
+        else:
+            svc.pids.pop(sock[0], None)
+        if not svc.pids:
+            self._closing[key] = now
+
+    def seed(self, socks, resolve_exe, now=None):
+        """Take the current listening sockets as the starting inventory (no events)."""
+        now = now or time.time()
+        for sock in socks:
+            self._add(sock, resolve_exe(sock[0]), now)
+
+    def update(self, added, removed, resolve_exe, now=None):
+        """Apply one snapshot diff; listener_drift events for services that appeared or went away."""
+        now = now or time.time()
+        self.reload_approved()
+        out = []
+        for sock in removed:
+            self._remove(sock, now)
+        for sock in added:
+            if sock in self._sockets:
+                continue
+            key = self._add(sock, resolve_exe(sock[0]), now)
+            if key is not None:
+                out.append(self._drift("added", key, self._services[key]))
+        if self._closing:
+            for key, t in list(self._closing.items()):
+                if now - t >= self.grace:
+                    del self._closing[key]
+                    del self._services[key]
+                    self.changed = True
+                    out.append(self._drift("removed", key))
+        return out
+
+    def exposure(self):
+        """Currently exposed services (including ones inside their grace period), sorted."""
+        return [{"proto": k[0], "addr": k[1], "port": k[2], "exe": k[3] or None,
+                 "pids": sorted(p for p in s.pids if p), "since": s.since,
+                 "approved": self.approved is not None and k in self.approved}
+                for k, s in sorted(self._services.items(), key=lambda kv: repr(kv[0]))]
+
+    def keys(self):
+        return set(self._services)
+
+    # persistence
+
+    def checkpoint(self, force=False, now=None):
+        """
+        Save the exposure for `mini_hids listeners` and the next start, if a
+        service was added or removed and (unless force) checkpoint_interval has passed.
+        """
+        if not self.changed:
+            return False
+        now = now or time.time()
+        if not force and now - self._saved_at < self.checkpoint_interval:
+            return False
+        state.save("listeners", self.exposure(), boot=False)
+        self.changed = False
+        self._saved_at = now
+        return True
+
+    def since_last_run(self):
+        """listener_drift events between the last saved exposure and now (services changed while down)."""
+        prev, _ = state.load("listeners", max_age=0)
+        if prev is None:
+            return []
+        self.reload_approved()
+        before = {(s["proto"], s["addr"], s["port"], s["exe"] or "") for s in prev}
+        now = self.keys()
+        out = [self._drift("added", k, self._services[k]) for k in sorted(now - before, key=repr)]
+        out += [self._drift("removed", k) for k in sorted(before - now, key=repr)]
+        for ev in out:
+            ev["during_downtime"] = True
+        return out
@@ -4,8 +4,12 @@ import threading
 import re
 import os
 import json
+from datetime import datetime, timezone
 from storage.db import add_event
-from utils.helpers import now_iso, read_json
+from storage import state
+from monitor import policy
+from utils.helpers import now_iso
+from config import CHECKPOINT
 
 # Patterns (tail /var/log/auth.log)
 AUTH_LOG = "/var/log/auth.log"
@@ -15,23 +19,8 @@ INVALID_USER_RE = re.compile(r"Invalid user (?P<user>\S+) from (?P<ip>\S+)")
 ACCEPTED_PW_RE = re.compile(r"Accepted password for (?P<user>\S+) from (?P<ip>\S+)")
 SUDO_FAIL_RE = re.compile(r"sudo: .*authentication failure; .*")
 SUDO_OK_RE = re.compile(r"sudo: .*session opened for user (?P<user>\S+)")
-
-CREDS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "teacher_creds.json")
-
-def load_whitelist():
-    try:
-        creds = read_json(CREDS_PATH, default={})
-        t = creds.get("username") or ""
-        return {t.strip()} if t else set()
-    except Exception:
-        return set()
-
-WHITELIST_USERS = load_whitelist()
-
-def _is_whitelisted(user):
-    if not user:
-        return False
-    return user.strip() in WHITELIST_USERS
+_MONTHS = {m: i for i, m in enumerate(("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                                       "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1)}
 
 def sanitize_str(s: str) -> str:
     """Make a short stable key-friendly string from user/ip."""
@@ -39,6 +28,49 @@ def sanitize_str(s: str) -> str:
         return ""
     return "".join(c for c in s if c.isalnum() or c in ("_", "-")).lower()
 
+def parse_line(line, ts=None):
+    """Auth event for one auth.log line, or None. ts defaults to now (live tailing)."""
+    # cheap pre-check: most auth.log lines (cron, pam sessions) match none of the patterns
+    if "password for" not in line and "Invalid user" not in line and "sudo:" not in line:
+        return None
+    ts = ts or now_iso()
+    m = FAILED_PW_RE.search(line)
+    if m:
+        return {"ts": ts, "type": "auth_failed", "user": m.group("user").strip(), "ip": m.group("ip"), "raw": line.strip()}
+    m = INVALID_USER_RE.search(line)
+    if m:
+        return {"ts": ts, "type": "auth_invalid_user", "user": m.group("user").strip(), "ip": m.group("ip"), "raw": line.strip()}
+    m = ACCEPTED_PW_RE.search(line)
+    if m:
+        return {"ts": ts, "type": "auth_success", "user": m.group("user").strip(), "ip": m.group("ip"), "raw": line.strip()}
+    m = SUDO_FAIL_RE.search(line)
+    if m:
+        return {"ts": ts, "type": "sudo_failed", "raw": line.strip()}
+    m = SUDO_OK_RE.search(line)
+    if m:
+        return {"ts": ts, "type": "sudo_ok", "user": m.group("user").strip(), "raw": line.strip()}
+    return None
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
+
+def log_ts(line, year, month=12):
+    """UTC ISO timestamp of a syslog line, or None. Lines dated after `month` belong to year - 1."""
+    if line[:4].isdigit() and line[4:5] == "-":
+        try:
+            dt = datetime.fromisoformat(line.split(" ", 1)[0].replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return _iso(dt.timestamp())
+    mon = _MONTHS.get(line[:3])
+    if not mon:
+        return None
+    try:
+        day, hh, mm, ss = int(line[4:6]), int(line[7:9]), int(line[10:12]), int(line[13:15])
+        return _iso(time.mktime((year if mon <= month else year - 1, mon, day, hh, mm, ss, 0, 0, -1)))
+    except (ValueError, OverflowError):
+        return None
+
 class AuthTailer:
     """
     Tails /var/log/auth.log and creates auth events.
@@ -50,49 +82,33 @@ class AuthTailer:
         self._stop = threading.Event()
         self._t = None
         self.alert_callback = None
+        self.emit = add_event   # replaced by offline replay (monitor/replay.py)
 
     def set_alert_callback(self, cb):
         self.alert_callback = cb
 
     def _process_line(self, line):
-        ev = None
-        m = FAILED_PW_RE.search(line)
-        if m:
-            ev = {"ts": now_iso(), "type": "auth_failed", "user": m.group("user").strip(), "ip": m.group("ip"), "raw": line.strip()}
-        else:
-            m = INVALID_USER_RE.search(line)
-            if m:
-                ev = {"ts": now_iso(), "type": "auth_invalid_user", "user": m.group("user").strip(), "ip": m.group("ip"), "raw": line.strip()}
-            else:
-                m = ACCEPTED_PW_RE.search(line)
-                if m:
-                    ev = {"ts": now_iso(), "type": "auth_success", "user": m.group("user").strip(), "ip": m.group("ip"), "raw": line.strip()}
-                else:
-                    m = SUDO_FAIL_RE.search(line)
-                    if m:
-                        ev = {"ts": now_iso(), "type": "sudo_failed", "raw": line.strip()}
-                    else:
-                        m = SUDO_OK_RE.search(line)
-                        if m:
-                            ev = {"ts": now_iso(), "type": "sudo_ok", "user": m.group("user").strip(), "raw": line.strip()}
+        return self._handle(parse_line(line))
 
+    def _handle(self, ev):
+        """Policy, storage and alerting for a parsed auth event (shared with offline replay)."""
         if not ev:
             return None
 
+        # whitelist policy: trusted activity is dropped or stored without alerting
+        action = policy.apply(ev)
+        if action == policy.SUPPRESS:
+            return None
+
         # persist event to DB (encrypted)
         try:
-            add_event(ev)
+            self.emit(ev)
         except Exception:
             pass
 
-        # If whitelisted user, still log but don't call alert to send email
-        user = ev.get("user") or ""
-        if _is_whitelisted(user):
-            try:
-                add_event({"ts": now_iso(), "type": "auth_whitelisted_ignored", "user": user, "raw": line.strip()})
-            except Exception:
-                pass
+        if action == policy.NO_ALERT:
             return ev
+        user = ev.get("user") or ""
 
         # call central alert callback if set
         try:
@@ -107,11 +123,60 @@ class AuthTailer:
                 self.alert_callback(ev)
         except Exception as e:
             try:
-                add_event({"ts": now_iso(), "type": "auth_alert_callback_failed", "error": str(e), "event": ev})
+                self.emit({"ts": now_iso(), "type": "auth_alert_callback_failed", "error": str(e), "event": ev})
             except Exception:
                 pass
         return ev
 
+    # checkpoints (storage/state.py): inode + byte offset of the next unread line
+
+    def checkpoint(self, inode, offset):
+        state.save("auth", {"path": self.path, "inode": inode, "offset": offset}, boot=False)
+
+    def _read_lines(self, path, start, end, skip_partial=False):
+        """Handle the complete lines in [start, end) of path, dated from the log; (lines, offset reached)."""
+        t = time.localtime()
+        n = 0
+        with open(path, "rb") as f:
+            f.seek(start)
+            if skip_partial:
+                f.readline()
+            while f.tell() < end:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                text = line.decode("utf-8", "ignore")
+                self._handle(parse_line(text, log_ts(text, t.tm_year, t.tm_mon)))
+                n += 1
+            return n, f.tell()
+
+    def _catch_up(self, st):
+        """Process what was logged while we were down; returns the offset to tail the current file from."""
+        ck, saved_at = state.load("auth")
+        if ck is None or ck.get("path") != self.path:
+            return st.st_size
+        limit = int(CHECKPOINT["auth_catchup_mb"] * 1024 * 1024)
+        inode, offset = ck.get("inode"), int(ck.get("offset") or 0)
+        lines, rotated = 0, False
+        if inode == st.st_ino and offset <= st.st_size:
+            start = offset
+        else:
+            # rotated while we were down: finish the old file if it is still next to the new one
+            rotated, start = True, 0
+            try:
+                old = self.path + ".1"
+                ost = os.stat(old)
+                if ost.st_ino == inode and offset <= ost.st_size:
+                    lines += self._read_lines(old, max(offset, ost.st_size - limit), ost.st_size,
+                                              skip_partial=ost.st_size - offset > limit)[0]
+            except OSError:
+                pass
+        skipped = max(0, st.st_size - start - limit)
+        n, pos = self._read_lines(self.path, start + skipped, st.st_size, skip_partial=skipped > 0)
+        add_event({"ts": now_iso(), "type": "auth_downtime_catchup", "since": saved_at,
+                   "lines": lines + n, "rotated": rotated, "skipped_bytes": skipped})
+        return pos
+
     def _tail_loop(self):
         try:
             # ensure file exists
@@ -119,17 +184,26 @@ class AuthTailer:
                 add_event({"ts": now_iso(), "type": "auth_log_missing", "path": self.path})
                 return
 
-            with open(self.path, "r", errors="ignore") as f:
-                # go to EOF initially
-                f.seek(0, 2)
+            saver = state.Every() if CHECKPOINT["enabled"] else None
+            with open(self.path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                # resume from the checkpoint if there is one, else go to EOF
+                if saver is not None:
+                    f.seek(self._catch_up(os.fstat(f.fileno())))
+                else:
+                    f.seek(0, 2)
                 while not self._stop.is_set():
                     where = f.tell()
                     line = f.readline()
-                    if not line:
-                        time.sleep(self.polling)
+                    if not line.endswith(b"\n"):   # nothing new, or a line still being written
                         f.seek(where)
+                        if saver is not None and saver.ready():
+                            self.checkpoint(inode, where)
+                        time.sleep(self.polling)
                     else:
-                        self._process_line(line)
+                        self._process_line(line.decode("utf-8", "ignore"))
+                if saver is not None:
+                    self.checkpoint(inode, f.tell())
         except Exception as e:
             try:
                 add_event({"ts": now_iso(), "type": "auth_monitor_error", "error": str(e)})
@@ -2,25 +2,21 @@
 import threading
 import os
 import time
-from storage.db import init_db, add_event
-from utils.helpers import now_iso, read_json
+from storage.db import init_db, add_event, warm_keys
+from storage.retention import RetentionManager
+from storage import chain
+from config import CHAIN_CHECKPOINT_INTERVAL, STREAM_ENABLED, CLUSTER_COLLECTOR
+from utils.helpers import now_iso
 from utils.emailer import send_email
+from utils import metrics
 
 # monitors (these should exist in monitor/)
 from monitor.file_monitor import start_file_monitor, set_alert_callback
 from monitor.proc_net_monitor import ProcNetMonitor
 from monitor.net_monitor import NetMonitor
-from config import MONITOR_PATHS
-
-# load teacher username from assets/teacher_creds.json
-CREDS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "teacher_creds.json")
-def load_teacher():
-    try:
-        obj = read_json(CREDS_PATH, default={})
-        return (obj.get("username") or "").strip()
-    except Exception:
-        return ""
-TEACHER_USER = load_teacher()
+from monitor import policy, severity
+from monitor.alerting import AlertQueue
+from config import MONITOR_PATHS, ALERT_BUDGETS
 
 def _safe_str(s):
     try:
@@ -37,28 +33,25 @@ class HIDS:
         self.proc_monitor = ProcNetMonitor()
         self.net_monitor = NetMonitor()
         self.file_observer = None
+        self.stream_server = None
         self.threads = []
+        # severity-ordered alert queue with per-level budgets
+        self.alerts = AlertQueue(self._send_alert, on_exhausted=self._budget_exhausted)
 
     def alert(self, event):
         """
         Centralized alert function:
-        - Skips emailing for whitelisted teacher user (but logs the event)
-        - Uses event-provided _rate_key/_rate_seconds if present, else constructs a stable key
-        - Calls send_email(...) and logs outcome
+        - Skips events the whitelist policy marks as trusted
+        - Scores the event (monitor/severity.py); below ALERT_MIN_SEVERITY it is only logged
+        - Queues it by severity (monitor/alerting.py); the queue worker calls _send_alert
+        Returns True if the alert was queued.
         """
         try:
-            subj = f"[mini-HIDS] {event.get('type')}"
-            body = f"Detected event:\n{event}"
-            etype = (event.get("type") or "event").strip()
-            # preferred user fields from different monitors
-            user = _safe_str(event.get("user") or event.get("user_entered") or event.get("owner"))
+            # Trusted activity (monitor/policy.py): the event itself is already stored
+            if policy.quiet(event):
+                return False
 
-            # If event belongs to whitelisted teacher -> log & skip emailing
-            if user and TEACHER_USER and user == TEACHER_USER:
-                try:
-                    add_event({"ts": now_iso(), "type": "alert_whitelisted_ignored", "user": user, "orig_event": event})
-                except Exception:
-                    pass
+            if not severity.should_alert(event):
                 return False
 
             if not self.email_alerts:
@@ -68,7 +61,32 @@ class HIDS:
                     pass
                 return False
 
-            
+            return self.alerts.submit(event)
+        except Exception as e:
+            try:
+                add_event({"ts": now_iso(), "type": "alert_failed_exception", "error": str(e), "event": event})
+            except Exception:
+                pass
+            return False
+
+    def _budget_exhausted(self, level):
+        add_event({"ts": now_iso(), "type": "alert_budget_exhausted", "level": level,
+                   "per_hour": ALERT_BUDGETS[level][0]})
+
+    def _send_alert(self, event):
+        """
+        Alert queue sink:
+        - Uses event-provided _rate_key/_rate_seconds if present, else constructs a stable key
+        - Calls send_email(...) and logs outcome
+        """
+        try:
+            sev = event.get("severity")
+            subj = f"[mini-HIDS] [{severity.level(sev or 0)}] {event.get('type')}"
+            body = f"Detected event (severity {sev}):\n{event}"
+            etype = (event.get("type") or "event").strip()
+            # preferred user fields from different monitors
+            user = _safe_str(event.get("user") or event.get("user_entered") or event.get("owner"))
+
             rate_key = event.get("_rate_key")
             rate_seconds = event.get("_rate_seconds")
             if rate_seconds is None:
@@ -103,7 +121,7 @@ class HIDS:
             # log result for auditing
             if sent:
                 try:
-                    add_event({"ts": now_iso(), "type": "email_sent", "subject": subj, "rate_key": rate_key})
+                    add_event({"ts": now_iso(), "type": "email_sent", "subject": subj, "rate_key": rate_key, "severity": sev})
                 except Exception:
                     pass
             else:
@@ -120,20 +138,64 @@ class HIDS:
                 pass
             return False
 
-    def start(self):
+    def _start_metrics(self):
+        # self-instrumentation exporter + periodic hids_stats events (no-op unless enabled)
+        try:
+            if metrics.start(emit=add_event):
+                add_event({"ts": now_iso(), "type": "metrics_started", "port": metrics.METRICS_PORT})
+        except Exception as e:
+            add_event({"ts": now_iso(), "type": "metrics_start_failed", "error": str(e)})
+
+    def _start_stream(self):
+        # live event stream for the GUI / local consumers
+        if STREAM_ENABLED:
+            try:
+                from storage.stream import StreamServer
+                self.stream_server = StreamServer().start()
+                add_event({"ts": now_iso(), "type": "stream_server_started", "socket": self.stream_server.path})
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "stream_server_start_failed", "error": str(e)})
+
+    def _start_file_monitor(self):
         # set file monitor to use our alert callback (file_monitor will call this)
         try:
             set_alert_callback(self.alert)
         except Exception:
             pass
 
-        # start file observer
+        # start file observer (imports watchdog and walks the watched trees)
         try:
             self.file_observer = start_file_monitor(MONITOR_PATHS)
             add_event({"ts": now_iso(), "type": "file_monitor_started", "paths": MONITOR_PATHS})
         except Exception as e:
             add_event({"ts": now_iso(), "type": "file_monitor_start_failed", "error": str(e)})
 
+    def _warm_store(self):
+        # load cryptography and fetch the keyring master key now, not on the first flush
+        try:
+            warm_keys()
+        except Exception as e:
+            add_event({"ts": now_iso(), "type": "store_key_load_failed", "error": str(e)})
+
+    def start(self):
+        # independent, I/O-bound bring-up steps run concurrently
+        steps = [self._start_metrics, self._start_stream, self._start_file_monitor, self._warm_store]
+        started = [threading.Thread(target=fn, daemon=True) for fn in steps]
+        for t in started:
+            t.start()
+
+        # multi-host mode: ship events to the collector, which does the emailing
+        if CLUSTER_COLLECTOR:
+            try:
+                from cluster.agent import Agent
+                self.email_alerts = False
+                t5 = threading.Thread(target=Agent(CLUSTER_COLLECTOR).run_loop, args=(self.stop_event,), daemon=True)
+                t5.start()
+                self.threads.append(t5)
+                add_event({"ts": now_iso(), "type": "cluster_agent_started", "collector": CLUSTER_COLLECTOR})
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "cluster_agent_start_failed", "error": str(e)})
+
         # start proc monitor thread
         try:
             t1 = threading.Thread(target=self.proc_monitor.run_loop, args=(self.stop_event, self.alert), daemon=True)
@@ -143,6 +205,22 @@ class HIDS:
         except Exception as e:
             add_event({"ts": now_iso(), "type": "proc_monitor_start_failed", "error": str(e)})
 
+        # background retention / compaction of the segmented event store
+        try:
+            t3 = threading.Thread(target=RetentionManager().run_loop, args=(self.stop_event,), daemon=True)
+            t3.start()
+            self.threads.append(t3)
+        except Exception as e:
+            add_event({"ts": now_iso(), "type": "retention_start_failed", "error": str(e)})
+
+        # periodic signed checkpoints of the event hash chain
+        try:
+            t4 = threading.Thread(target=chain.checkpoint_loop, args=(self.stop_event, CHAIN_CHECKPOINT_INTERVAL), daemon=True)
+            t4.start()
+            self.threads.append(t4)
+        except Exception as e:
+            add_event({"ts": now_iso(), "type": "chain_checkpoint_start_failed", "error": str(e)})
+
         # start net monitor thread
         try:
             t2 = threading.Thread(target=self.net_monitor.run_loop, args=(self.stop_event, self.alert), daemon=True)
@@ -152,6 +230,9 @@ class HIDS:
         except Exception as e:
             add_event({"ts": now_iso(), "type": "net_monitor_start_failed", "error": str(e)})
 
+        for t in started:
+            t.join()
+
     def stop(self):
         try:
             self.stop_event.set()
@@ -170,6 +251,14 @@ class HIDS:
                     self.file_observer.join(timeout=2)
                 except Exception:
                     pass
+                scanner = getattr(self.file_observer, "scanner", None)
+                if scanner:
+                    scanner.stop()
+        except Exception:
+            pass
+
+        try:
+            self.alerts.stop()
         except Exception:
             pass
 
@@ -180,5 +269,16 @@ class HIDS:
             except Exception:
                 pass
 
+        try:
+            metrics.stop()
+        except Exception:
+            pass
+
+        try:
+            if self.stream_server:
+                self.stream_server.stop()
+        except Exception:
+            pass
+
         add_event({"ts": now_iso(), "type": "hids_stopped"})
 
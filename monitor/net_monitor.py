@@ -1,31 +1,37 @@
 # monitor/net_monitor.py
-import os, time
-from utils.helpers import now_iso, read_json
+import os, time, socket
+from utils.helpers import now_iso, lazy_import
 from storage.db import add_event
+from storage import state
+from monitor import policy
+from monitor.rules import load_rules
+from monitor.scan_detect import ScanDetector, split_addr
+from monitor.listeners import ListenerInventory, save_approved
+from config import SCAN_DETECT, CHECKPOINT, LISTENERS
+from utils import metrics
 
-try:
-    import psutil
-except Exception:
-    psutil = None
+psutil = lazy_import("psutil")   # None if not installed; loaded on first use
 
-RULES_PATH = os.path.join(os.path.dirname(__file__), "..", "rules.json")
-def _load_rules():
-    try:
-        obj = read_json(RULES_PATH, default={})
-        return {
-            "suspicious_ports": obj.get("suspicious_ports", []),
-            "suspicious_processes": obj.get("suspicious_processes", [])
-        }
-    except Exception:
-        return {"suspicious_ports": [], "suspicious_processes": []}
-
-RULES = _load_rules()
+RULES = load_rules()
 
 class NetMonitor:
     def __init__(self, polling=1.0):
         self.polling = float(polling)
         self._prev_conns = set()
         self._prev_listens = set()
+        self.alert_callback = None
+        self.emit = add_event   # replaced by offline replay (monitor/replay.py)
+        self.clock = time.time  # replay substitutes event time
+        self.scans = ScanDetector() if SCAN_DETECT["enabled"] else None
+        self.inventory = None   # monitor/listeners.py, live runs only (set in run_loop)
+
+    def _alert(self, ev):
+        # scored and queued by HIDS.alert (monitor/severity.py, monitor/alerting.py)
+        if self.alert_callback:
+            try:
+                self.alert_callback(ev)
+            except Exception:
+                pass
 
     def _snapshot(self):
         conns = set()
@@ -41,13 +47,177 @@ class NetMonitor:
                     conns.add(key)
                     if c.status == psutil.CONN_LISTEN:
                         listens.add((c.pid, laddr))
+                    elif LISTENERS["udp"] and not raddr and c.type == socket.SOCK_DGRAM:
+                        listens.add((c.pid, laddr, "udp"))   # bound UDP socket; tcp listeners stay 2-tuples
                 except Exception:
                     continue
         except Exception:
             pass
         return conns, listens
 
+    def process_snapshot(self, cur_conns, cur_listens):
+        """Diff a snapshot against the previous one and log new connections/listeners."""
+        new_conns = cur_conns - self._prev_conns
+        now = self.clock()
+        if self.scans is not None:
+            listen_ports = {split_addr(l[1])[1] for l in cur_listens}
+        for pid, status, laddr, raddr in new_conns:
+            ev = {"ts": now_iso(), "type": "net_connection", "pid": pid, "status": status, "local": laddr, "remote": raddr}
+            if policy.apply(ev) == policy.SUPPRESS:
+                continue
+
+            # port scans / fanout; rows of a flagged flow are counted instead of stored
+            drop = False
+            if self.scans is not None and raddr:
+                found, drop = self.scans.observe(pid, laddr, raddr, listen_ports, now)
+                for sev in found:
+                    if "policy" in ev:
+                        sev["policy"] = ev["policy"]
+                    try:
+                        self.emit(sev)
+                    except Exception:
+                        pass
+                    self._alert(sev)
+            if not drop:
+                try:
+                    self.emit(ev)
+                except Exception:
+                    pass
+
+            try:
+                # if remote port in suspicious list -> escalate
+                if raddr:
+                    try:
+                        port = int(raddr.split(":")[-1])
+                    except Exception:
+                        port = None
+                    if port and port in RULES.get("suspicious_ports", []):
+                        sev = {"ts": now_iso(), "type": "suspicious_connection", "pid": pid, "local": laddr, "remote": raddr}
+                        if "policy" in ev:
+                            sev["policy"] = ev["policy"]
+                        try:
+                            self.emit(sev)
+                        except Exception:
+                            pass
+                        self._alert(sev)
+                        continue
+            except Exception:
+                pass
+
+        new_listens = cur_listens - self._prev_listens
+        if self.inventory is not None:
+            self._update_inventory(new_listens, self._prev_listens - cur_listens, now)
+            new_listens = ()
+        for pid, l, *_ in new_listens:
+            ev = {"ts": now_iso(), "type":"listening_port", "pid": pid, "local": l}
+            if policy.apply(ev) == policy.SUPPRESS:
+                continue
+            try:
+                self.emit(ev)
+            except Exception:
+                pass
+            try:
+                try:
+                    port = int(l.split(":")[-1])
+                except Exception:
+                    port = None
+                if port and port in RULES.get("suspicious_ports", []):
+                    sev = {"ts": now_iso(), "type":"suspicious_listen", "pid": pid, "local": l}
+                    if "policy" in ev:
+                        sev["policy"] = ev["policy"]
+                    self.emit(sev)
+                    self._alert(sev)
+
+                else:
+                    pass
+            except Exception:
+                pass
+
+        if self.scans is not None:
+            for ev in self.scans.expired(now):
+                try:
+                    self.emit(ev)
+                except Exception:
+                    pass
+
+        self._prev_conns = cur_conns
+        self._prev_listens = cur_listens
+
+    # listener inventory (monitor/listeners.py)
+
+    def _listener_exe(self, pid):
+        try:
+            return psutil.Process(pid).exe() if psutil and pid else ""
+        except Exception:
+            return ""
+
+    def _update_inventory(self, added, removed, now):
+        """Feed a listener diff to the inventory; store / alert only services that appeared or went away."""
+        allowed, tags = [], {}
+        for sock in added:
+            ev = {"ts": now_iso(), "type": "listening_port", "pid": sock[0], "local": sock[1]}
+            if policy.apply(ev) == policy.SUPPRESS:
+                continue
+            allowed.append(sock)
+            if "policy" in ev:
+                tags[sock[0]] = ev["policy"]
+        self._report_drift(self.inventory.update(allowed, removed, self._listener_exe, now), tags)
+
+    def _report_drift(self, drift, tags=None):
+        for ev in drift:
+            tag = next((tags[p] for p in ev["pids"] if p in tags), None) if tags else None
+            if tag:
+                ev["policy"] = tag
+            try:
+                self.emit(ev)
+            except Exception:
+                pass
+            if ev["change"] != "added":
+                continue
+            if ev["port"] in RULES.get("suspicious_ports", []):
+                sev = {"ts": now_iso(), "type": "suspicious_listen", "pid": (ev["pids"] or [None])[0],
+                       "local": f"{ev['addr']}:{ev['port']}", "exe": ev["exe"]}
+                if tag:
+                    sev["policy"] = tag
+                try:
+                    self.emit(sev)
+                except Exception:
+                    pass
+                self._alert(sev)
+            elif not ev["approved"]:
+                self._alert(ev)
+
+    def _start_inventory(self, cur_listens):
+        self.inventory = ListenerInventory()
+        self.inventory.seed(cur_listens, self._listener_exe)
+        if self.inventory.approved is None:
+            # first run: what is exposed now is the approved baseline
+            save_approved(self.inventory.keys())
+            self.inventory.reload_approved()
+            add_event({"ts": now_iso(), "type": "listener_baseline_created", "services": len(self.inventory)})
+        self._report_drift(self.inventory.since_last_run())
+        self.inventory.checkpoint()
+
+    # checkpoints (storage/state.py)
+
+    def checkpoint(self):
+        state.save("net", {"conns": sorted(map(list, self._prev_conns), key=repr),
+                           "listens": sorted(map(list, self._prev_listens), key=repr)})
+
+    def restore(self, cur_conns, cur_listens):
+        """(conns, listens) from the checkpoint (None if unusable), plus a net_downtime_diff event."""
+        st, saved_at = state.load("net")
+        if st is None:
+            return None, None
+        conns = {tuple(c) for c in st.get("conns", [])}
+        listens = {tuple(l) for l in st.get("listens", [])}
+        ev = {"ts": now_iso(), "type": "net_downtime_diff", "since": saved_at,
+              "new_connections": len(cur_conns - conns), "closed_connections": len(conns - cur_conns),
+              "new_listeners": len(cur_listens - listens), "closed_listeners": len(listens - cur_listens)}
+        return (conns, listens), ev
+
     def run_loop(self, stop_event, alert_callback):
+        self.alert_callback = alert_callback
         if psutil is None:
             add_event({"ts": now_iso(), "type":"net_monitor_missing_psutil"})
             return
@@ -56,61 +226,53 @@ class NetMonitor:
         self._prev_conns = cur_conns
         self._prev_listens = cur_listens
 
-        while not stop_event.is_set():
-            time.sleep(self.polling)
-            cur_conns, cur_listens = self._snapshot()
+        if LISTENERS["enabled"] and self.inventory is None:
+            try:
+                self._start_inventory(cur_listens)
+            except Exception as e:
+                self.inventory = None
+                add_event({"ts": now_iso(), "type": "listener_inventory_error", "error": str(e)})
 
-            new_conns = cur_conns - self._prev_conns
-            for pid, status, laddr, raddr in new_conns:
-                ev = {"ts": now_iso(), "type": "net_connection", "pid": pid, "status": status, "local": laddr, "remote": raddr}
-                try:
+        # diff against the last checkpoint: sockets opened while we were down
+        saver = state.Every() if CHECKPOINT["enabled"] else None
+        if saver is not None:
+            try:
+                prev, ev = self.restore(cur_conns, cur_listens)
+                if prev is not None:
                     add_event(ev)
-                except Exception:
-                    pass
+                    self._prev_conns, self._prev_listens = prev
+                    self.process_snapshot(cur_conns, cur_listens)
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "net_checkpoint_error", "error": str(e)})
 
-                try:
-                    # if remote port in suspicious list -> escalate
-                    if raddr:
-                        try:
-                            port = int(raddr.split(":")[-1])
-                        except Exception:
-                            port = None
-                        if port and port in RULES.get("suspicious_ports", []):
-                            sev = {"ts": now_iso(), "type": "suspicious_connection", "pid": pid, "local": laddr, "remote": raddr}
-                            try:
-                                add_event(sev)
-                            
-                                continue
-                            except Exception:
-                                pass
-                             continue
-                except Exception:
-                    pass
+        while not stop_event.is_set():
+            time.sleep(self.polling)
+            with metrics.timed("hids_snapshot_seconds", {"monitor": "net"}):
+                cur_conns, cur_listens = self._snapshot()
+            metrics.set_gauge("hids_net_tracked_connections", len(cur_conns))
 
-            new_listens = cur_listens - self._prev_listens
-            for pid, l in new_listens:
-                ev = {"ts": now_iso(), "type":"listening_port", "pid": pid, "local": l}
+            self.process_snapshot(cur_conns, cur_listens)
+            if self.inventory is not None:
                 try:
-                    add_event(ev)
+                    self.inventory.checkpoint()
                 except Exception:
                     pass
+            if saver is not None and saver.ready():
                 try:
-                    try:
-                        port = int(l.split(":")[-1])
-                    except Exception:
-                        port = None
-                    if port and port in RULES.get("suspicious_ports", []):
-                        sev = {"ts": now_iso(), "type":"suspicious_listen", "pid": pid, "local": l}
-                        add_event(sev)
-                        
-                    else:
-                        pass
+                    self.checkpoint()
                 except Exception:
                     pass
 
-            self._prev_conns = cur_conns
-            self._prev_listens = cur_listens
-
+        if self.inventory is not None:
+            try:
+                self.inventory.checkpoint(force=True)
+            except Exception:
+                pass
+        if saver is not None:
+            try:
+                self.checkpoint()
+            except Exception:
+                pass
         add_event({"ts": now_iso(), "type":"net_monitor_stopped"})
 
 
@@ -0,0 +1,267 @@
+# monitor/policy.py
+"""
+Whitelist / identity policy engine.
+
+One place decides what trusted activity looks like, instead of each
+monitor re-reading teacher_creds.json and comparing strings. Monitors
+call `apply(ev)` once, right after building an event and before storing
+it:
+
+    SUPPRESS   the event is dropped: not stored, not alerted
+    NO_ALERT   the event is stored with ev["policy"] = <rule name>, never alerted
+    None       no rule matched; normal handling
+
+Rules live in policy.json (POLICY_PATH):
+
+    {
+      "include_teacher": true,
+      "rules": [
+        {"name": "backup", "action": "suppress", "types": ["process_start"],
+         "match": {"exe": ["/usr/bin/rsync"], "user": ["root"]}},
+        {"name": "lan", "action": "no_alert", "match": {"ip": ["192.168.1.0/24"]}},
+        {"name": "admins", "action": "no_alert", "match": {"group": ["sudo"], "uid": [0]}}
+      ]
+    }
+
+Within a rule every listed field must match (any value of its list);
+`types` optionally limits the rule to those event types. The first
+matching rule in file order wins. Fields: user, uid, group, exe, name
+(process name), ip (addresses or CIDR ranges, checked against ev["ip"]
+or the host part of ev["remote"]). Groups and uids are expanded to user
+names when the policy is loaded, so a lookup is a handful of dict/set
+probes regardless of the number of rules. "include_teacher" adds a
+no_alert rule for the username in assets/teacher_creds.json.
+"""
+
+import ipaddress
+import os
+import socket
+import threading
+
+from config import POLICY_PATH
+from utils.helpers import read_json
+from utils import metrics
+
+SUPPRESS = "suppress"
+NO_ALERT = "no_alert"
+ACTIONS = (SUPPRESS, NO_ALERT)
+
+CREDS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets", "teacher_creds.json")
+
+
+def load_teacher_user():
+    """The trusted (teacher) username from assets/teacher_creds.json."""
+    obj = read_json(CREDS_PATH, default={}) or {}
+    return (obj.get("username") or "").strip()
+
+
+def _event_user(ev):
+    u = ev.get("user") or ev.get("user_entered") or ev.get("owner")
+    return u.strip() if isinstance(u, str) else u
+
+
+def _event_ip(ev):
+    ip = ev.get("ip")
+    if not ip:
+        remote = ev.get("remote")
+        if remote:
+            ip = remote.rsplit(":", 1)[0].strip("[]")
+    return ip or None
+
+
+def _parse_ip(raw):
+    """(version, int) for an address string, or None. inet_pton is much cheaper than ipaddress."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, raw), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, raw.split("%", 1)[0]), "big")
+    except (OSError, TypeError, AttributeError):
+        return None
+
+
+def _net_key(version, plen, n):
+    bits = 32 if version == 4 else 128
+    return version, plen, n >> (bits - plen) << (bits - plen)
+
+
+def _group_users(name):
+    """Members of a group, including users whose primary group it is."""
+    try:
+        import grp
+        import pwd
+        g = grp.getgrnam(name)
+    except (ImportError, KeyError):
+        return set()
+    users = set(g.gr_mem)
+    users.update(p.pw_name for p in pwd.getpwall() if p.pw_gid == g.gr_gid)
+    return users
+
+
+def _uid_users(uid):
+    try:
+        import pwd
+        return {pwd.getpwuid(int(uid)).pw_name}
+    except (ImportError, KeyError, ValueError):
+        return set()
+
+
+class Rule:
+    __slots__ = ("order", "name", "action", "types", "users", "uids", "exes", "names", "nets")
+
+    def __init__(self, order, spec):
+        self.order = order
+        self.name = spec.get("name") or f"rule{order}"
+        self.action = spec.get("action", NO_ALERT)
+        if self.action not in ACTIONS:
+            raise ValueError(f"policy rule {self.name}: unknown action {self.action!r}")
+        self.types = frozenset(spec["types"]) if spec.get("types") else None
+        m = spec.get("match") or {}
+        self.users = set(m["user"]) if m.get("user") else None
+        # uid/group conditions match on the uid field or on the expanded user names
+        self.uids = None
+        if m.get("uid") is not None or m.get("group"):
+            self.uids = {"uid": set(), "user": set()}
+            for uid in m.get("uid") or []:
+                self.uids["uid"].add(int(uid))
+                self.uids["user"] |= _uid_users(uid)
+            for g in m.get("group") or []:
+                self.uids["user"] |= _group_users(g)
+        self.exes = set(m["exe"]) if m.get("exe") else None
+        self.names = {n.lower() for n in m["name"]} if m.get("name") else None
+        self.nets = None
+        if m.get("ip"):
+            nets = [ipaddress.ip_network(n, strict=False) for n in m["ip"]]
+            self.nets = {(n.version, n.prefixlen, int(n.network_address)) for n in nets}
+
+    def index_keys(self):
+        """Keys of the most selective condition; an event must produce one of them to match."""
+        if self.users is not None:
+            return [("user", u) for u in self.users]
+        if self.exes is not None:
+            return [("exe", e) for e in self.exes]
+        if self.names is not None:
+            return [("name", n) for n in self.names]
+        if self.uids is not None:
+            return [("uid", u) for u in self.uids["uid"]] + [("user", u) for u in self.uids["user"]]
+        if self.nets is not None:
+            return [("net", n) for n in self.nets]
+        if self.types is not None:
+            return [("type", t) for t in self.types]
+        return [("any", None)]
+
+    def matches(self, etype, user, uid, exe, name, ip):
+        if self.types is not None and etype not in self.types:
+            return False
+        if self.users is not None and user not in self.users:
+            return False
+        if self.uids is not None and uid not in self.uids["uid"] and user not in self.uids["user"]:
+            return False
+        if self.exes is not None and exe not in self.exes:
+            return False
+        if self.names is not None and (name or "").lower() not in self.names:
+            return False
+        if self.nets is not None:
+            if ip is None or not any(_net_key(ip[0], plen, ip[1]) in self.nets
+                                     for version, plen, _ in self.nets if version == ip[0]):
+                return False
+        return True
+
+
+class Policy:
+    def __init__(self, rules=(), include_teacher=False):
+        specs = list(rules)
+        if include_teacher:
+            teacher = load_teacher_user()
+            if teacher:
+                specs.append({"name": "teacher", "action": NO_ALERT, "match": {"user": [teacher]}})
+        self.rules = [Rule(i, s) for i, s in enumerate(specs)]
+        self._index = {}
+        self._prefixes = set()   # (version, prefixlen) present in ip rules
+        for r in self.rules:
+            for key in r.index_keys():
+                self._index.setdefault(key, []).append(r)
+                if key[0] == "net":
+                    self._prefixes.add(key[1][:2])
+        self.needs_exe = any(r.exes is not None for r in self.rules)
+
+    @classmethod
+    def load(cls, path=POLICY_PATH):
+        obj = read_json(path, default=None)
+        if obj is None:
+            return cls(include_teacher=True)
+        return cls(obj.get("rules") or [], include_teacher=obj.get("include_teacher", True))
+
+    def lookup(self, ev):
+        """Return the first matching Rule or None."""
+        if not self.rules:
+            return None
+        index = self._index
+        etype = ev.get("type")
+        user = _event_user(ev)
+        uid = ev.get("uid")
+        exe = ev.get("exe")
+        name = ev.get("name")
+        lname = name.lower() if isinstance(name, str) else None
+        cands = []
+        for key in (("user", user), ("exe", exe), ("name", lname), ("uid", uid), ("type", etype), ("any", None)):
+            hit = index.get(key)
+            if hit:
+                cands.extend(hit)
+        ip = None
+        if self._prefixes:
+            raw = _event_ip(ev)
+            ip = _parse_ip(raw) if raw else None
+            if ip is not None:
+                for version, plen in self._prefixes:
+                    if version == ip[0]:
+                        hit = index.get(("net", _net_key(version, plen, ip[1])))
+                        if hit:
+                            cands.extend(hit)
+        best = None
+        for r in cands:
+            if (best is None or r.order < best.order) and r.matches(etype, user, uid, exe, name, ip):
+                best = r
+        return best
+
+
+_policy = {"current": None}
+_lock = threading.Lock()
+
+
+def get_policy():
+    p = _policy["current"]
+    if p is None:
+        with _lock:
+            if _policy["current"] is None:
+                _policy["current"] = Policy.load()
+            p = _policy["current"]
+    return p
+
+
+def reload(path=POLICY_PATH):
+    _policy["current"] = Policy.load(path)
+    return _policy["current"]
+
+
+def apply(ev):
+    """Evaluate once and tag the event; returns SUPPRESS, NO_ALERT or None."""
+    rule = get_policy().lookup(ev)
+    if rule is None:
+        return None
+    metrics.inc("hids_policy_matches_total", labels={"rule": rule.name, "action": rule.action})
+    if rule.action == NO_ALERT:
+        ev["policy"] = rule.name
+    return rule.action
+
+
+def quiet(ev):
+    """True if the event must not be alerted (already tagged, or a matching rule)."""
+    if ev.get("policy"):
+        return True
+    return apply(ev) is not None
+
+
+def needs_exe():
+    return get_policy().needs_exe
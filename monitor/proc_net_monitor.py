@@ -5,6 +5,9 @@ ProcNetMonitor - process monitor for mini_hids.
 Features:
 - Detects new processes using psutil
 - Detects suspicious processes from rules.json
+- Hashes new processes' executables against known-bad/good sets (monitor/exe_hash.py)
+- Flags rare processes and summarizes frequent ones (monitor/baseline.py)
+- Checkpoints the process table and reports what started while it was down (storage/state.py)
 - Logs all events to encrypted DB
 """
 
@@ -12,42 +15,20 @@ import os
 import time
 import threading
 
-from utils.helpers import now_iso, read_json
+from utils.helpers import now_iso, lazy_import
 from storage.db import add_event
+from storage import state
+from monitor import policy
+from monitor.rules import load_rules
+from monitor.exe_hash import ExeHasher, KNOWN_BAD
+from monitor.baseline import ProcessBaseline, RARE, FREQUENT
+from config import EXE_HASH, PROC_BASELINE, CHECKPOINT
+from utils import metrics
 
-try:
-    import psutil
-except Exception:
-    psutil = None
+psutil = lazy_import("psutil")   # None if not installed; loaded on first use
 
-# Paths
-BASE_DIR = os.path.dirname(__file__)
-RULES_PATH = os.path.join(BASE_DIR, "..", "rules.json")
-CREDS_PATH = os.path.join(BASE_DIR, "..", "assets", "teacher_creds.json")
-
-# Load suspicious process names
-
-def _load_suspicious():
-    try:
-        rules = read_json(RULES_PATH, default={})
-        return [x.lower() for x in rules.get("suspicious_processes", [])]
-    except Exception:
-        return []
-
-SUSPICIOUS = _load_suspicious()
-
-
-# Load teacher username
-
-def _load_teacher():
-    try:
-        obj = read_json(CREDS_PATH, default={})
-        u = obj.get("username") or ""
-        return u.strip()
-    except Exception:
-        return ""
-
-TEACHER_USER = _load_teacher()
+# Suspicious process names (rules.json, loaded once)
+SUSPICIOUS = {x.lower() for x in load_rules()["suspicious_processes"]}
 
 # Build stable rate key (PREVENT MULTIPLE EMAILS)
 
@@ -77,6 +58,10 @@ class ProcNetMonitor:
     def __init__(self, polling_interval=1.0):
         self.polling = float(polling_interval)
         self._prev_snapshot = {}
+        self.alert_callback = None
+        self.emit = add_event   # replaced by offline replay (monitor/replay.py)
+        self.hasher = None      # monitor/exe_hash.py, live runs only (set in run_loop)
+        self.baseline = None    # monitor/baseline.py, live runs only (set in run_loop)
 
     def _snapshot(self):
         """Take snapshot of processes."""
@@ -85,13 +70,13 @@ class ProcNetMonitor:
             return result
 
         try:
-            for p in psutil.process_iter(['name', 'username']):
+            for p in psutil.process_iter(['name', 'username', 'ppid', 'create_time']):
                 try:
                     info = p.info
                     name = info.get("name") or ""
                     raw_user = info.get("username") or ""
                     user = raw_user.split("\\")[-1].split("/")[-1]
-                    result[int(p.pid)] = (name, user)
+                    result[int(p.pid)] = (name, user, info.get("ppid"), round(info.get("create_time") or 0, 2))
                 except Exception:
                     continue
         except Exception:
@@ -111,60 +96,189 @@ class ProcNetMonitor:
             "_rate_seconds": _proc_rate_seconds()
         }
 
-    def run_loop(self, stop_event, alert_callback):
-    """Main monitoring loop without sending emails."""
-    if psutil is None:
-        add_event({"ts": now_iso(), "type": "proc_monitor_missing_psutil"})
-        return
-
-    try:
-        self._prev_snapshot = self._snapshot()
-    except Exception:
-        self._prev_snapshot = {}
-
-    while not stop_event.is_set():
+    def _exe(self, pid):
         try:
-            time.sleep(self.polling)
-            cur = self._snapshot()
-
-            new_pids = set(cur.keys()) - set(self._prev_snapshot.keys())
-            for pid in sorted(new_pids):
-                name, user = cur.get(pid, ("", ""))
-
-                # Ignore teacher-owned processes
-                if user and user == TEACHER_USER:
-                    add_event({
-                        "ts": now_iso(),
-                        "type": "process_ignored_teacher",
-                        "pid": pid,
-                        "name": name,
-                        "user": user
-                    })
-                    continue
-
-                # Normal process event
-                ev = self._ev("process_start", pid, name, user)
+            return psutil.Process(pid).exe() if psutil else None
+        except Exception:
+            return None
+
+    def _alert(self, ev):
+        # scored and queued by HIDS.alert (monitor/severity.py, monitor/alerting.py)
+        if self.alert_callback:
+            try:
+                self.alert_callback(ev)
+            except Exception:
+                pass
+
+    def _parent(self, cur, ppid):
+        p = cur.get(ppid) or self._prev_snapshot.get(ppid)
+        return p[0] if p else ""
+
+    def process_snapshot(self, cur):
+        """Diff a snapshot against the previous one and log new processes."""
+        new_pids = set(cur.keys()) - set(self._prev_snapshot.keys())
+        want_exe = policy.needs_exe()
+        for pid in sorted(new_pids):
+            name, user, *rest = cur.get(pid, ("", ""))
+
+            # Normal process event (whitelist policy decides once per process)
+            ev = self._ev("process_start", pid, name, user)
+            if self.hasher is not None:
+                ev.update(self.hasher.check(pid))
+            if want_exe and not ev.get("exe"):
+                ev["exe"] = self._exe(pid)
+            action = policy.apply(ev)
+
+            # Known-bad binary, whatever it is called and whatever the policy trusts
+            if ev.get("hash_verdict") == KNOWN_BAD:
+                bad = self._ev("known_bad_executable", pid, name, user)
+                bad.update(exe=ev.get("exe"), sha256=ev["sha256"])
                 try:
-                    add_event(ev)  # log only, no email
+                    self.emit(bad)
                 except Exception:
                     pass
-
-                # Suspicious process
-                if name.lower() in SUSPICIOUS:
-                    sev = self._ev("suspicious_process", pid, name, user)
+                self._alert(bad)
+
+            if action == policy.SUPPRESS:
+                continue
+
+            # Rare for this host / user, or frequent enough to be summarized
+            verdict = None
+            if self.baseline is not None:
+                ev["parent"] = self._parent(cur, rest[0]) if rest else ""
+                verdict, scope, host_n, user_n = self.baseline.observe(user, name, ev["parent"], ev.get("exe"))
+                if verdict == RARE:
+                    rare = self._ev("process_rare", pid, name, user)
+                    rare.update(parent=ev["parent"], exe=ev.get("exe"), scope=scope,
+                                host_count=round(host_n, 1), user_count=round(user_n, 1))
+                    if "policy" in ev:
+                        rare["policy"] = ev["policy"]
                     try:
-                        add_event(sev)  # log only, no email
+                        self.emit(rare)
                     except Exception:
                         pass
+                    self._alert(rare)
 
-            self._prev_snapshot = cur
-
-        except Exception as e:
-            add_event({"ts": now_iso(), "type": "proc_monitor_error", "error": str(e)})
-            time.sleep(1)
-
-    add_event({"ts": now_iso(), "type": "proc_monitor_stopped"})
+            if verdict == FREQUENT and name.lower() not in SUSPICIOUS and ev.get("hash_verdict") != KNOWN_BAD:
+                for summary in self.baseline.fold(ev):
+                    try:
+                        self.emit(summary)
+                    except Exception:
+                        pass
+                continue
+            try:
+                self.emit(ev)  # log only, no email
+            except Exception:
+                pass
+
+            # Suspicious process
+            if name.lower() in SUSPICIOUS:
+                sev = self._ev("suspicious_process", pid, name, user)
+                if "policy" in ev:
+                    sev["policy"] = ev["policy"]
+                try:
+                    self.emit(sev)
+                except Exception:
+                    pass
+                self._alert(sev)
+
+        self._prev_snapshot = cur
+
+    # checkpoints (storage/state.py)
+
+    def checkpoint(self):
+        rows = [[pid, v[3], v[0], v[1], v[2]] for pid, v in sorted(self._prev_snapshot.items()) if len(v) > 3]
+        state.save("proc", rows)
+
+    def restore(self, cur):
+        """Previous snapshot rebuilt from the checkpoint (None if unusable), plus a proc_downtime_diff event."""
+        rows, saved_at = state.load("proc")
+        if rows is None:
+            return None, None
+        prev = {}
+        reused = 0
+        for pid, ctime, name, user, ppid in rows:
+            now = cur.get(pid)
+            if now is not None and len(now) > 3 and now[3] != ctime:
+                reused += 1   # pid was recycled: the checkpointed process is gone, this one is new
+                continue
+            prev[pid] = (name, user, ppid, ctime)
+        ev = {"ts": now_iso(), "type": "proc_downtime_diff", "since": saved_at,
+              "started": sum(1 for pid in cur if pid not in prev),
+              "exited": sum(1 for pid in prev if pid not in cur) + reused, "checkpointed": len(rows)}
+        return prev, ev
 
+    def run_loop(self, stop_event, alert_callback):
+        """Main monitoring loop; only suspicious processes go to alert_callback."""
+        self.alert_callback = alert_callback
+        if psutil is None:
+            add_event({"ts": now_iso(), "type": "proc_monitor_missing_psutil"})
+            return
+
+        if EXE_HASH["enabled"] and self.hasher is None:
+            try:
+                self.hasher = ExeHasher()
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "exe_hash_init_failed", "error": str(e)})
+        if PROC_BASELINE["enabled"] and self.baseline is None:
+            try:
+                self.baseline = ProcessBaseline()
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "proc_baseline_init_failed", "error": str(e)})
 
+        try:
+            self._prev_snapshot = self._snapshot()
+        except Exception:
+            self._prev_snapshot = {}
+
+        # diff against the last checkpoint: processes started while we were down
+        saver = state.Every() if CHECKPOINT["enabled"] else None
+        if saver is not None:
+            try:
+                cur = self._prev_snapshot
+                prev, ev = self.restore(cur)
+                if prev is not None:
+                    add_event(ev)
+                    self._prev_snapshot = prev
+                    self.process_snapshot(cur)
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "proc_checkpoint_error", "error": str(e)})
+
+        while not stop_event.is_set():
+            try:
+                time.sleep(self.polling)
+                with metrics.timed("hids_snapshot_seconds", {"monitor": "proc"}):
+                    cur = self._snapshot()
+                metrics.set_gauge("hids_proc_tracked_pids", len(cur))
+                self.process_snapshot(cur)
+                if self.hasher is not None:
+                    self.hasher.maybe_save()
+                if self.baseline is not None:
+                    for summary in self.baseline.due():
+                        add_event(summary)
+                    self.baseline.maybe_save()
+                if saver is not None and saver.ready():
+                    self.checkpoint()
+
+            except Exception as e:
+                add_event({"ts": now_iso(), "type": "proc_monitor_error", "error": str(e)})
+                time.sleep(1)
+
+        if self.hasher is not None:
+            try:
+                self.hasher.save()
+            except Exception:
+                pass
+        if self.baseline is not None:
+            try:
+                for summary in self.baseline.flush():
+                    add_event(summary)
+                self.baseline.save()
+            except Exception:
+                pass
+        if saver is not None:
+            try:
+                self.checkpoint()
+            except Exception:
+                pass
         add_event({"ts": now_iso(), "type": "proc_monitor_stopped"})
-
@@ -0,0 +1,376 @@
+# monitor/replay.py
+"""
+Offline replay / forensic mode.
+
+Re-runs detection over historic input after rules.json or policy.json
+changed, using the live monitors' own parsing and detection code
+(AuthTailer._handle, ProcNetMonitor / NetMonitor.process_snapshot,
+_FileHandler._emit) with their storage sink and alert callback replaced.
+Nothing is emailed. Results go to a separate store (--out) and/or a
+JSON report.
+
+Inputs (detected from the file content; .gz is read transparently):
+
+- auth logs (/var/log/auth.log.1, secure-*.gz): classic syslog
+  ("Oct 18 12:34:56", local time, year taken from the file's mtime) or
+  RFC 3339 timestamps
+- snapshots written by `mini_hids snapshot`, one JSON object per line:
+      {"kind": "proc", "ts": ..., "procs": [[pid, name, user(, exe)], ...]}
+      {"kind": "net",  "ts": ..., "conns": [[pid, status, local, remote], ...],
+                                  "listens": [[pid, local], ...]}
+  The first snapshot of a file is diffed against nothing, so every
+  process and socket in it is checked.
+- exported events: a JSON array (GUI export / get_events rows) or JSON
+  lines. suspicious_* entries are dropped and re-derived from the
+  process / connection events they came from.
+
+Work is split into tasks and run on a process pool: plain-text logs and
+JSONL exports in REPLAY_CHUNK_MB byte ranges on line boundaries, JSON
+arrays in slices, gzip files and snapshot files (each diff depends on
+the previous snapshot) as one task each. Results are consumed in input
+order, so the output store and report are deterministic.
+
+Workers only mark the events the monitors would alert on. Scoring runs
+in the parent after all tasks finished, over the marked events sorted by
+event time, so severity correlation (same ip / user / process within
+the window) sees the whole history whichever task an event came from and
+does not depend on how the input was split. Marked events are held in
+memory until then and written to the output store after the others.
+"""
+
+import gzip
+import heapq
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from config import REPLAY_CHUNK_MB, REPLAY_TOP_ALERTS, ALERT_MIN_SEVERITY
+from monitor import policy, severity
+from monitor.file_monitor import _FileHandler
+from monitor.login_monitor import AuthTailer, log_ts, parse_line
+from monitor.net_monitor import NetMonitor
+from monitor.proc_net_monitor import ProcNetMonitor
+from utils.helpers import now_iso
+
+AUTH, SNAPSHOTS, EVENTS, EVENTS_ARRAY = "auth", "snapshots", "events", "events_array"
+DERIVED = ("suspicious_process", "suspicious_connection", "suspicious_listen")
+ARRAY_SLICE = 20000   # exported events per task
+
+
+# timestamps
+
+def _epoch(ts):
+    try:
+        return datetime.fromisoformat(ts.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    except Exception:
+        return None
+
+
+# input
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _lines(path, start=0, end=None):
+    """Lines starting in [start, end) (a line straddling start belongs to the previous range)."""
+    with _open(path) as f:
+        if end is None:
+            yield from f
+            return
+        pos = start
+        if start:
+            f.seek(start - 1)
+            pos += len(f.readline()) - 1
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+def sniff(path):
+    with _open(path) as f:
+        head = f.read(4096).lstrip()
+    if head.startswith(b"["):
+        return EVENTS_ARRAY
+    if head.startswith(b"{"):
+        try:
+            first = json.loads(head.split(b"\n", 1)[0])
+        except ValueError:
+            first = {}
+        return SNAPSHOTS if first.get("kind") in ("proc", "net") else EVENTS
+    return AUTH
+
+
+def plan(paths, chunk_mb=REPLAY_CHUNK_MB):
+    """Split inputs into tasks: (kind, path, start, end, items)."""
+    chunk = max(int(chunk_mb * 1024 * 1024), 64 * 1024)
+    tasks = []
+    for path in paths:
+        kind = sniff(path)
+        if kind == EVENTS_ARRAY:
+            with _open(path) as f:
+                items = json.load(f)
+            for i in range(0, len(items), ARRAY_SLICE):
+                tasks.append((EVENTS, path, None, None, items[i:i + ARRAY_SLICE]))
+        elif kind == SNAPSHOTS or path.endswith(".gz"):
+            tasks.append((kind, path, 0, None, None))
+        else:
+            size = os.path.getsize(path)
+            for start in range(0, max(size, 1), chunk):
+                tasks.append((kind, path, start, min(start + chunk, size), None))
+    return tasks
+
+
+# detection
+
+class _Sink:
+    """Storage sink and alert callback handed to the monitors for one task."""
+
+    def __init__(self):
+        self.events = []
+        self.ts = None
+        self.fold = None   # (type, count / first_ts / last_ts) of the exported row being replayed
+
+    def emit(self, ev):
+        if self.ts:
+            ev["ts"] = self.ts
+        if self.fold and ev.get("type") == self.fold[0]:
+            ev.update(self.fold[1])   # a folded row (storage/dedup.py) still stands for count events
+        self.events.append(ev)
+
+    def alert(self, ev):
+        # scored in the parent, in event-time order across tasks (replay())
+        if self.ts:
+            ev["ts"] = self.ts
+        ev["_alert"] = True
+
+
+class _Detectors:
+    def __init__(self, sink):
+        self.sink = sink
+        self.auth = AuthTailer(path=None)
+        self.auth.emit = sink.emit
+        self.auth.set_alert_callback(sink.alert)
+        self.proc = ProcNetMonitor()
+        self.net = NetMonitor()
+        self.exes = {}
+        self.proc._exe = self.exes.get
+        for m in (self.proc, self.net):
+            m.emit = sink.emit
+            m.alert_callback = sink.alert
+        self.net.clock = lambda: _epoch(sink.ts or "") or time.time()
+        self.files = _FileHandler(emit=sink.emit, alert_callback=sink.alert)
+
+    def auth_lines(self, lines, year, month):
+        n = 0
+        for raw in lines:
+            n += 1
+            line = raw.decode("utf-8", "replace")
+            ev = parse_line(line)
+            if ev:
+                ev["ts"] = log_ts(line, year, month) or ev["ts"]
+                self.auth._handle(ev)
+        return n
+
+    def snapshots(self, lines):
+        n = 0
+        for raw in lines:
+            try:
+                snap = json.loads(raw)
+            except ValueError:
+                continue
+            n += 1
+            self.sink.ts = snap.get("ts")
+            if snap.get("kind") == "proc":
+                cur = {}
+                self.exes.clear()
+                for p in snap.get("procs", []):
+                    cur[int(p[0])] = (p[1] or "", p[2] or "")
+                    if len(p) > 3:
+                        self.exes[int(p[0])] = p[3]
+                self.proc.process_snapshot(cur)
+            elif snap.get("kind") == "net":
+                self.net.process_snapshot({tuple(c) for c in snap.get("conns", [])},
+                                          {tuple(l) for l in snap.get("listens", [])})
+        self.sink.ts = None
+        return n
+
+    def event(self, obj):
+        """One exported event, through the stage that produced it originally."""
+        ev = obj.get("ev") if isinstance(obj.get("ev"), dict) else obj
+        ev = {k: v for k, v in ev.items() if not k.startswith("_") and k not in ("policy", "severity")}
+        etype = ev.get("type") or ""
+        if etype in DERIVED:
+            return False
+        ts = ev.get("ts")
+        self.sink.ts = ts
+        fold = {k: ev[k] for k in ("count", "first_ts", "last_ts") if k in ev}
+        self.sink.fold = (etype, fold) if fold else None
+        try:
+            if ev.get("raw") and etype.startswith(("auth_", "sudo_")):
+                self.auth._handle(parse_line(ev["raw"], ts))
+            elif etype == "process_start":
+                pid = int(ev.get("pid") or 0)
+                self.exes.clear()
+                self.exes[pid] = ev.get("exe")
+                self.proc._prev_snapshot = {}
+                self.proc.process_snapshot({pid: (ev.get("name") or "", ev.get("user") or "")})
+            elif etype == "net_connection":
+                self.net._prev_conns, self.net._prev_listens = set(), set()
+                self.net.process_snapshot({(ev.get("pid"), ev.get("status"), ev.get("local"), ev.get("remote"))}, set())
+            elif etype == "listening_port":
+                self.net._prev_conns, self.net._prev_listens = set(), set()
+                self.net.process_snapshot(set(), {(ev.get("pid"), ev.get("local"))})
+            elif etype in ("file_created", "file_modified", "file_deleted"):
+                self.files._emit(etype, ev.get("path"), ts=ts, user=ev.get("user") or "")
+            else:
+                action = policy.apply(ev)
+                if action != policy.SUPPRESS:
+                    self.sink.emit(ev)
+                    if action is None:
+                        self.sink.alert(ev)
+        finally:
+            self.sink.ts = self.sink.fold = None
+        return True
+
+    def events(self, items):
+        n = skipped = 0
+        for obj in items:
+            if isinstance(obj, (bytes, str)):
+                try:
+                    obj = json.loads(obj)
+                except ValueError:
+                    continue
+            if not isinstance(obj, dict):
+                continue
+            n += 1
+            if not self.event(obj):
+                skipped += 1
+        return n, skipped
+
+
+def _log_year(path):
+    t = time.localtime(os.path.getmtime(path))
+    return t.tm_year, t.tm_mon
+
+
+def run_task(task):
+    """Worker entry point: ([emitted events], {"records": n, "skipped": n})."""
+    kind, path, start, end, items = task
+    sink = _Sink()
+    det = _Detectors(sink)
+    skipped = 0
+    if kind == AUTH:
+        n = det.auth_lines(_lines(path, start, end), *_log_year(path))
+    elif kind == SNAPSHOTS:
+        n = det.snapshots(_lines(path, start, end))
+    else:
+        n, skipped = det.events(items if items is not None else _lines(path, start, end))
+    return sink.events, {"records": n, "skipped": skipped}
+
+
+# driver
+
+def replay(paths, out_root=None, jobs=None, chunk_mb=REPLAY_CHUNK_MB, top=REPLAY_TOP_ALERTS):
+    """Replay paths through detection; returns a report dict. Writes events to out_root if given."""
+    t0 = time.time()
+    tasks = plan(paths, chunk_mb)
+    if not jobs:
+        try:
+            jobs = len(os.sched_getaffinity(0))
+        except AttributeError:
+            jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(tasks) or 1))
+
+    db = None
+    if out_root:
+        from storage import db
+        db.set_storage_root(out_root)
+        db.init_db()
+
+    by_type, by_level = Counter(), Counter()
+    counts = {"records": 0, "skipped": 0, "events": 0, "alerts": 0}
+    best = []      # min-heap of (severity, seq, event), size <= top
+    marked = []    # (event time, seq, event) of events to score
+    seq = 0
+
+    if jobs == 1:
+        results = map(run_task, tasks)
+        pool = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        results = pool.map(run_task, tasks)
+    try:
+        for events, stats in results:
+            counts["records"] += stats["records"]
+            counts["skipped"] += stats["skipped"]
+            for ev in events:
+                alert = ev.get("_alert")
+                for k in [k for k in ev if k.startswith("_")]:
+                    del ev[k]
+                counts["events"] += 1
+                by_type[ev.get("type") or "unknown"] += 1
+                seq += 1
+                if alert:
+                    t = _epoch(ev.get("ts") or "")
+                    marked.append((t if t is not None else float("inf"), seq, ev))
+                elif db is not None:
+                    db.add_event(ev, dedup=False)   # dedup windows are wall-clock; keep history row for row
+
+        severity.reset_correlation()
+        marked.sort(key=lambda m: m[:2])
+        for t, n, ev in marked:
+            sev = severity.score(ev, t if t != float("inf") else None)
+            if db is not None:
+                db.add_event(ev, dedup=False)
+            if sev < ALERT_MIN_SEVERITY:
+                continue
+            counts["alerts"] += 1
+            by_level[severity.level(sev)] += 1
+            if len(best) < top:
+                heapq.heappush(best, (sev, -n, ev))
+            elif top and sev > best[0][0]:
+                heapq.heapreplace(best, (sev, -n, ev))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if db is not None:
+            db.flush()
+
+    elapsed = time.time() - t0
+    return {
+        "ts": now_iso(),
+        "inputs": list(paths),
+        "tasks": len(tasks),
+        "jobs": jobs,
+        "elapsed_s": round(elapsed, 3),
+        "records_per_s": round(counts["records"] / max(elapsed, 1e-6), 1),
+        **counts,
+        "events_by_type": dict(by_type.most_common()),
+        "alerts_by_level": dict(by_level),
+        "top_alerts": [ev for _, _, ev in sorted(best, reverse=True)],
+        "out": out_root,
+    }
+
+
+def capture_snapshots(path, count=1, interval=1.0):
+    """Append process / socket snapshots of this host to path (input for replay)."""
+    proc, net = ProcNetMonitor(), NetMonitor()
+    with open(path, "a") as f:
+        for i in range(count):
+            if i:
+                time.sleep(interval)
+            ts = now_iso()
+            procs = proc._snapshot()
+            conns, listens = net._snapshot()
+            f.write(json.dumps({"kind": "proc", "ts": ts,
+                                "procs": [[pid, p[0], p[1]] for pid, p in procs.items()]}) + "\n")
+            f.write(json.dumps({"kind": "net", "ts": ts, "conns": [list(c) for c in conns],
+                                "listens": [list(l) for l in listens]}) + "\n")
+    return count
@@ -1,19 +1,28 @@
 # monitor/rules.py
-import json, os
+import os
 from utils.helpers import read_json
 
-RULES_PATH = "rules.json"
+RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rules.json")
 
-def load_rules():
-    r = read_json(RULES_PATH, default={})
-    return r
+_rules = {"loaded": None}
+
+def load_rules(reload=False):
+    """rules.json, read once per process and shared by all monitors."""
+    if _rules["loaded"] is None or reload:
+        r = read_json(RULES_PATH, default={}) or {}
+        r.setdefault("suspicious_processes", [])
+        r.setdefault("suspicious_ports", [])
+        r.setdefault("suspicious_filenames", [])
+        r.setdefault("bad_ips", [])
+        r.setdefault("content_signatures", [])
+        r.setdefault("known_bad_sha256", [])
+        r.setdefault("known_good_sha256", [])
+        _rules["loaded"] = r
+    return _rules["loaded"]
 
 def check_process_name(proc_name):
-    rules = load_rules()
-    s = rules.get("suspicious_processes", [])
+    s = load_rules()["suspicious_processes"]
     return any(x.lower() in proc_name.lower() for x in s)
 
 def check_port(port):
-    rules = load_rules()
-    return port in rules.get("suspicious_ports", [])
-
+    return port in load_rules()["suspicious_ports"]
@@ -0,0 +1,186 @@
+# monitor/scan_detect.py
+"""
+Port-scan and connection-fanout detection for NetMonitor.
+
+Every new connection NetMonitor sees is fed to ScanDetector.observe().
+Distinct counts over a sliding window (SCAN_DETECT["window"]) are kept
+per tracked key: exactly while a key has seen at most SPARSE_MAX distinct
+items, then in a small sliding HyperLogLog (monitor/sketches.py). Keys
+live in an LRU table of at most SCAN_DETECT["max_keys"], so memory is
+fixed no matter how much traffic there is:
+
+    inbound   remote ip -> distinct local ports        port_scan
+    inbound   local port -> distinct remote hosts      connection_fanin
+    outbound  (pid, remote host) -> distinct ports     port_scan
+    outbound  pid -> distinct remote hosts             connection_fanout
+
+A connection is inbound when its local port is listening, or when the
+local port is below the ephemeral range and the remote one inside it (the
+listener may be gone by the time the snapshot is taken). Connections to
+closed ports are never visible to psutil, so a remote scanner can only
+be seen on ports that accept: the inbound threshold
+(SCAN_DETECT["inbound_port_threshold"]) is therefore lower than the
+outbound one.
+
+A key over its threshold emits one event and is then flagged for a
+window. While it is flagged, its connection rows are not stored one by
+one (SCAN_DETECT["suppress_flows"]); they are counted and reported in a
+scan_flows_suppressed event when the flag expires.
+"""
+
+import time
+from collections import OrderedDict
+
+from config import SCAN_DETECT
+from monitor.sketches import SlidingHLL
+from utils.helpers import now_iso
+from utils import metrics
+
+SAMPLE = 10        # ports / hosts listed in an event
+SPARSE_MAX = 64    # distinct items kept exactly before a track switches to a HyperLogLog
+EPHEMERAL_LOW = 32768   # start of the Linux default ip_local_port_range
+
+
+def split_addr(addr):
+    host, _, port = (addr or "").rpartition(":")
+    try:
+        return host, int(port)
+    except ValueError:
+        return host, None
+
+
+def is_inbound(lport, rport, listen_ports):
+    if lport in listen_ports:
+        return True
+    return lport is not None and rport is not None and lport < EPHEMERAL_LOW <= rport
+
+
+class _Track:
+    __slots__ = ("exact", "hll", "sample", "flagged_until", "suppressed")
+
+    def __init__(self):
+        self.exact = {}    # item -> last seen, until SPARSE_MAX distinct items
+        self.hll = None    # then a SlidingHLL
+        self.sample = []
+        self.flagged_until = 0.0
+        self.suppressed = 0
+
+
+class ScanDetector:
+    def __init__(self, cfg=SCAN_DETECT):
+        self.cfg = cfg
+        self.window = float(cfg["window"])
+        self._tracks = OrderedDict()   # (kind, key) -> _Track
+        self._held = {}                # tracks with suppressed rows not yet reported
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def _track(self, tkey):
+        t = self._tracks.pop(tkey, None)
+        if t is None:
+            t = _Track()
+            while len(self._tracks) >= self.cfg["max_keys"]:
+                self._tracks.popitem(last=False)
+                metrics.inc("hids_scan_tracks_evicted_total")
+        self._tracks[tkey] = t
+        return t
+
+    def _count(self, tkey, item, threshold, now):
+        """Add item to the key's window; (track, estimate if the key just crossed the threshold)."""
+        t = self._track(tkey)
+        if t.hll is None:
+            # sparse: exact distinct count (most sources never see more than a few ports / hosts)
+            exact = t.exact
+            new = item not in exact
+            exact[item] = now
+            if not new:
+                return t, None
+            if len(exact) >= threshold:
+                cutoff = now - self.window
+                t.exact = exact = {k: v for k, v in exact.items() if v > cutoff}
+            if len(exact) > SPARSE_MAX:
+                t.hll = SlidingHLL(self.cfg["window"], self.cfg["buckets"], self.cfg["precision"])
+                for k, v in exact.items():
+                    t.hll.add(k, v)
+                t.exact = None
+            est = len(exact)
+        elif not t.hll.add(item, now):
+            return t, None   # no register changed: the estimate did not grow
+        else:
+            est = None
+        if len(t.sample) < SAMPLE and item not in t.sample:
+            t.sample.append(item)
+        if t.flagged_until > now:
+            return t, None
+        if est is None:
+            est = t.hll.estimate(now)
+        if est >= threshold:
+            t.flagged_until = now + self.window
+            return t, int(round(est))
+        return t, None
+
+    def observe(self, pid, laddr, raddr, listen_ports, now=None):
+        """([events], drop_row) for one new connection."""
+        if not raddr:
+            return [], False
+        now = now or time.time()
+        cfg = self.cfg
+        lhost, lport = split_addr(laddr)
+        rhost, rport = split_addr(raddr)
+        events, tracks = [], []
+
+        if is_inbound(lport, rport, listen_ports):
+            tkey = ("in", rhost)
+            t, est = self._count(tkey, lport, cfg["inbound_port_threshold"], now)
+            tracks.append((tkey, t))
+            if est:
+                events.append({"ts": now_iso(), "type": "port_scan", "direction": "inbound", "src": rhost,
+                               "dst": lhost, "distinct_ports": est, "ports": sorted(t.sample),
+                               "window": self.window})
+            tkey = ("dst", lport)
+            t, est = self._count(tkey, rhost, cfg["source_threshold"], now)
+            if est:
+                # not in `tracks`: a busy service's legitimate clients must not lose their rows
+                events.append({"ts": now_iso(), "type": "connection_fanin", "dst": lhost, "port": lport,
+                               "distinct_sources": est, "sources": t.sample[:SAMPLE], "window": self.window})
+        else:
+            tkey = ("out", pid, rhost)
+            t, est = self._count(tkey, rport, cfg["port_threshold"], now)
+            tracks.append((tkey, t))
+            if est:
+                events.append({"ts": now_iso(), "type": "port_scan", "direction": "outbound", "pid": pid,
+                               "src": lhost, "dst": rhost, "distinct_ports": est, "ports": sorted(t.sample),
+                               "window": self.window})
+            tkey = ("fan", pid)
+            t, est = self._count(tkey, rhost, cfg["host_threshold"], now)
+            tracks.append((tkey, t))
+            if est:
+                events.append({"ts": now_iso(), "type": "connection_fanout", "pid": pid, "src": lhost,
+                               "distinct_hosts": est, "hosts": t.sample[:SAMPLE], "window": self.window})
+
+        for ev in events:
+            metrics.inc("hids_scan_detections_total", labels={"type": ev["type"]})
+        drop = False
+        if cfg["suppress_flows"]:
+            for tkey, t in tracks:
+                if t.flagged_until > now:
+                    t.suppressed += 1
+                    self._held[tkey] = t
+                    drop = True
+        return events, drop
+
+    def expired(self, now=None):
+        """scan_flows_suppressed events for flags that ran out with rows held back."""
+        now = now or time.time()
+        out = []
+        if not self._held:
+            return out
+        for tkey, t in list(self._held.items()):
+            if t.flagged_until <= now:
+                kind, *key = tkey
+                out.append({"ts": now_iso(), "type": "scan_flows_suppressed", "track": kind,
+                            "key": key, "rows": t.suppressed})
+                t.suppressed = 0
+                del self._held[tkey]
+        return out
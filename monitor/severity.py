@@ -0,0 +1,149 @@
+# monitor/severity.py
+"""
+Severity scoring for the alert path.
+
+Every event headed for alerting gets a score from 0 to 100:
+
+    base score by type            SEVERITY["types"], else SEVERITY["default"]
+  + reputation                    suspicious process name / port / filename or a
+                                  known-bad IP from rules.json
+  + correlation                   earlier events from the same actor (ip, user or
+                                  process name) inside the correlation window
+    whitelisted (policy tag)      forced to 0
+
+The score is stored on the event as ev["severity"] (scored once; later
+calls reuse it) and mapped to a level used for queue priority and rate
+budgets (monitor/alerting.py):
+
+    info < 20 <= low < 50 <= medium < 70 <= high < 90 <= critical
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import SEVERITY, ALERT_MIN_SEVERITY
+from monitor.rules import load_rules
+
+LEVELS = (("critical", 90), ("high", 70), ("medium", 50), ("low", 20), ("info", 0))
+
+_TYPES = SEVERITY["types"]
+_DEFAULT = SEVERITY["default"]
+_REPUTATION = SEVERITY["reputation_bonus"]
+_WINDOW = SEVERITY["correlation_window"]
+_STEP = SEVERITY["correlation_step"]
+_MAX_CORR = SEVERITY["correlation_max"]
+_MAX_ACTORS = SEVERITY.get("correlation_actors", 4096)
+
+_rep = {"loaded": None}
+_actors = OrderedDict()   # actor -> deque of event times
+_lock = threading.Lock()
+
+
+def _reputation():
+    if _rep["loaded"] is None:
+        r = load_rules()
+        _rep["loaded"] = {
+            "procs": {x.lower() for x in r["suspicious_processes"]},
+            "ports": {int(p) for p in r["suspicious_ports"]},
+            "files": {x.lower() for x in r["suspicious_filenames"]},
+            "ips": set(r.get("bad_ips", [])),
+        }
+    return _rep["loaded"]
+
+
+def _port(addr):
+    try:
+        return int(str(addr).rsplit(":", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _host(addr):
+    return str(addr).rsplit(":", 1)[0].strip("[]") if addr else None
+
+
+def reputation_hits(ev):
+    rep = _reputation()
+    hits = 0
+    name = ev.get("name") or ev.get("procname")
+    if name and name.lower() in rep["procs"]:
+        hits += 1
+    for addr in (ev.get("remote"), ev.get("local")):
+        if addr and _port(addr) in rep["ports"]:
+            hits += 1
+            break
+    path = ev.get("path")
+    if path and path.replace("\\", "/").rsplit("/", 1)[-1].lower() in rep["files"]:
+        hits += 1
+    ip = ev.get("ip") or _host(ev.get("remote"))
+    if ip and ip in rep["ips"]:
+        hits += 1
+    return hits
+
+
+def _actor(ev):
+    ip = ev.get("ip") or _host(ev.get("remote"))
+    if ip:
+        return "ip:" + ip
+    user = ev.get("user") or ev.get("user_entered")
+    if user:
+        return "user:" + user
+    name = ev.get("name")
+    return "proc:" + name if name else None
+
+
+def reset_correlation():
+    """Forget all actors (offline replay scores a fresh history)."""
+    with _lock:
+        _actors.clear()
+
+
+def correlation_hits(ev, now=None):
+    """Earlier events from the same actor in the window (this event is recorded too)."""
+    actor = _actor(ev)
+    if actor is None:
+        return 0
+    now = now or time.time()
+    with _lock:
+        q = _actors.pop(actor, None)
+        if q is None:
+            q = deque()
+        while q and now - q[0] > _WINDOW:
+            q.popleft()
+        hits = len(q)
+        q.append(now)
+        _actors[actor] = q
+        while len(_actors) > _MAX_ACTORS:
+            _actors.popitem(last=False)
+    return hits
+
+
+def score(ev, now=None):
+    """Severity 0-100; computed once per event and kept in ev["severity"].
+
+    now is the event time for correlation (offline replay); default is the wall clock.
+    """
+    s = ev.get("severity")
+    if isinstance(s, int):
+        return s
+    if ev.get("policy"):
+        s = 0
+    else:
+        s = _TYPES.get(ev.get("type"), _DEFAULT)
+        s += _REPUTATION * reputation_hits(ev)
+        s += min(_STEP * correlation_hits(ev, now), _MAX_CORR)
+        s = max(0, min(100, s))
+    ev["severity"] = s
+    return s
+
+
+def level(s):
+    for name, floor in LEVELS:
+        if s >= floor:
+            return name
+    return "info"
+
+
+def should_alert(ev):
+    return score(ev) >= ALERT_MIN_SEVERITY
@@ -0,0 +1,203 @@
+# monitor/sketches.py
+"""
+Fixed-memory probabilistic counters used by the behavioural detectors.
+
+HyperLogLog      distinct-count estimate in 2**p one-byte registers
+SlidingHLL       HyperLogLog over a sliding time window: a ring of
+                 per-bucket register arrays, merged (register-wise max)
+                 when estimated
+CountMinSketch   frequency estimate in depth x width float counters,
+                 with exponential decay (old observations fade out)
+"""
+
+import hashlib
+import math
+import struct
+from array import array
+
+_MASK64 = (1 << 64) - 1
+
+
+def hash64(item):
+    """Stable 64-bit hash (str / bytes / anything with a stable repr)."""
+    if not isinstance(item, bytes):
+        item = str(item).encode()
+    return int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), "big")
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+_POW = [2.0 ** -i for i in range(66)]
+
+
+def _linear(m, zeros):
+    """Linear-counting estimate, or None when the raw HyperLogLog estimate applies."""
+    if zeros:
+        lc = m * math.log(m / zeros)
+        if lc <= 2.5 * m:
+            return lc
+    return None
+
+
+def hll_estimate(registers):
+    m = len(registers)
+    lc = _linear(m, registers.count(0))
+    if lc is not None:
+        return lc   # small cardinalities
+    return _alpha(m) * m * m / sum(map(_POW.__getitem__, registers))
+
+
+class HyperLogLog:
+    def __init__(self, p=8):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, item):
+        """Returns True if a register changed (the estimate may have moved)."""
+        return self.add_hash(hash64(item))
+
+    def add_hash(self, x):
+        idx = x >> (64 - self.p)
+        w = (x << self.p) & _MASK64
+        rho = min(64 - w.bit_length() + 1, 64 - self.p + 1)
+        if rho > self.registers[idx]:
+            self.registers[idx] = rho
+            return True
+        return False
+
+    def estimate(self):
+        return hll_estimate(self.registers)
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class SlidingHLL:
+    """Distinct count over the last `window` seconds, in `buckets` steps."""
+
+    def __init__(self, window=60.0, buckets=6, p=8):
+        self.width = float(window) / buckets
+        self.p = p
+        # slot -> [bucket number, registers, bitmask of non-zero registers]
+        self.ring = [None] * buckets
+
+    def _bucket(self, now):
+        n = int(now // self.width)
+        slot = n % len(self.ring)
+        cur = self.ring[slot]
+        if cur is None or cur[0] != n:
+            cur = self.ring[slot] = [n, bytearray(1 << self.p), 0]
+        return cur
+
+    def add(self, item, now):
+        cur = self._bucket(now)
+        regs = cur[1]
+        x = hash64(item)
+        idx = x >> (64 - self.p)
+        w = (x << self.p) & _MASK64
+        rho = min(64 - w.bit_length() + 1, 64 - self.p + 1)
+        if rho > regs[idx]:
+            regs[idx] = rho
+            cur[2] |= 1 << idx
+            return True
+        return False
+
+    def estimate(self, now):
+        oldest = int(now // self.width) - len(self.ring) + 1
+        live = [c for c in self.ring if c is not None and c[0] >= oldest]
+        if not live:
+            return 0.0
+        # small counts (the detection range) need only the zero count: OR the bitmasks
+        m = 1 << self.p
+        nonzero = 0
+        for c in live:
+            nonzero |= c[2]
+        lc = _linear(m, m - nonzero.bit_count())
+        if lc is not None:
+            return lc
+        merged = live[0][1] if len(live) == 1 else bytearray(map(max, *(c[1] for c in live)))
+        return hll_estimate(merged)
+
+
+class CountMinSketch:
+    """Decaying count-min sketch: estimate(key) never under-counts, over-counts by collisions only.
+
+    Decay is lazy: an observation at time t adds 2**((t - t0) / half_life)
+    instead of 1, and estimates divide by the current weight, so nothing
+    is rescanned until the weight gets large (then counters are rescaled
+    once and t0 moves forward).
+    """
+
+    _HEADER = struct.Struct(">4sBIIdd")   # magic, version, width, depth, t0, half_life
+    _MAGIC = b"CMS1"
+    _RESCALE_AT = 2.0 ** 40
+
+    def __init__(self, width=4096, depth=4, half_life=7 * 86400.0, t0=0.0):
+        self.width = int(width)
+        self.depth = int(depth)
+        self.half_life = float(half_life)
+        self.t0 = float(t0)
+        self.counters = array("d", bytes(8 * self.width * self.depth))
+
+    def _cells(self, key):
+        if not isinstance(key, bytes):
+            key = str(key).encode()
+        digest = hashlib.blake2b(key, digest_size=4 * self.depth).digest()
+        w = self.width
+        return [row * w + int.from_bytes(digest[4 * row:4 * row + 4], "big") % w
+                for row in range(self.depth)]
+
+    def _weight(self, now):
+        if not self.t0:
+            self.t0 = now
+        return 2.0 ** ((now - self.t0) / self.half_life)
+
+    def _rescale(self, now):
+        f = 1.0 / self._weight(now)
+        c = self.counters
+        for i in range(len(c)):
+            c[i] *= f
+        self.t0 = now
+
+    def add(self, key, now, count=1.0):
+        """Add and return the (decayed) estimate after adding."""
+        wt = self._weight(now)
+        if wt > self._RESCALE_AT:
+            self._rescale(now)
+            wt = 1.0
+        c = self.counters
+        inc = count * wt
+        est = None
+        for i in self._cells(key):
+            c[i] += inc
+            if est is None or c[i] < est:
+                est = c[i]
+        return est / wt
+
+    def estimate(self, key, now):
+        c = self.counters
+        return min(c[i] for i in self._cells(key)) / self._weight(now)
+
+    def to_bytes(self):
+        return self._HEADER.pack(self._MAGIC, 1, self.width, self.depth, self.t0, self.half_life) + \
+            self.counters.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, _, width, depth, t0, half_life = cls._HEADER.unpack_from(data)
+        if magic != cls._MAGIC:
+            raise ValueError("not a count-min sketch")
+        cms = cls(width, depth, half_life, t0)
+        body = data[cls._HEADER.size:]
+        if len(body) != 8 * width * depth:
+            raise ValueError("truncated count-min sketch")
+        cms.counters = array("d", body)
+        return cms
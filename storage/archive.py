@@ -0,0 +1,424 @@
+# storage/archive.py
+"""
+Columnar, compressed, chunk-encrypted archive for cold event history.
+
+Aged day segments are rolled into one archive file each
+(storage/archive/events-YYYYMMDD.hca) and the sqlite segment is dropped.
+
+File layout:
+
+    b"HCA1"
+    column chunks ...                     (AES-GCM sealed, zlib compressed)
+    footer JSON                           (plaintext block index)
+    HMAC-SHA256 of the footer (32 bytes)
+    u32 footer length, b"HCA1"
+
+Rows are grouped into blocks of BLOCK_ROWS. Each block stores four
+columns as separate chunks:
+
+    id     int64 deltas (array "q")
+    ts     newline-joined ISO timestamps
+    type   per-block dictionary + uint16 codes
+    event  newline-joined compact JSON (ts/type stripped, re-added on read)
+
+The footer lists every block with its id/ts range and distinct types, so
+scans skip blocks on ts/type predicates without decrypting anything, and
+only the projected columns of the surviving blocks are decrypted.
+A fresh data key is generated per file and stored wrapped by the
+keyring master key (utils.crypto_utils.wrap_key).
+
+The footer is authenticated with an HMAC keyed from the file's data key,
+so the block index (and with it predicate pushdown and TTL expiry)
+cannot be edited to hide blocks without the master key. A reader checks
+it before using the footer and raises ArchiveIntegrityError when it does
+not verify; such an archive is reported, never silently skipped.
+
+zlib is used rather than zstd so the archive needs nothing beyond the
+standard library and `cryptography`.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import struct
+import zlib
+from array import array
+from itertools import accumulate
+
+from utils.crypto_utils import aead, new_data_key, wrap_key, unwrap_key
+from utils.helpers import ensure_dir
+
+ARCHIVE_DIR = "storage/archive"
+ARCHIVE_PREFIX = "events-"
+ARCHIVE_SUFFIX = ".hca"
+MAGIC = b"HCA1"
+VERSION = 2   # 1 had an unauthenticated footer
+BLOCK_ROWS = 8192
+ZLEVEL = 6
+COLUMNS = ("id", "ts", "type", "event")
+
+
+def archive_path(day):
+    return os.path.join(ARCHIVE_DIR, f"{ARCHIVE_PREFIX}{day}{ARCHIVE_SUFFIX}")
+
+
+def list_archives():
+    """Return [(day, path)] oldest first."""
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except OSError:
+        return []
+    out = []
+    for n in sorted(names):
+        if n.startswith(ARCHIVE_PREFIX) and n.endswith(ARCHIVE_SUFFIX):
+            out.append((n[len(ARCHIVE_PREFIX):-len(ARCHIVE_SUFFIX)], os.path.join(ARCHIVE_DIR, n)))
+    return out
+
+
+def _aad(file_id, block_no, column):
+    return f"{file_id}:{block_no}:{column}".encode()
+
+
+def _footer_mac(dek, footer):
+    key = hmac.new(dek, b"mini_hids-archive-footer-v2", hashlib.sha256).digest()
+    return hmac.new(key, footer, hashlib.sha256).digest()
+
+
+class ArchiveIntegrityError(ValueError):
+    """The archive's footer is not authentic (edited, truncated or from an older format)."""
+
+
+# Writing
+
+class ArchiveWriter:
+    """Streams (id, ts, event_dict) rows in id order into an archive file."""
+
+    def __init__(self, path, segment=None, block_rows=BLOCK_ROWS):
+        self.path = path
+        self.tmp = path + ".tmp"
+        self.segment = segment
+        self.block_rows = block_rows
+        self.file_id = base64.urlsafe_b64encode(os.urandom(9)).decode()
+        self.dek = new_data_key()
+        self.aead = aead(self.dek)
+        self.blocks = []
+        self.rows = 0
+        self._buf = []
+        ensure_dir(path)
+        self._f = open(self.tmp, "wb")
+        self._f.write(MAGIC)
+
+    def _seal(self, block_no, column, raw):
+        nonce = os.urandom(12)
+        ct = self.aead.encrypt(nonce, zlib.compress(raw, ZLEVEL), _aad(self.file_id, block_no, column))
+        off = self._f.tell()
+        self._f.write(nonce)
+        self._f.write(ct)
+        return [off, 12 + len(ct)]
+
+    def _flush_block(self):
+        if not self._buf:
+            return
+        block_no = len(self.blocks)
+        ids = array("q")
+        prev = 0
+        ts_list, codes, payloads = [], array("H"), []
+        type_dict = {}
+        for rid, ts, ev in self._buf:
+            ids.append(rid - prev)
+            prev = rid
+            ts = ts or ""
+            ts_list.append(ts)
+            et = ev.get("type") or ""
+            code = type_dict.get(et)
+            if code is None:
+                code = type_dict[et] = len(type_dict)
+            codes.append(code)
+            rest = {k: v for k, v in ev.items() if k not in ("ts", "type") or (k == "ts" and v != ts)}
+            payloads.append(json.dumps(rest, separators=(",", ":"), default=str))
+        types = list(type_dict)
+        chunks = {
+            "id": self._seal(block_no, "id", ids.tobytes()),
+            "ts": self._seal(block_no, "ts", "\n".join(ts_list).encode()),
+            "type": self._seal(block_no, "type", json.dumps(types).encode() + b"\0" + codes.tobytes()),
+            "event": self._seal(block_no, "event", "\n".join(payloads).encode()),
+        }
+        nonempty_ts = [t for t in ts_list if t]
+        self.blocks.append({
+            "rows": len(self._buf),
+            "id_min": self._buf[0][0],
+            "id_max": self._buf[-1][0],
+            "ts_min": min(nonempty_ts) if nonempty_ts else "",
+            "ts_max": max(nonempty_ts) if nonempty_ts else "",
+            "types": types,
+            "chunks": chunks,
+        })
+        self.rows += len(self._buf)
+        self._buf = []
+
+    def add(self, rid, ts, ev):
+        self._buf.append((rid, ts, ev))
+        if len(self._buf) >= self.block_rows:
+            self._flush_block()
+
+    def close(self):
+        self._flush_block()
+        footer = json.dumps({
+            "version": VERSION,
+            "file_id": self.file_id,
+            "segment": self.segment,
+            "rows": self.rows,
+            "wrapped_key": base64.b64encode(wrap_key(self.dek)).decode(),
+            "columns": list(COLUMNS),
+            "blocks": self.blocks,
+        }, separators=(",", ":")).encode()
+        self._f.write(footer)
+        self._f.write(_footer_mac(self.dek, footer))
+        self._f.write(struct.pack("<I", len(footer)))
+        self._f.write(MAGIC)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self.tmp, self.path)
+        return self.rows
+
+    def abort(self):
+        try:
+            self._f.close()
+        finally:
+            try:
+                os.remove(self.tmp)
+            except OSError:
+                pass
+
+
+# Reading
+
+class ArchiveReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            f.seek(-8, os.SEEK_END)
+            tail = f.read(8)
+            if tail[4:] != MAGIC:
+                raise ValueError(f"not a mini_hids archive: {path}")
+            (flen,) = struct.unpack("<I", tail[:4])
+            try:
+                f.seek(-8 - 32 - flen, os.SEEK_END)
+            except OSError:
+                raise ArchiveIntegrityError(f"{path}: truncated footer")
+            raw = f.read(flen)
+            mac = f.read(32)
+        try:
+            footer = json.loads(raw)
+            version = footer.get("version")
+        except (ValueError, AttributeError):
+            raise ArchiveIntegrityError(f"{path}: unreadable footer")
+        if version != VERSION:
+            raise ArchiveIntegrityError(f"{path}: archive version {version!r} has no authenticated footer")
+        # fail closed: nothing in the footer is used before its MAC verifies
+        try:
+            dek = unwrap_key(base64.b64decode(footer["wrapped_key"]))
+        except Exception:
+            raise ArchiveIntegrityError(f"{path}: data key cannot be unwrapped")
+        if not hmac.compare_digest(_footer_mac(dek, raw), mac):
+            raise ArchiveIntegrityError(f"{path}: footer authentication failed")
+        self._aead = aead(dek)
+        self.footer = footer
+        self.file_id = footer["file_id"]
+        self.rows = footer["rows"]
+        self.blocks = footer["blocks"]
+
+    def _cipher(self):
+        return self._aead
+
+    def _open_chunk(self, f, block_no, column):
+        off, length = self.blocks[block_no]["chunks"][column]
+        f.seek(off)
+        blob = f.read(length)
+        raw = self._cipher().decrypt(blob[:12], blob[12:], _aad(self.file_id, block_no, column))
+        return zlib.decompress(raw)
+
+    def _decode(self, f, block_no, column):
+        raw = self._open_chunk(f, block_no, column)
+        if column == "id":
+            deltas = array("q")
+            deltas.frombytes(raw)
+            return list(accumulate(deltas))
+        if column == "ts":
+            return raw.decode().split("\n")
+        if column == "type":
+            head, _, body = raw.partition(b"\0")
+            names = json.loads(head)
+            codes = array("H")
+            codes.frombytes(body)
+            return [names[c] for c in codes]
+        return raw.decode().split("\n")
+
+    def block_matches(self, block, since=None, until=None, types=None):
+        """Predicate pushdown on the plaintext block index."""
+        if since and block["ts_max"] and block["ts_max"] < since:
+            return False
+        if until and block["ts_min"] and block["ts_min"] >= until:
+            return False
+        if types and not (set(block["types"]) & set(types)):
+            return False
+        return True
+
+    def scan_columns(self, since=None, until=None, types=None, columns=("id", "ts", "type"), reverse=False):
+        """
+        Yield one {column: list} dict per surviving block, decrypting only
+        the requested columns. Row-level ts/type filters are applied when
+        those columns are requested (they are fetched automatically if a
+        predicate needs them). reverse walks the blocks last to first.
+        """
+        need = list(columns)
+        if (since or until) and "ts" not in need:
+            need.append("ts")
+        if types and "type" not in need:
+            need.append("type")
+        wanted = set(types) if types else None
+        order = range(len(self.blocks) - 1, -1, -1) if reverse else range(len(self.blocks))
+        with open(self.path, "rb") as f:
+            for i in order:
+                block = self.blocks[i]
+                if not self.block_matches(block, since, until, types):
+                    continue
+                cols = {c: self._decode(f, i, c) for c in need}
+                # skip per-row filtering when the whole block is inside the predicate
+                full = ((not since or (block["ts_min"] and block["ts_min"] >= since)) and
+                        (not until or (block["ts_max"] and block["ts_max"] < until)) and
+                        (not wanted or set(block["types"]) <= wanted))
+                if not full:
+                    keep = []
+                    ts_col = cols.get("ts")
+                    ty_col = cols.get("type")
+                    for j in range(block["rows"]):
+                        if since and ts_col[j] < since:
+                            continue
+                        if until and ts_col[j] >= until:
+                            continue
+                        if wanted and ty_col[j] not in wanted:
+                            continue
+                        keep.append(j)
+                    cols = {c: [v[j] for j in keep] for c, v in cols.items()}
+                yield {c: cols[c] for c in columns}
+
+    def scan(self, since=None, until=None, types=None, reverse=False):
+        """Yield (id, ts, event_dict) in id order (newest first with reverse, one block in memory)."""
+        for cols in self.scan_columns(since, until, types, columns=("id", "ts", "type", "event"), reverse=reverse):
+            rows = zip(cols["id"], cols["ts"], cols["type"], cols["event"])
+            if reverse:
+                rows = reversed(list(rows))
+            for rid, ts, et, payload in rows:
+                ev = json.loads(payload) if payload else {}
+                if ts:
+                    ev.setdefault("ts", ts)
+                if et:
+                    ev["type"] = et
+                yield rid, ts, ev
+
+
+def iter_archived(since=None, until=None, types=None, newest_first=True):
+    """(id, ts, event_dict) across all archives, in the same order as db.iter_rows."""
+    archives = list_archives()
+    if newest_first:
+        archives.reverse()
+    for _, path in archives:
+        try:
+            reader = ArchiveReader(path)
+        except OSError:
+            continue   # dropped by retention meanwhile; ArchiveIntegrityError propagates
+        for r in reader.scan(since, until, types, reverse=newest_first):
+            yield r
+
+
+# Rolling segments into archives
+
+def expired_types(day, today=None, policy=None):
+    """Types whose RETENTION TTL has passed for a segment / archive day (all of them: None)."""
+    from datetime import datetime
+    from config import RETENTION
+
+    p = policy or RETENTION
+    today = today or datetime.utcnow().date()
+    age = (today - datetime.strptime(day, "%Y%m%d").date()).days
+    if age > int(p.get("default_days", 90)):
+        return None
+    return sorted(t for t, d in (p.get("type_days") or {}).items() if age > int(d))
+
+
+def archive_segment(day, seg_path, today=None, policy=None):
+    """
+    Copy one sqlite segment into an archive file. Returns the row count.
+    Rows of types already past their TTL are left out. Raises (and writes
+    nothing) if any row cannot be decrypted, so the segment is kept.
+    The caller drops the segment afterwards (see RetentionManager).
+    """
+    import storage.db as db
+
+    expired = expired_types(day, today, policy)
+    if expired is None:
+        return 0
+    where, params = "", []
+    if expired:
+        where = " WHERE etype IS NULL OR etype NOT IN (%s)" % ",".join("?" * len(expired))
+        params = expired
+    path = archive_path(day)
+    writer = ArchiveWriter(path, segment=day)
+    try:
+        conn = db.connect(seg_path)
+        try:
+            cur = conn.execute("SELECT id, ts, etype, enc_event FROM events" + where + " ORDER BY id ASC", params)
+            decrypt = db.row_decryptor(strict=True, segment=seg_path)
+            while True:
+                rows = cur.fetchmany(1000)
+                if not rows:
+                    break
+                for rid, ts, etype, enc in rows:
+                    try:
+                        ev = decrypt(enc)
+                    except Exception as e:
+                        raise ValueError(f"segment {day}: row {rid} cannot be decrypted ({type(e).__name__})")
+                    if "type" not in ev and etype:
+                        ev["type"] = etype
+                    if ev.get("type") in expired:
+                        continue   # legacy row without etype
+                    writer.add(rid, ts, ev)
+        finally:
+            conn.close()
+        return writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def expire_archive_types(day, path, types):
+    """
+    Rewrite an archive without the rows of `types` (their TTL passed after
+    the segment was archived). Only blocks whose index lists one of the
+    types are decoded; returns the rows removed (0: file left untouched).
+    """
+    reader = ArchiveReader(path)
+    types = set(types)
+    if not any(types & set(b["types"]) for b in reader.blocks):
+        return 0
+    writer = ArchiveWriter(path, segment=reader.footer.get("segment") or day)
+    removed = 0
+    try:
+        for rid, ts, ev in reader.scan():
+            if ev.get("type") in types:
+                removed += 1
+                continue
+            writer.add(rid, ts, ev)
+        if writer.rows + len(writer._buf) == 0:
+            writer.abort()
+            os.remove(path)
+        else:
+            writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return removed
@@ -0,0 +1,545 @@
+# storage/chain.py
+"""
+Tamper-evident hash chain over stored events.
+
+Every write transaction (one envelope batch, or one Fernet row) appends a
+link to the segment's `chain` table in the same transaction, so chaining
+adds no extra fsync to the insert path:
+
+    leaf   = sha256(id | ts | etype | enc_event)
+    digest = sum(leaf) mod 2**256         (multiset hash of the link's rows)
+    head   = sha256("link" | prev_head | seq | first_id | last_id | n | digest)
+
+Each segment starts with a genesis link that points at the previous
+segment's last head, so the chain continues across days.
+
+Retention may legitimately delete rows (per-type TTLs). It first appends
+a "prune" link and records, for every affected data link, the count and
+multiset digest of the removed rows in `chain_pruned`. Verification
+accepts a data link when present rows + pruned rows add up to its digest.
+Any other insert, edit or delete breaks it.
+
+A prune link only counts if it is signed (`chain_prune_sig`, same Ed25519
+key as the checkpoints) over the link head and what was removed: the
+event types and newest ts of the pruned rows, taken from the rows
+themselves. Verification lists every prune and rejects one that is
+unsigned, signed by another key, or not justified by RETENTION: every
+pruned type must be past its type_days (default_days otherwise) for the
+segment's day, under the retention policy the prune was made with
+(recorded in the signed metadata, so a later TTL change or a custom
+RetentionManager policy does not invalidate old prunes). Without the
+trusted key from the keyring nothing signed is accepted. A segment
+written before chaining existed is chained (adopt) before its first
+prune, so TTLs apply to it too.
+
+Signed checkpoints (Ed25519 via PyNaCl, key in the OS keyring) pin the
+current head of each segment and are appended to CHECKPOINT_FILE,
+outside the segments, so rewriting a segment's whole chain is detectable
+too.
+"""
+
+import hashlib
+import json
+import os
+import struct
+from bisect import bisect_right
+from datetime import datetime
+
+from config import CHAIN_SIGNING_KEY_NAME, RETENTION
+from utils.helpers import now_iso, ensure_dir
+
+CHECKPOINT_FILE = "storage/chain_checkpoints.jsonl"
+MOD = 1 << 256
+ZERO = b"\0" * 32
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS chain (
+        seq INTEGER PRIMARY KEY,
+        kind TEXT,
+        first_id INTEGER,
+        last_id INTEGER,
+        n INTEGER,
+        digest BLOB,
+        prev BLOB,
+        head BLOB
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS chain_pruned (
+        link_seq INTEGER,
+        prune_seq INTEGER,
+        n INTEGER,
+        digest BLOB
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_chain_pruned_link ON chain_pruned(link_seq)",
+    '''
+    CREATE TABLE IF NOT EXISTS chain_prune_sig (
+        prune_seq INTEGER PRIMARY KEY,
+        meta TEXT,
+        sig BLOB
+    )
+    ''',
+)
+
+_ID = struct.Struct(">q")
+_sha256 = hashlib.sha256
+_from_bytes = int.from_bytes
+_LINK = struct.Struct(">qqqq")
+
+
+def leaf(rid, ts, etype, enc):
+    return _sha256(b"".join((_ID.pack(rid), (ts or "").encode(), b"\0",
+                             (etype or "").encode(), b"\0", enc or b""))).digest()
+
+
+def add_digest(acc, d):
+    return (acc + int.from_bytes(d, "big")) % MOD
+
+
+def to_bytes(acc):
+    return acc.to_bytes(32, "big")
+
+
+def link_head(prev, seq, first_id, last_id, n, digest):
+    return hashlib.sha256(b"link" + prev + _LINK.pack(seq, first_id, last_id, n) + digest).digest()
+
+
+def genesis_head(prev, day):
+    return hashlib.sha256(b"genesis" + prev + (day or "").encode()).digest()
+
+
+def create(conn, day, prev_head=None):
+    """Create chain tables in a new segment and write its genesis link."""
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    if conn.execute("SELECT 1 FROM chain LIMIT 1").fetchone() is None:
+        prev = prev_head or ZERO
+        conn.execute("INSERT INTO chain (seq, kind, first_id, last_id, n, digest, prev, head) "
+                     "VALUES (0, 'genesis', 0, 0, 0, ?, ?, ?)",
+                     (ZERO, prev, genesis_head(prev, day)))
+
+
+def adopt(conn, day):
+    """Chain a segment written before chaining existed: genesis plus one data link over its rows."""
+    create(conn, day)
+    acc, n, lo, hi = 0, 0, None, None
+    for r in conn.execute("SELECT id, ts, etype, enc_event FROM events ORDER BY id"):
+        acc = add_digest(acc, leaf(*r))
+        n += 1
+        lo = r[0] if lo is None else lo
+        hi = r[0]
+    if n:
+        seq, prev = last_head(conn)
+        digest = to_bytes(acc)
+        conn.execute("INSERT INTO chain (seq, kind, first_id, last_id, n, digest, prev, head) "
+                     "VALUES (?, 'data', ?, ?, ?, ?, ?, ?)",
+                     (seq + 1, lo, hi, n, digest, prev, link_head(prev, seq + 1, lo, hi, n, digest)))
+    return n
+
+
+def last_head(conn):
+    try:
+        row = conn.execute("SELECT seq, head FROM chain ORDER BY seq DESC LIMIT 1").fetchone()
+    except Exception:
+        return None
+    return row
+
+
+def append(conn, rows, kind="data"):
+    """
+    Append a link for `rows` [(id, ts, etype, enc)] inside the caller's
+    open transaction. Returns the new head, or None if the segment has no
+    chain (created before chaining existed).
+    """
+    last = last_head(conn)
+    if last is None:
+        return None
+    seq, prev = last[0] + 1, last[1]
+    digest = to_bytes(sum(_from_bytes(leaf(*r), "big") for r in rows) % MOD)
+    first_id, last_id = rows[0][0], rows[-1][0]
+    head = link_head(prev, seq, first_id, last_id, len(rows), digest)
+    conn.execute("INSERT INTO chain (seq, kind, first_id, last_id, n, digest, prev, head) "
+                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                 (seq, kind, first_id, last_id, len(rows), digest, prev, head))
+    return head
+
+
+def record_prune(conn, where, params, day=None, policy=None):
+    """
+    Account for rows about to be deleted by `DELETE FROM events WHERE <where>`.
+    Must run in the same transaction as the DELETE. The prune link is signed
+    together with the retention policy applied (default RETENTION); raises if
+    the signing key is unavailable, which rolls the DELETE back.
+    """
+    if last_head(conn) is None:
+        adopt(conn, day)
+    links = conn.execute("SELECT first_id, seq FROM chain WHERE kind = 'data' ORDER BY first_id").fetchall()
+    starts = [l[0] for l in links]
+    per_link = {}
+    types = {}
+    total, total_n = 0, 0
+    lo = hi = None
+    max_ts = ""
+    cur = conn.execute(f"SELECT id, ts, etype, enc_event FROM events WHERE {where}", params)
+    for r in cur:
+        i = bisect_right(starts, r[0]) - 1
+        if i < 0:
+            continue   # row predates chaining in this segment
+        d = leaf(*r)
+        link_seq = links[i][1]
+        n, acc = per_link.get(link_seq, (0, 0))
+        per_link[link_seq] = (n + 1, add_digest(acc, d))
+        total = add_digest(total, d)
+        total_n += 1
+        lo = r[0] if lo is None else min(lo, r[0])
+        hi = r[0] if hi is None else max(hi, r[0])
+        types[r[2] or ""] = types.get(r[2] or "", 0) + 1
+        max_ts = max(max_ts, r[1] or "")
+    if not total_n:
+        return 0
+    seq, prev = last_head(conn)
+    seq += 1
+    digest = to_bytes(total)
+    head = link_head(prev, seq, lo, hi, total_n, digest)
+    p = policy or RETENTION
+    type_days = p.get("type_days") or {}
+    meta = {"ts": now_iso(), "segment": day, "seq": seq, "head": head.hex(), "n": total_n,
+            "types": types, "max_ts": max_ts,
+            "policy": {"default_days": int(p.get("default_days", 90)),
+                       "type_days": {t: int(type_days[t]) for t in types if t in type_days}}}
+    raw = json.dumps(meta, sort_keys=True, separators=(",", ":"))
+    sig = _signing_key().sign(raw.encode()).signature   # before writing anything
+    for stmt in SCHEMA:
+        conn.execute(stmt)   # segments chained before prune signatures existed
+    conn.execute("INSERT INTO chain (seq, kind, first_id, last_id, n, digest, prev, head) "
+                 "VALUES (?, 'prune', ?, ?, ?, ?, ?, ?)",
+                 (seq, lo, hi, total_n, digest, prev, head))
+    conn.executemany("INSERT INTO chain_pruned (link_seq, prune_seq, n, digest) VALUES (?, ?, ?, ?)",
+                     [(ls, seq, n, to_bytes(acc)) for ls, (n, acc) in per_link.items()])
+    conn.execute("INSERT INTO chain_prune_sig (prune_seq, meta, sig) VALUES (?, ?, ?)", (seq, raw, sig))
+    return total_n
+
+
+def prune_justified(meta, day, today=None, policy=None):
+    """
+    None if the policy the prune was made under (its signed meta; RETENTION
+    for prunes that predate that) allowed removing these types from this
+    segment day at the (signed) time of the prune, else the reason it did not.
+    """
+    p = policy or meta.get("policy") or RETENTION
+    try:
+        today = today or datetime.strptime(meta["ts"][:10], "%Y-%m-%d").date()
+        age = (today - datetime.strptime(day, "%Y%m%d").date()).days
+    except (KeyError, TypeError, ValueError):
+        return f"segment {day!r} / prune time has no day to check retention against"
+    type_days = p.get("type_days") or {}
+    early = [t for t in sorted(meta.get("types") or {})
+             if age <= int(type_days.get(t, p.get("default_days", 90)))]
+    if early:
+        return f"types {', '.join(early)} are not past their retention at age {age} days"
+    return None
+
+
+# Signed checkpoints
+
+def _signing_key(create=True):
+    import keyring
+    from nacl.signing import SigningKey
+
+    seed = keyring.get_password("mini_hids", CHAIN_SIGNING_KEY_NAME)
+    if seed:
+        return SigningKey(bytes.fromhex(seed))
+    if not create:
+        return None
+    sk = SigningKey.generate()
+    keyring.set_password("mini_hids", CHAIN_SIGNING_KEY_NAME, bytes(sk).hex())
+    return sk
+
+
+_last_signed = {}   # {segment: seq} heads already checkpointed by this process
+
+
+def _canonical(cp):
+    body = {k: cp[k] for k in ("ts", "segment", "seq", "head", "max_id")}
+    return json.dumps(body, sort_keys=True, separators=(",", ":")).encode()
+
+
+def checkpoint(path=None, force=False):
+    """Sign the current head of every changed segment and append to CHECKPOINT_FILE."""
+    import storage.db as db
+
+    sk = _signing_key()
+    vk = bytes(sk.verify_key).hex()
+    out = []
+    for day, seg in db.list_segments(include_legacy=False):
+        conn = db.connect(seg)
+        try:
+            last = last_head(conn)
+            if last is None or (not force and _last_signed.get(day) == last[0]):
+                continue
+            max_id = conn.execute("SELECT MAX(id) FROM events").fetchone()[0] or 0
+        finally:
+            conn.close()
+        cp = {"ts": now_iso(), "segment": day, "seq": last[0], "head": last[1].hex(), "max_id": max_id}
+        cp["sig"] = sk.sign(_canonical(cp)).signature.hex()
+        cp["vk"] = vk
+        out.append(cp)
+        _last_signed[day] = last[0]
+    if not out:
+        return out
+    path = path or CHECKPOINT_FILE
+    ensure_dir(path)
+    with open(path, "a", encoding="utf-8") as f:
+        for cp in out:
+            f.write(json.dumps(cp, separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return out
+
+
+def checkpoint_loop(stop_event, interval):
+    import storage.db as db
+
+    while not stop_event.wait(interval):
+        try:
+            db.flush()
+            checkpoint()
+        except Exception as e:
+            try:
+                db.add_event({"ts": now_iso(), "type": "chain_checkpoint_failed", "error": str(e)})
+            except Exception:
+                pass
+
+
+# Verification
+
+def _check_prune(pconn, seq, n, head, day, trusted_vk):
+    """(report entry, [errors]) for one prune link: signature and retention justification."""
+    import sqlite3
+    from nacl.signing import VerifyKey
+    from nacl.exceptions import BadSignatureError
+
+    info = {"seq": seq, "rows": n, "types": None, "max_ts": None, "signed": False, "justified": False}
+    try:
+        row = pconn.execute("SELECT meta, sig FROM chain_prune_sig WHERE prune_seq = ?", (seq,)).fetchone()
+    except sqlite3.Error:
+        row = None
+    if row is None:
+        return info, [f"link {seq}: prune is not signed ({n} rows removed)"]
+    errors = []
+    try:
+        meta = json.loads(row[0])
+        info.update(types=meta.get("types"), max_ts=meta.get("max_ts"), ts=meta.get("ts"),
+                    policy=meta.get("policy"))
+    except ValueError:
+        return info, [f"link {seq}: prune record unreadable"]
+    if trusted_vk is None:
+        errors.append(f"link {seq}: no trusted signing key in the keyring, prune cannot be checked")
+    else:
+        try:
+            VerifyKey(bytes.fromhex(trusted_vk)).verify(row[0].encode(), bytes(row[1]))
+            info["signed"] = True
+        except (BadSignatureError, ValueError, TypeError):
+            errors.append(f"link {seq}: bad prune signature")
+    if meta.get("seq") != seq or meta.get("head") != head.hex() or meta.get("n") != n or meta.get("segment") != day:
+        errors.append(f"link {seq}: prune record does not belong to this link")
+    reason = prune_justified(meta, day)
+    if reason:
+        errors.append(f"link {seq}: prune not justified by retention ({reason})")
+    else:
+        info["justified"] = True
+    return info, errors
+
+
+def verify_segment(path, day=None, batch=2000, trusted_vk=None):
+    """
+    Single streaming pass over one segment. Memory is bounded by one link
+    plus one fetch batch. Returns a report dict; "prunes" lists every prune link.
+    """
+    import sqlite3
+
+    rep = {"segment": day or path, "rows": 0, "links": 0, "errors": [], "unchained_rows": 0,
+           "first_prev": None, "head": None, "prunes": []}
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        try:
+            links = conn.execute("SELECT seq, kind, first_id, last_id, n, digest, prev, head FROM chain ORDER BY seq")
+        except sqlite3.Error:
+            rep["unchained_rows"] = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            rep["rows"] = rep["unchained_rows"]
+            return rep
+        has_prunes = conn.execute("SELECT 1 FROM chain_pruned LIMIT 1").fetchone() is not None
+        pconn = sqlite3.connect(path, timeout=10)
+        rows = conn.cursor().execute("SELECT id, ts, etype, enc_event FROM events ORDER BY id")
+        buf, pos = [], 0
+
+        def next_row():
+            nonlocal buf, pos
+            if pos >= len(buf):
+                buf, pos = rows.fetchmany(batch), 0
+                if not buf:
+                    return None
+            r = buf[pos]
+            pos += 1
+            return r
+
+        pending = next_row()
+        prev_head = None
+        want_seq = 0
+        for seq, kind, first_id, last_id, n, digest, prev, head in links:
+            rep["links"] += 1
+            if seq != want_seq:
+                rep["errors"].append(f"link {seq}: expected seq {want_seq} (links missing)")
+            want_seq = seq + 1
+            if kind == "genesis":
+                rep["first_prev"] = prev.hex()
+                if head != genesis_head(prev, day if day else ""):
+                    rep["errors"].append(f"link {seq}: genesis head mismatch")
+            else:
+                if prev_head is not None and prev != prev_head:
+                    rep["errors"].append(f"link {seq}: prev does not match previous head")
+                if head != link_head(prev, seq, first_id, last_id, n, digest):
+                    rep["errors"].append(f"link {seq}: head mismatch")
+            if kind == "data":
+                acc, cnt = 0, 0
+                while pending is not None and pending[0] <= last_id:
+                    if pending[0] < first_id:
+                        rep["unchained_rows"] += 1
+                    else:
+                        acc = add_digest(acc, leaf(*pending))
+                        cnt += 1
+                    rep["rows"] += 1
+                    pending = next_row()
+                if has_prunes:
+                    for pn, pd in pconn.execute("SELECT n, digest FROM chain_pruned WHERE link_seq = ?", (seq,)):
+                        acc = add_digest(acc, pd)
+                        cnt += pn
+                if cnt != n or to_bytes(acc) != digest:
+                    rep["errors"].append(f"link {seq}: rows {first_id}..{last_id} do not match digest "
+                                         f"({cnt} present+pruned, {n} chained)")
+            elif kind == "prune":
+                acc, cnt = 0, 0
+                for pn, pd in pconn.execute("SELECT n, digest FROM chain_pruned WHERE prune_seq = ?", (seq,)):
+                    acc = add_digest(acc, pd)
+                    cnt += pn
+                if cnt != n or to_bytes(acc) != digest:
+                    rep["errors"].append(f"link {seq}: prune record does not match its per-link entries")
+                info, errors = _check_prune(pconn, seq, n, head, day, trusted_vk)
+                rep["prunes"].append(info)
+                rep["errors"].extend(errors)
+            prev_head = head
+        while pending is not None:
+            rep["rows"] += 1
+            rep["errors"].append(f"row {pending[0]}: not covered by any link")
+            pending = next_row()
+            if len(rep["errors"]) > 1000:
+                break
+        rep["head"] = prev_head.hex() if prev_head else None
+        pconn.close()
+    finally:
+        conn.close()
+    return rep
+
+
+def _seq_head(path, seq):
+    import sqlite3
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        row = conn.execute("SELECT head FROM chain WHERE seq = ?", (seq,)).fetchone()
+        return row[0].hex() if row else None
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+
+def _has_head(path, head):
+    import sqlite3
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        return conn.execute("SELECT 1 FROM chain WHERE head = ? LIMIT 1", (head,)).fetchone() is not None
+    except sqlite3.Error:
+        return True   # unchained predecessor, nothing to compare against
+    finally:
+        conn.close()
+
+
+def verify_checkpoints(path=None, trusted_vk=None):
+    """Stream the checkpoint file; check signatures and that each pinned head still exists."""
+    import storage.db as db
+    from nacl.signing import VerifyKey
+    from nacl.exceptions import BadSignatureError
+
+    path = path or CHECKPOINT_FILE
+    rep = {"checkpoints": 0, "errors": [], "segments_dropped": set()}
+    if not os.path.exists(path):
+        return rep
+    segs = dict(db.list_segments(include_legacy=False))
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            rep["checkpoints"] += 1
+            if trusted_vk is None:
+                # never trust the key a checkpoint carries itself
+                if not rep["errors"]:
+                    rep["errors"].append("no trusted signing key in the keyring: checkpoints cannot be verified")
+                continue
+            try:
+                cp = json.loads(line)
+                if cp.get("vk") != trusted_vk:
+                    rep["errors"].append(f"checkpoint line {lineno}: signed by an unknown key")
+                    continue
+                VerifyKey(bytes.fromhex(trusted_vk)).verify(_canonical(cp), bytes.fromhex(cp["sig"]))
+            except BadSignatureError:
+                rep["errors"].append(f"checkpoint line {lineno}: bad signature")
+                continue
+            except Exception as e:
+                rep["errors"].append(f"checkpoint line {lineno}: unreadable ({e})")
+                continue
+            seg = segs.get(cp["segment"])
+            if seg is None:
+                rep["segments_dropped"].add(cp["segment"])
+                continue
+            if _seq_head(seg, cp["seq"]) != cp["head"]:
+                rep["errors"].append(f"checkpoint line {lineno}: segment {cp['segment']} link {cp['seq']} "
+                                     f"no longer has the signed head")
+    rep["segments_dropped"] = sorted(rep["segments_dropped"])
+    return rep
+
+
+def trusted_verify_key():
+    """The keyring's verify key, or None (verification never creates a key)."""
+    try:
+        sk = _signing_key(create=False)
+        return bytes(sk.verify_key).hex() if sk is not None else None
+    except Exception:
+        return None
+
+
+def verify_all(checkpoint_path=None):
+    """Verify every segment and the checkpoint log. Returns (ok, report)."""
+    import storage.db as db
+
+    db.flush()
+    report = {"segments": [], "checkpoints": None}
+    ok = True
+    prev_path = None
+    trusted = trusted_verify_key()
+    for day, path in db.list_segments(include_legacy=False):
+        rep = verify_segment(path, day, trusted_vk=trusted)
+        # chain continuity across days; only checkable while the previous segment
+        # still exists. Prune links may be appended to it later, so the genesis
+        # must match one of its heads rather than the last one.
+        if prev_path is not None and rep["first_prev"] not in (None, ZERO.hex()):
+            if not _has_head(prev_path, bytes.fromhex(rep["first_prev"])):
+                rep["errors"].append("genesis does not link to a head of the previous segment")
+        prev_path = path
+        ok = ok and not rep["errors"]
+        report["segments"].append(rep)
+    report["checkpoints"] = verify_checkpoints(checkpoint_path, trusted)
+    ok = ok and not report["checkpoints"]["errors"]
+    return ok, report
@@ -1,48 +1,667 @@
 # storage/db.py
+"""
+Encrypted event store.
+
+Events are written to time-partitioned segment databases, one sqlite file
+per UTC day under SEGMENT_DIR (events-YYYYMMDD.db). Each new segment
+continues the id sequence of the previous one, so ids stay globally
+increasing and "newest first" reads just walk segments newest to oldest.
+Old data is removed by dropping whole segment files (see
+storage/retention.py) instead of running large DELETEs.
+
+The original single-file DB (DB_PATH) is still read as the oldest segment
+if it exists, but nothing new is written to it.
+
+Encryption (config.STORAGE_ENCRYPTION):
+ - "envelope" (default): events are buffered and written in batches. Each
+   batch gets a fresh AES-256-GCM data key, stored once in the `batches`
+   table wrapped by the keyring master key. Every record is sealed on its
+   own under that key, so one row can still be decrypted without touching
+   the rest of its batch:
+       enc_event = b"\x01" | batch_id (8) | nonce (12) | ciphertext+tag
+ - "fernet": one standalone Fernet token per event (the original format).
+Both formats are always readable.
+"""
 import sqlite3
 import json
-from utils.crypto_utils import get_fernet
-from utils.helpers import ensure_dir
 import os
+import struct
+import threading
+import time
+import atexit
+import weakref
+from datetime import datetime
+from config import SEGMENT_DIR, STORAGE_ENCRYPTION, BATCH_SIZE, BATCH_MAX_DELAY, SPOOL_MAX_MB, SPOOL_HIGH_WATER, DEDUP
+from utils.crypto_utils import aead as new_aead, get_fernet, get_master_key, new_data_key, wrap_key, unwrap_key
+from utils.helpers import ensure_dir, now_iso
+from utils import metrics
+from storage import chain
+from storage.dedup import Deduplicator
 
-DB_PATH = "storage/logs_encrypted.db"
+DB_PATH = "storage/logs_encrypted.db"      # legacy single-file store
+SPOOL_PATH = "storage/spool.bin"           # fallback when writes fail (storage/spool.py)
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".db"
+LEGACY_DAY = "legacy"
 
-def init_db():
-    ensure_dir(DB_PATH)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS events (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ts TEXT,
-        enc_event BLOB
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def add_event(event_dict):
-    f = get_fernet()
-    enc = f.encrypt(json.dumps(event_dict).encode())
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO events (ts, enc_event) VALUES (?, ?)", (event_dict.get("ts"), enc))
-    conn.commit()
-    conn.close()
-
-def get_events(limit=100):
-    f = get_fernet()
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, ts, enc_event FROM events ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT,
+    enc_event BLOB,
+    etype TEXT
+)
+'''
+
+_BATCH_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batches (
+    id INTEGER PRIMARY KEY,
+    wrapped_key BLOB,
+    first_id INTEGER,
+    last_id INTEGER,
+    n INTEGER
+)
+'''
+
+ENCRYPTION_MODE = STORAGE_ENCRYPTION
+ENVELOPE_V1 = 0x01
+_ENV_HEADER = struct.Struct(">BQ12s")   # version, batch id, nonce
+
+_seg_lock = threading.Lock()
+_current = {"day": None, "path": None}
+_local = threading.local()   # per-thread writer connection, closed when the thread exits
+
+
+def set_storage_root(root):
+    """Point the store at another directory (benchmarks, replay output, ...)."""
+    global DB_PATH, SEGMENT_DIR, SPOOL_PATH
+    import storage.archive as archive
+    _write_folds(drain=True)   # repeats seen so far belong to the old store
+    if _pending:
+        flush()
+    _close_spool()
+    DB_PATH = os.path.join(root, "logs_encrypted.db")
+    SPOOL_PATH = os.path.join(root, "spool.bin")
+    SEGMENT_DIR = os.path.join(root, "segments")
+    archive.ARCHIVE_DIR = os.path.join(root, "archive")
+    chain.CHECKPOINT_FILE = os.path.join(root, "chain_checkpoints.jsonl")
+    with _seg_lock:
+        _current["day"] = None
+        _current["path"] = None
+
+
+def store_dir():
+    """Directory holding the store (segments/, spool, checkpoints, ...); follows set_storage_root."""
+    return os.path.dirname(os.path.abspath(SEGMENT_DIR))
+
+
+def _utc_day():
+    return datetime.utcnow().strftime("%Y%m%d")
+
+
+def segment_path(day):
+    if day == LEGACY_DAY:
+        return DB_PATH
+    return os.path.join(SEGMENT_DIR, f"{SEGMENT_PREFIX}{day}{SEGMENT_SUFFIX}")
+
+
+def list_segments(include_legacy=True):
+    """Return [(day, path)] oldest first. The legacy DB, if present, comes first."""
     out = []
-    for r in rows:
+    if include_legacy and os.path.exists(DB_PATH):
+        out.append((LEGACY_DAY, DB_PATH))
+    try:
+        names = os.listdir(SEGMENT_DIR)
+    except OSError:
+        names = []
+    days = []
+    for n in names:
+        if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX):
+            day = n[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            if len(day) == 8 and day.isdigit():
+                days.append(day)
+    for day in sorted(days):
+        out.append((day, segment_path(day)))
+    return out
+
+
+def connect(path, **kw):
+    conn = sqlite3.connect(path, timeout=10, **kw)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class _ThreadToken:
+    __slots__ = ("__weakref__",)
+
+
+def _close_writer(box):
+    conn = box.pop("conn", None)
+    if conn is not None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def _writer(path):
+    """Reuse one connection per thread for the active segment."""
+    box = getattr(_local, "box", None)
+    if box is None:
+        box = _local.box = {}
+        # the thread-local, and with it the token, goes away when this thread exits
+        _local.token = _ThreadToken()
+        weakref.finalize(_local.token, _close_writer, box)
+    conn = box.get("conn")
+    if conn is not None and box["path"] == path:
+        return conn
+    _close_writer(box)
+    # closed by the finalizer, which may run on another thread
+    box["conn"] = connect(path, check_same_thread=False)
+    box["path"] = path
+    return box["conn"]
+
+
+def _max_id(path):
+    try:
+        conn = sqlite3.connect(path, timeout=10)
+        try:
+            hi = conn.execute("SELECT MAX(id) FROM events").fetchone()[0] or 0
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='events'").fetchone()
+            return max(hi, row[0] if row else 0)
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+
+def last_row_id():
+    """Highest id ever assigned in the store (0 for an empty store)."""
+    segs = list_segments()
+    return _max_id(segs[-1][1]) if segs else 0
+
+
+def _last_chain_head(path):
+    try:
+        conn = sqlite3.connect(path, timeout=10)
         try:
-            dec = f.decrypt(r[2])
-            out.append((r[0], r[1], json.loads(dec)))
+            row = chain.last_head(conn)
+            return row[1] if row else None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def _create_segment(path):
+    """Create a segment whose ids continue after the newest existing segment."""
+    ensure_dir(path)
+    prev = [p for _, p in list_segments() if p != path]
+    base = _max_id(prev[-1]) if prev else 0
+    prev_head = _last_chain_head(prev[-1]) if prev else None
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        # auto_vacuum must be chosen before the first table exists
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        conn.execute(_BATCH_SCHEMA)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_events_etype ON events(etype)")
+        day = os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+        chain.create(conn, day, prev_head)
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='events'").fetchone()
+        if row is None and base:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('events', ?)", (base,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def current_segment():
+    """Path of today's segment, creating it on first use (day rollover happens here)."""
+    day = _utc_day()
+    if _current["day"] == day:
+        return _current["path"]
+    with _seg_lock:
+        if _current["day"] != day:
+            path = segment_path(day)
+            _create_segment(path)
+            _current["path"] = path
+            _current["day"] = day
+        return _current["path"]
+
+
+def _upgrade_legacy():
+    if not os.path.exists(DB_PATH):
+        return
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    try:
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(events)")]
+        if cols and "etype" not in cols:
+            conn.execute("ALTER TABLE events ADD COLUMN etype TEXT")
+        if cols:
+            # retention expires legacy rows by ts
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+_init_done = {"root": None}
+
+
+def init_db():
+    """Upgrade the legacy DB and open today's segment; runs once per storage root."""
+    if _init_done["root"] == SEGMENT_DIR:
+        return
+    _upgrade_legacy()
+    current_segment()
+    _init_done["root"] = SEGMENT_DIR
+    if os.path.exists(SPOOL_PATH):
+        _get_spool()   # events left over from a failed store get replayed
+
+
+# Live subscribers (storage/stream.py). Called after commit with the
+# stored rows [(id, ts, event_dict)]; must never block.
+
+_subscribers = []
+
+
+def subscribe(fn):
+    if fn not in _subscribers:
+        _subscribers.append(fn)
+
+
+def unsubscribe(fn):
+    try:
+        _subscribers.remove(fn)
+    except ValueError:
+        pass
+
+
+def _publish(rows):
+    for fn in list(_subscribers):
+        try:
+            fn(rows)
         except Exception:
-            out.append((r[0], r[1], {"error":"decrypt_failed"}))
-    return out
+            pass
+
+
+# Envelope batching
+
+_master = {"key": None}
+_pending = []                  # [(ts, plaintext bytes, etype, event_dict)]
+_pending_since = [0.0]
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher = {"thread": None}
+
+
+def _master_key():
+    if _master["key"] is None:
+        _master["key"] = get_master_key()
+    return _master["key"]
+
 
+def warm_keys():
+    """Load the crypto backend and the storage keys ahead of the first write."""
+    if ENCRYPTION_MODE != "envelope":
+        get_fernet()
+    # also in fernet mode: the spool (and the archive) seal with the master key
+    new_aead(new_data_key())   # imports and initializes the AES-GCM backend
+
+
+def _seal_batch(items):
+    """Encrypt one batch. Returns (batch_id, wrapped_key, [(ts, enc, etype)])."""
+    dek = new_data_key()
+    aead = new_aead(dek)
+    bid = int.from_bytes(os.urandom(8), "big") >> 1   # positive sqlite INTEGER
+    rows = []
+    for ts, raw, etype, _ in items:
+        nonce = os.urandom(12)
+        header = _ENV_HEADER.pack(ENVELOPE_V1, bid, nonce)
+        rows.append((ts, header + aead.encrypt(nonce, raw, header[:9]), etype))
+    return bid, wrap_key(dek, _master_key()), rows
+
+
+def _write(items):
+    """Encrypt and commit [(ts, raw, etype, event_dict)] in one transaction, then publish."""
+    if ENCRYPTION_MODE == "envelope":
+        with metrics.timed("hids_db_encrypt_seconds"):
+            bid, wrapped, rows = _seal_batch(items)
+    else:
+        f = get_fernet()
+        if _master["key"] is None:
+            try:
+                _master_key()   # keyring answers: load the key the spool seals with
+            except Exception:
+                pass
+        with metrics.timed("hids_db_encrypt_seconds"):
+            rows = [(ts, f.encrypt(raw), etype) for ts, raw, etype, _ in items]
+    with metrics.timed("hids_db_flush_seconds"):
+        conn = _writer(current_segment())
+        with conn:
+            conn.executemany("INSERT INTO events (ts, enc_event, etype) VALUES (?, ?, ?)", rows)
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            first_id = last_id - len(rows) + 1
+            if ENCRYPTION_MODE == "envelope":
+                conn.execute("INSERT INTO batches (id, wrapped_key, first_id, last_id, n) VALUES (?, ?, ?, ?, ?)",
+                             (bid, wrapped, first_id, last_id, len(rows)))
+            chain.append(conn, [(first_id + i, r[0], r[2], r[1]) for i, r in enumerate(rows)])
+        if _subscribers:
+            _publish([(first_id + i, it[0], it[3]) for i, it in enumerate(items)])
+    metrics.observe("hids_db_batch_rows", len(rows), buckets=(1, 8, 32, 64, 128, 256, 512, 1024))
+    return len(rows)
+
+
+def flush(block=True):
+    """
+    Write all buffered events in one transaction. Safe to call any time.
+    If the write fails the events go to the spool instead of being lost.
+    With block=False returns None when another thread is already flushing.
+    """
+    if not _flush_lock.acquire(block):
+        return None
+    try:
+        with _pending_lock:
+            items = _pending[:]
+            del _pending[:]
+        if not items:
+            return 0
+        try:
+            return _write(items)
+        except Exception:
+            metrics.inc("hids_db_write_errors_total")
+            if _spill(items):
+                return 0
+            # neither store nor spool took them: keep them for the next flush
+            _requeue(items)
+            raise
+    finally:
+        _flush_lock.release()
+
+
+def _requeue(items):
+    """Put unwritten events back at the front of the buffer, dropping the oldest beyond the spool high water."""
+    limit = BATCH_SIZE * SPOOL_HIGH_WATER * 4
+    with _pending_lock:
+        if not _pending:
+            _pending_since[0] = time.time()
+        _pending[:0] = items
+        over = len(_pending) - limit
+        if over > 0:
+            del _pending[:over]
+            metrics.inc("hids_events_dropped_total", over)
+
+
+# Fallback spool
+
+_spool = {"spool": None, "replayer": None}
+_spool_lock = threading.Lock()
+
+
+def _get_spool():
+    sp = _spool["spool"]
+    if sp is None:
+        from storage.spool import Spool, Replayer
+        with _spool_lock:
+            if _spool["spool"] is None:
+                # only an already-loaded master key (the keyring may be what failed);
+                # without it the spool holds events in memory rather than write them unsealed
+                sp = Spool(SPOOL_PATH, SPOOL_MAX_MB, master_key=lambda: _master["key"])
+                _spool["replayer"] = Replayer(sp, _replay_events, on_replayed=_on_replayed).start()
+                _spool["spool"] = sp
+            sp = _spool["spool"]
+    return sp
+
+
+def _close_spool():
+    with _spool_lock:
+        if _spool["replayer"] is not None:
+            _spool["replayer"].stop()
+        if _spool["spool"] is not None:
+            _spool["spool"].close()
+        _spool["spool"] = _spool["replayer"] = None
+
+
+def _spill(items):
+    """Append events the store could not take to the spool. True if all of them were kept."""
+    try:
+        return _get_spool().append([it[1] for it in items]) == len(items)
+    except Exception:
+        return False
+
+
+def _replay_events(events):
+    """Replayer callback: bulk-write spooled events straight to the store."""
+    _write([(ev.get("ts"), json.dumps(ev).encode(), ev.get("type"), ev) for ev in events])
+
+
+def _on_replayed(n, rate):
+    add_event({"ts": now_iso(), "type": "spool_replayed", "events": n, "events_per_sec": rate})
+
+
+def _flush_loop():
+    while True:
+        time.sleep(BATCH_MAX_DELAY / 2.0)
+        try:
+            _write_folds()
+        except Exception:
+            pass
+        if _pending and time.time() - _pending_since[0] >= BATCH_MAX_DELAY:
+            try:
+                flush()
+            except Exception:
+                pass
+
+
+def _ensure_flusher():
+    if _flusher["thread"] is None:
+        with _pending_lock:
+            if _flusher["thread"] is None:
+                t = threading.Thread(target=_flush_loop, daemon=True)
+                t.start()
+                _flusher["thread"] = t
+
+
+# Folding of repeated events (storage/dedup.py)
+
+_dedup = Deduplicator() if DEDUP["enabled"] else None
+
+
+def _write_folds(drain=False):
+    """Store the fold rows of closed dedup windows (all open windows with drain=True)."""
+    if _dedup is None or not _dedup:
+        return
+    for ev in (_dedup.drain() if drain else _dedup.due()):
+        add_event(ev, dedup=False)
+
+
+def _at_exit():
+    _write_folds(drain=True)
+    if _pending:
+        flush()
+
+
+atexit.register(_at_exit)
+
+
+def add_event(event_dict, dedup=True):
+    """
+    Store one event. With dedup (the default) repeats of DEDUP["keys"] types are
+    folded (storage/dedup.py); pass dedup=False for events that are already
+    deduplicated or must be kept row for row (collector, replay).
+    """
+    with metrics.timed("hids_db_add_event_seconds"):
+        raw = json.dumps(event_dict).encode()
+        if dedup and _dedup is not None:
+            keep, folds = _dedup.admit(event_dict, raw)
+            for ev in folds:
+                add_event(ev, dedup=False)
+            if not keep:
+                return
+        item = (event_dict.get("ts"), raw, event_dict.get("type"), event_dict)
+        if ENCRYPTION_MODE == "envelope":
+            with _pending_lock:
+                if not _pending:
+                    _pending_since[0] = time.time()
+                _pending.append(item)
+                full = len(_pending) >= BATCH_SIZE
+            if full:
+                # another thread is mid-flush (slow disk, locked DB): don't stall the sensor,
+                # spill to the spool once too much has piled up behind it
+                if flush(block=False) is None and len(_pending) >= BATCH_SIZE * SPOOL_HIGH_WATER:
+                    with _pending_lock:
+                        items = _pending[:]
+                        del _pending[:]
+                    if items and not _spill(items):
+                        _requeue(items)
+            else:
+                _ensure_flusher()
+        else:
+            try:
+                _write([item])
+            except Exception:
+                metrics.inc("hids_db_write_errors_total")
+                if not _spill([item]):
+                    raise
+    metrics.inc("hids_events_total", labels={"type": event_dict.get("type") or "unknown"})
+
+
+def iter_rows(types=None, since=None, until=None, newest_first=True, batch=500, after_id=None):
+    """
+    Stream raw (id, ts, etype, enc_event) rows across all segments.
+    `types` filters on the plaintext etype column, `since`/`until` on ts
+    (ISO strings compare correctly as text), `after_id` on id.
+    """
+    segs = list_segments()
+    if newest_first:
+        segs.reverse()
+    where, params = [], []
+    if types:
+        where.append("etype IN (%s)" % ",".join("?" * len(types)))
+        params.extend(types)
+    if since:
+        where.append("ts >= ?")
+        params.append(since)
+    if until:
+        where.append("ts < ?")
+        params.append(until)
+    if after_id is not None:
+        where.append("id > ?")
+        params.append(after_id)
+    sql = "SELECT id, ts, etype, enc_event FROM events"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC" if newest_first else " ORDER BY id ASC"
+    for _, path in segs:
+        try:
+            conn = sqlite3.connect(path, timeout=10)
+        except sqlite3.Error:
+            continue
+        try:
+            cur = conn.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    break
+                for r in rows:
+                    yield r
+        except sqlite3.Error:
+            # segment dropped or legacy DB without etype column
+            continue
+        finally:
+            conn.close()
+
+
+def decrypt_row(f, enc):
+    try:
+        return json.loads(f.decrypt(enc))
+    except Exception:
+        return {"error": "decrypt_failed"}
+
+
+def _find_wrapped_key(bid, first=None):
+    """(wrapped key, segment path) of batch bid; the segment `first` is searched before the others."""
+    paths = [p for _, p in reversed(list_segments(include_legacy=False)) if p != first]
+    for path in ([first] if first else []) + paths:
+        try:
+            conn = sqlite3.connect(path, timeout=10)
+            try:
+                row = conn.execute("SELECT wrapped_key FROM batches WHERE id = ?", (bid,)).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            continue
+        if row:
+            return row[0], path
+    return None, None
+
+
+class RowDecryptor:
+    """
+    Decrypts stored enc_event blobs of either format. Unwrapped batch keys
+    are cached, so a scan pays one key unwrap per batch, not per row.
+    """
+
+    def __init__(self, max_keys=4096, strict=False, segment=None):
+        self._fernet = None
+        self._keys = {}
+        self.max_keys = max_keys
+        self.strict = strict   # raise instead of returning a decrypt_failed placeholder
+        self.segment = segment   # segment being read (or where the last key was found): searched first
+
+    def _batch_cipher(self, bid):
+        aead = self._keys.get(bid)
+        if aead is None:
+            wrapped, path = _find_wrapped_key(bid, self.segment)
+            if wrapped is None:
+                raise KeyError(bid)
+            self.segment = path
+            if len(self._keys) >= self.max_keys:
+                self._keys.clear()
+            aead = self._keys[bid] = new_aead(unwrap_key(wrapped, _master_key()))
+        return aead
+
+    def __call__(self, enc):
+        try:
+            if enc[:1] == b"\x01":
+                _, bid, nonce = _ENV_HEADER.unpack_from(enc)
+                raw = self._batch_cipher(bid).decrypt(nonce, enc[_ENV_HEADER.size:], enc[:9])
+                return json.loads(raw)
+            if self._fernet is None:
+                self._fernet = get_fernet()
+            return json.loads(self._fernet.decrypt(enc))
+        except Exception:
+            if self.strict:
+                raise
+            return {"error": "decrypt_failed"}
+
+
+def row_decryptor(strict=False, segment=None):
+    """Return a function mapping a stored enc_event blob to its event dict (segment: path being read)."""
+    return RowDecryptor(strict=strict, segment=segment)
+
+
+def get_events(limit=100, types=None, since=None, until=None, include_archive=True):
+    """
+    Latest `limit` events, newest first, as (id, ts, event_dict) tuples.
+    Falls through to the cold archive when live segments run out.
+    """
+    out = []
+    if limit <= 0:
+        return out
+    _write_folds()
+    flush()
+    decrypt = row_decryptor()
+    for r in iter_rows(types=types, since=since, until=until, batch=limit):
+        out.append((r[0], r[1], decrypt(r[3])))
+        if len(out) >= limit:
+            return out
+    if include_archive:
+        from storage.archive import iter_archived
+        for r in iter_archived(since=since, until=until, types=types):
+            out.append(r)
+            if len(out) >= limit:
+                break
+    return out
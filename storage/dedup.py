@@ -0,0 +1,118 @@
+# storage/dedup.py
+"""
+Ingest-side folding of repeated events.
+
+Many stored rows are the same record over and over: the same
+file_modified path while an editor saves, the same net_connection tuple
+cycling through TIME_WAIT, the alert_received / alert_filtered_out
+bookkeeping of start_hids.guarded_alert. For the event types listed in
+DEDUP["keys"], add_event fingerprints the configured fields (dotted
+paths reach into nested dicts, e.g. "event.type"):
+
+- the first occurrence of a fingerprint is stored as usual, straight away
+- repeats within DEDUP["window"] seconds are only counted
+- when the window closes, one row is stored for the repeats: the last
+  repeat, with "count" (repeats folded into it), "first_ts" and
+  "last_ts"; its ts is last_ts, so a reader polling get_events(since=...)
+  with the time of its previous poll still finds the row written after it
+
+So every row stands for `count` occurrences (1 if the field is absent),
+readers never wait for a first occurrence, and a fingerprint repeating
+all day costs two rows per window. The fingerprint table holds at most
+DEDUP["max_keys"] windows; when it is full the oldest window is closed
+early.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from config import DEDUP
+from utils import metrics
+
+
+def _field(ev, path):
+    for part in path.split("."):
+        if not isinstance(ev, dict):
+            return None
+        ev = ev.get(part)
+    return ev
+
+
+class Deduplicator:
+    def __init__(self, cfg=DEDUP):
+        self.window = float(cfg["window"])
+        self.max_keys = int(cfg["max_keys"])
+        self.keys = {t: tuple(f) for t, f in cfg["keys"].items()}
+        # fingerprint -> [window start, repeats, first_ts, last_ts, last repeat (JSON bytes)],
+        # in window-start order (repeats do not move an entry)
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._open)
+
+    def fingerprint(self, ev):
+        fields = self.keys.get(ev.get("type"))
+        if not fields or "count" in ev:   # not configured, or already a folded row
+            return None
+        fp = (ev["type"],) + tuple(_field(ev, f) if "." in f else ev.get(f) for f in fields)
+        try:
+            hash(fp)
+        except TypeError:   # a list / dict valued field
+            fp = repr(fp)
+        return fp
+
+    def admit(self, ev, raw, now=None):
+        """(store this event?, [fold rows that are due]). raw is the event's JSON, kept for the fold row."""
+        fp = self.fingerprint(ev)
+        if fp is None:
+            return True, []
+        now = now or time.time()
+        with self._lock:
+            out = self._close(now)
+            e = self._open.get(fp)
+            if e is None:
+                while len(self._open) >= self.max_keys:
+                    out.append(self._fold(self._open.popitem(last=False)[1]))
+                self._open[fp] = [now, 0, None, None, None]
+                return True, [r for r in out if r]
+            ts = ev.get("ts")
+            e[1] += 1
+            e[2] = e[2] or ts
+            e[3] = ts
+            e[4] = raw
+        metrics.inc("hids_events_folded_total", labels={"type": ev.get("type") or "unknown"})
+        return False, [r for r in out if r]
+
+    @staticmethod
+    def _fold(e):
+        if not e[1]:
+            return None
+        ev = json.loads(e[4])
+        ev.update(ts=e[3], count=e[1], first_ts=e[2], last_ts=e[3])
+        return ev
+
+    def _close(self, now):
+        out = []
+        cutoff = now - self.window
+        while self._open:
+            fp, e = next(iter(self._open.items()))
+            if e[0] > cutoff:
+                break
+            del self._open[fp]
+            out.append(self._fold(e))
+        return out
+
+    def due(self, now=None):
+        """Fold rows for windows that have closed."""
+        with self._lock:
+            return [r for r in self._close(now or time.time()) if r]
+
+    def drain(self):
+        """Close every window (shutdown, store switch)."""
+        with self._lock:
+            out = [self._fold(e) for e in self._open.values()]
+            self._open.clear()
+        return [r for r in out if r]
@@ -0,0 +1,339 @@
+# storage/query.py
+"""
+Aggregation queries over the whole event history: live segments plus
+cold archives (`mini_hids query`).
+
+    counts     events per type per time bucket
+    top        most frequent values of a field (user, ip, name, ...)
+    distinct   number of distinct values of a field
+
+Every day segment and every archive file is one task. Tasks run in a
+process pool (decryption is the cost) and each returns a small partial
+aggregate that is merged as it arrives, so memory does not grow with
+the size of the history:
+
+- counts of types that are never folded come straight from the
+  plaintext ts / etype columns (GROUP BY in sqlite, the type / ts columns
+  of archive blocks); nothing is decrypted. Rows of DEDUP["keys"] types
+  are decrypted for their "count" (storage/dedup.py).
+- top keeps a bounded Misra-Gries summary (QUERY["top_capacity"]
+  counters): values are never under-counted by more than the reported
+  max_error, which is 0 whenever the field has fewer distinct values.
+- distinct is exact up to QUERY["exact_distinct"] values, then a
+  HyperLogLog (monitor/sketches.py, ~0.8% error).
+
+Segments and archive blocks outside --since / --until are skipped
+without being opened or decrypted.
+
+A task that fails part-way (segment removed or archived meanwhile,
+unreadable or tampered archive) still contributes what it read, but is
+listed in report["scanned"]["failed"] and not counted as scanned, and
+`mini_hids query` exits non-zero: the result is then a lower bound.
+"""
+
+import calendar
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+
+from config import QUERY, DEDUP
+from monitor.sketches import HyperLogLog, hash64
+import storage.archive as archive
+import storage.db as db
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_bucket(spec):
+    """'15m' / '1h' / '1d' / '30' (seconds) -> seconds."""
+    spec = str(spec).strip().lower()
+    if spec[-1:] in UNITS:
+        return int(float(spec[:-1]) * UNITS[spec[-1]])
+    return int(spec)
+
+
+def _epoch(ts):
+    try:
+        return calendar.timegm(time.strptime(ts[:19], "%Y-%m-%dT%H:%M:%S"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _bucket_iso(start):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start))
+
+
+def field_value(ev, path):
+    for part in path.split("."):
+        if not isinstance(ev, dict):
+            return None
+        ev = ev.get(part)
+    return ev
+
+
+# partial aggregates (merged in the parent)
+
+class Counts:
+    def __init__(self, spec):
+        self.size = spec["bucket"]
+        self.n = Counter()   # (bucket start, type) -> events
+
+    def add_rows(self, rows):
+        """[(bucket number, type, n)] from GROUP BY."""
+        for b, etype, n in rows:
+            if b is not None:
+                self.n[(b * self.size, etype)] += n
+
+    def observe(self, ts, etype, ev, weight):
+        t = _epoch(ts)
+        if t is not None:
+            self.n[(t - t % self.size, etype)] += weight
+
+    def merge(self, other):
+        self.n.update(other.n)
+
+    def result(self, spec):
+        rows = [{"bucket": _bucket_iso(b), "type": t, "count": n} for (b, t), n in sorted(self.n.items())]
+        return {"rows": rows, "buckets": len({b for b, _ in self.n}), "total": sum(self.n.values())}
+
+
+class Top:
+    """Misra-Gries heavy hitters with batched decrements."""
+
+    def __init__(self, spec):
+        self.field = spec["field"]
+        self.capacity = max(int(spec["n"]) * 10, QUERY["top_capacity"])
+        self.c = Counter()
+        self.error = 0   # counts may be low by at most this much
+
+    def _reduce(self):
+        if len(self.c) <= 2 * self.capacity:
+            return
+        d = sorted(self.c.values(), reverse=True)[self.capacity]
+        self.error += d
+        self.c = Counter({k: v - d for k, v in self.c.items() if v > d})
+
+    def observe(self, ts, etype, ev, weight):
+        v = field_value(ev, self.field)
+        if v is None or v == "":
+            return
+        self.c[v if isinstance(v, (str, int, float)) else str(v)] += weight
+        if len(self.c) > 2 * self.capacity:
+            self._reduce()
+
+    def merge(self, other):
+        self.c.update(other.c)
+        self.error += other.error
+        self._reduce()
+
+    def result(self, spec):
+        rows = [{"value": v, "count": n} for v, n in self.c.most_common(int(spec["n"]))]
+        return {"field": self.field, "rows": rows, "max_error": self.error}
+
+
+class Distinct:
+    def __init__(self, spec):
+        self.field = spec["field"]
+        self.exact = set()   # 64-bit hashes, until QUERY["exact_distinct"]
+        self.hll = None
+
+    def _add_hash(self, x):
+        if self.hll is not None:
+            self.hll.add_hash(x)
+            return
+        self.exact.add(x)
+        if len(self.exact) > QUERY["exact_distinct"]:
+            self.hll = HyperLogLog(QUERY["hll_precision"])
+            for h in self.exact:
+                self.hll.add_hash(h)
+            self.exact = None
+
+    def observe(self, ts, etype, ev, weight):
+        v = field_value(ev, self.field)
+        if v is not None and v != "":
+            self._add_hash(hash64(v))
+
+    def merge(self, other):
+        if other.hll is not None:
+            if self.hll is None:
+                self.hll, other_exact = other.hll, self.exact
+                self.exact = None
+                for h in other_exact:
+                    self.hll.add_hash(h)
+            else:
+                self.hll.merge(other.hll)
+        else:
+            for h in other.exact:
+                self._add_hash(h)
+
+    def result(self, spec):
+        if self.hll is None:
+            return {"field": self.field, "distinct": len(self.exact), "exact": True}
+        return {"field": self.field, "distinct": int(round(self.hll.estimate())), "exact": False}
+
+
+AGGREGATES = {"counts": Counts, "top": Top, "distinct": Distinct}
+
+
+# tasks
+
+def _day_in_range(day, spec):
+    """Segment / archive days entirely outside since / until are skipped."""
+    if not day.isdigit():
+        return True   # legacy DB
+    iso = f"{day[:4]}-{day[4:6]}-{day[6:8]}"
+    if spec.get("since") and iso < spec["since"][:10]:
+        return False
+    if spec.get("until") and iso > spec["until"][:10]:
+        return False
+    return True
+
+
+def _where(spec, extra=()):
+    where, params = [], []
+    if spec.get("types"):
+        where.append("etype IN (%s)" % ",".join("?" * len(spec["types"])))
+        params.extend(spec["types"])
+    if spec.get("since"):
+        where.append("ts >= ?")
+        params.append(spec["since"])
+    if spec.get("until"):
+        where.append("ts < ?")
+        params.append(spec["until"])
+    for clause, values in extra:
+        where.append(clause)
+        params.extend(values)
+    return (" WHERE " + " AND ".join(where)) if where else "", params
+
+
+def _scan_segment(path, spec, agg):
+    folded = sorted(DEDUP["keys"])
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        decrypt_where = ()
+        if spec["agg"] == "counts":
+            try:
+                # plaintext columns only; strftime('%s') reads the ISO ts as UTC like _epoch
+                w, params = _where(spec, [("etype NOT IN (%s)" % ",".join("?" * len(folded)), folded)])
+                agg.add_rows(conn.execute(
+                    "SELECT CAST(strftime('%s', substr(ts, 1, 19)) AS INTEGER) / ?, etype, COUNT(*) "
+                    "FROM events" + w + " GROUP BY 1, 2", [agg.size] + params))
+                decrypt_where = [("etype IN (%s)" % ",".join("?" * len(folded)), folded)]
+            except sqlite3.OperationalError:
+                decrypt_where = ()   # legacy DB without etype: decrypt everything
+        decrypt = db.row_decryptor(segment=path)
+        w, params = _where(spec, decrypt_where)
+        try:
+            cur = conn.execute("SELECT ts, etype, enc_event FROM events" + w, params)
+        except sqlite3.OperationalError:
+            w, params = _where(dict(spec, types=None))
+            cur = conn.execute("SELECT ts, NULL, enc_event FROM events" + w, params)
+        while True:
+            rows = cur.fetchmany(1000)
+            if not rows:
+                break
+            for ts, etype, enc in rows:
+                ev = decrypt(enc)
+                etype = etype or ev.get("type")
+                if spec.get("types") and etype not in spec["types"]:
+                    continue
+                agg.observe(ts or ev.get("ts"), etype, ev, ev.get("count") or 1)
+    finally:
+        conn.close()
+
+
+def _scan_archive(path, spec, agg):
+    reader = archive.ArchiveReader(path)
+    since, until, types = spec.get("since"), spec.get("until"), spec.get("types")
+    if spec["agg"] == "counts":
+        folded = set(DEDUP["keys"])
+        # ts / type columns only; rows of foldable types are counted from their payload below
+        for cols in reader.scan_columns(since, until, types, columns=("ts", "type")):
+            for ts, etype in zip(cols["ts"], cols["type"]):
+                if etype not in folded:
+                    agg.observe(ts, etype, None, 1)
+        ftypes = [t for t in folded if not types or t in types]
+        if not ftypes:
+            return
+        for cols in reader.scan_columns(since, until, ftypes, columns=("ts", "type", "event")):
+            for ts, etype, payload in zip(cols["ts"], cols["type"], cols["event"]):
+                ev = json.loads(payload) if payload else {}
+                agg.observe(ts, etype, ev, ev.get("count") or 1)
+        return
+    for _, ts, ev in reader.scan(since, until, types):
+        agg.observe(ts, ev.get("type"), ev, ev.get("count") or 1)
+
+
+def run_task(task):
+    """One segment or archive file -> (partial aggregate, error or None)."""
+    kind, path, spec = task
+    agg = AGGREGATES[spec["agg"]](spec)
+    if kind == "segment" and not os.path.exists(path):
+        # sqlite3.connect would create an empty file in its place
+        return agg, "segment no longer exists (archived or pruned during the query)"
+    try:
+        if kind == "segment":
+            _scan_segment(path, spec, agg)
+        else:
+            _scan_archive(path, spec, agg)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        return agg, f"{type(e).__name__}: {e}"
+    return agg, None
+
+
+def _init_worker(paths):
+    db.DB_PATH, db.SEGMENT_DIR, archive.ARCHIVE_DIR = paths
+
+
+def plan(spec):
+    tasks = [("segment", path, spec) for day, path in db.list_segments() if _day_in_range(day, spec)]
+    tasks += [("archive", path, spec) for day, path in archive.list_archives() if _day_in_range(day, spec)]
+    return tasks
+
+
+def query(spec, jobs=None):
+    """
+    spec: {"agg": "counts" | "top" | "distinct", "bucket": seconds (counts),
+           "field": dotted field (top / distinct), "n": rows (top),
+           "since", "until": ISO timestamps, "types": [event types]}
+    Returns {"query", "rows" / "distinct", ..., "scanned": {...}, "elapsed_s"};
+    scanned["failed"] lists the tasks that did not complete ({"kind", "path", "error"}).
+    """
+    t0 = time.time()
+    tasks = plan(spec)
+    if not jobs:
+        try:
+            jobs = len(os.sched_getaffinity(0))
+        except AttributeError:
+            jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(tasks) or 1))
+
+    total = AGGREGATES[spec["agg"]](spec)
+    pool = None
+    if jobs == 1:
+        results = map(run_task, tasks)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                   initargs=((db.DB_PATH, db.SEGMENT_DIR, archive.ARCHIVE_DIR),))
+        results = pool.map(run_task, tasks)
+    failed = []
+    try:
+        for task, (part, error) in zip(tasks, results):
+            total.merge(part)
+            if error is not None:
+                failed.append({"kind": task[0], "path": task[1], "error": error})
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    out = {"query": {k: v for k, v in spec.items() if v not in (None, [], "")}}
+    out.update(total.result(spec))
+    bad = {f["path"] for f in failed}
+    out["scanned"] = {"segments": sum(1 for t in tasks if t[0] == "segment" and t[1] not in bad),
+                      "archives": sum(1 for t in tasks if t[0] == "archive" and t[1] not in bad),
+                      "jobs": jobs, "failed": failed}
+    out["elapsed_s"] = round(time.time() - t0, 3)
+    return out
@@ -0,0 +1,232 @@
+# storage/retention.py
+"""
+Retention, rollover and compaction for the segmented event store.
+
+ - Segments older than the default TTL are dropped whole (O(1) unlink).
+ - Shorter per-type TTLs (process_start, net_connection, bookkeeping
+   events, ...) are applied per segment with an indexed DELETE on etype,
+   once the whole segment day is past the TTL.
+ - A total size cap drops the oldest segments first.
+ - Segments older than archive_after_days are rolled into the columnar
+   archive (storage/archive.py) and then dropped. Type TTLs still apply:
+   expired types are left out when archiving and later removed from the
+   archive. A segment with a row that cannot be decrypted is kept, not
+   archived. Archives older than archive_days (default_days unless set)
+   are deleted.
+ - Freed pages are returned to the OS with PRAGMA incremental_vacuum in
+   small steps so the writer is never blocked for long.
+
+Run enforce() once, or RetentionManager().run_loop(stop_event) in a thread.
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from config import RETENTION
+import storage.db as db
+import storage.archive as archive
+from storage import chain
+from utils.helpers import now_iso
+from utils import metrics
+
+
+def _day_to_date(day):
+    return datetime.strptime(day, "%Y%m%d").date()
+
+
+def _segment_files(path):
+    return [path, path + "-wal", path + "-shm"]
+
+
+def _size(path):
+    total = 0
+    for p in _segment_files(path):
+        try:
+            total += os.path.getsize(p)
+        except OSError:
+            pass
+    return total
+
+
+class RetentionManager:
+    def __init__(self, policy=None):
+        p = dict(RETENTION)
+        p.update(policy or {})
+        self.default_days = int(p.get("default_days", 90))
+        self.type_days = {k: int(v) for k, v in (p.get("type_days") or {}).items()}
+        self.max_total_bytes = int(float(p.get("max_total_mb", 0)) * 1024 * 1024)
+        self.interval = float(p.get("check_interval", 3600))
+        self.vacuum_pages = int(p.get("vacuum_pages", 2000))
+        self.archive_after_days = int(p.get("archive_after_days", 0))   # 0 = never archive
+        # archives live as long as the data would have (default_days) unless overridden
+        self.archive_days = int(p.get("archive_days") or self.default_days)
+        self.policy = {"default_days": self.default_days, "type_days": self.type_days}
+
+    # individual steps
+
+    def drop_segment(self, day, path):
+        """Remove a whole segment. Never drops today's (active) segment."""
+        if day == db._utc_day():
+            return False
+        removed = False
+        for p in _segment_files(path):
+            try:
+                os.remove(p)
+                removed = True
+            except OSError:
+                pass
+        return removed
+
+    def _expire_types(self, path, types, day=None):
+        where = "etype IN (%s)" % ",".join("?" * len(types))
+        conn = db.connect(path)
+        try:
+            with conn:
+                # keep the hash chain verifiable: account for (and sign) the rows before deleting them
+                if not chain.record_prune(conn, where, types, day=day, policy=self.policy):
+                    return 0
+                cur = conn.execute(f"DELETE FROM events WHERE {where}", types)
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def _expire_legacy(self, cutoff_iso, chunk=5000):
+        """
+        Legacy DB has no day boundary and no etype for old rows: delete by ts
+        in bounded chunks, and drop the file once it is empty.
+        """
+        deleted = 0
+        conn = db.connect(db.DB_PATH)
+        try:
+            while True:
+                cur = conn.execute(
+                    "DELETE FROM events WHERE id IN (SELECT id FROM events WHERE ts < ? LIMIT ?)",
+                    (cutoff_iso, chunk))
+                conn.commit()
+                deleted += cur.rowcount
+                if cur.rowcount < chunk:
+                    break
+            empty = conn.execute("SELECT 1 FROM events LIMIT 1").fetchone() is None
+        finally:
+            conn.close()
+        if empty:
+            self.drop_segment(db.LEGACY_DAY, db.DB_PATH)
+        return deleted
+
+    def vacuum(self, path):
+        """Release up to vacuum_pages free pages of one segment."""
+        conn = db.connect(path)
+        try:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free:
+                conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+                conn.commit()
+            return free
+        finally:
+            conn.close()
+
+    # full pass
+
+    def enforce(self, today=None):
+        today = today or datetime.utcnow().date()
+        summary = {"dropped": [], "expired_rows": 0, "vacuumed": 0}
+        segs = db.list_segments()
+
+        keep = []
+        for day, path in segs:
+            if day == db.LEGACY_DAY:
+                cutoff = (today - timedelta(days=self.default_days)).isoformat()
+                summary["expired_rows"] += self._expire_legacy(cutoff)
+                if os.path.exists(path):
+                    keep.append((day, path))
+                continue
+            age = (today - _day_to_date(day)).days
+            if age > self.default_days and self.drop_segment(day, path):
+                summary["dropped"].append(day)
+                continue
+            keep.append((day, path))
+
+        # per-type TTLs: a segment is only touched once its whole day is past the TTL
+        for day, path in keep:
+            if day == db.LEGACY_DAY:
+                continue
+            age = (today - _day_to_date(day)).days
+            expired = [t for t, d in self.type_days.items() if age > d]
+            if expired:
+                try:
+                    summary["expired_rows"] += self._expire_types(path, expired, day)
+                except Exception as e:   # sqlite error, or no signing key: nothing is deleted
+                    summary.setdefault("expire_errors", []).append(f"{day}: {e}")
+
+        # roll aged segments into the cold archive
+        if self.archive_after_days:
+            rolled = []
+            for day, path in keep:
+                if day == db.LEGACY_DAY:
+                    continue
+                if (today - _day_to_date(day)).days <= self.archive_after_days:
+                    continue
+                try:
+                    n = archive.archive_segment(day, path, today, self.policy)
+                    summary["archived_rows"] = summary.get("archived_rows", 0) + n
+                except Exception as e:
+                    summary.setdefault("archive_errors", []).append(f"{day}: {e}")
+                    continue
+                if self.drop_segment(day, path):
+                    rolled.append(day)
+            if rolled:
+                summary["archived"] = rolled
+                keep = [(d, p) for d, p in keep if d not in rolled]
+
+        for day, path in archive.list_archives():
+            if (today - _day_to_date(day)).days > self.archive_days:
+                try:
+                    os.remove(path)
+                    summary.setdefault("archives_dropped", []).append(day)
+                except OSError:
+                    pass
+                continue
+            # per-type TTLs keep applying to archived days
+            expired = archive.expired_types(day, today, self.policy)
+            if expired:
+                try:
+                    summary["expired_rows"] += archive.expire_archive_types(day, path, expired)
+                except Exception as e:
+                    summary.setdefault("archive_errors", []).append(f"{day}: {e}")
+
+        # size cap: oldest first, never the active segment
+        if self.max_total_bytes:
+            sizes = [(day, path, _size(path)) for day, path in keep]
+            total = sum(s for _, _, s in sizes)
+            for day, path, size in sizes:
+                if total <= self.max_total_bytes:
+                    break
+                if self.drop_segment(day, path):
+                    summary["dropped"].append(day)
+                    total -= size
+            keep = [(d, p) for d, p in keep if d not in summary["dropped"]]
+
+        for day, path in keep:
+            try:
+                if self.vacuum(path):
+                    summary["vacuumed"] += 1
+            except sqlite3.Error:
+                pass
+
+        metrics.set_gauge("hids_db_segments", len(keep))
+        metrics.set_gauge("hids_db_bytes", sum(_size(p) for _, p in keep))
+        return summary
+
+    def run_loop(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                summary = self.enforce()
+                if summary["dropped"] or summary["expired_rows"] or summary.get("archived"):
+                    db.add_event({"ts": now_iso(), "type": "retention_run", **summary})
+            except Exception as e:
+                try:
+                    db.add_event({"ts": now_iso(), "type": "retention_error", "error": str(e)})
+                except Exception:
+                    pass
+            stop_event.wait(self.interval)
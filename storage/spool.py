@@ -0,0 +1,352 @@
+# storage/spool.py
+"""
+Crash-safe local spool for events the store could not take.
+
+When a write to the segment store fails (locked DB, full disk, keyring
+unavailable) or the writer falls behind, storage.db appends the events
+here instead of dropping them. A background replayer drains the spool
+back into the store in bulk once writes succeed again.
+
+The spool is one pre-sized, memory-mapped file (storage/spool.bin):
+
+    header (4096 bytes)
+        b"HSP1" | u32 version | u64 read offset | u16 n | wrapped data key (n bytes)
+    records, appended from offset 4096
+        u32 length | u32 crc32 | u8 flags | payload
+    u32 0 terminator after the last record
+
+The write end is not stored: on open the file is scanned from the read
+offset and stops at the terminator or at the first record whose CRC does
+not match, so a record torn by a crash is ignored. Replay is
+at-least-once: a crash between committing a replayed chunk and saving
+the new read offset replays that chunk again.
+
+Payloads are the event JSON, always AES-GCM sealed (flags bit 0) with
+the spool's own data key, wrapped by the storage master key and kept in
+the header. Nothing is ever written in the clear: if the master key is
+not in memory (the keyring is what failed before it was loaded), events
+are held in memory instead, up to the spool's capacity, and counted in
+hids_spool_held_records. They are written sealed as soon as the key is
+available, or handed straight back to the store by replay; a crash
+while they are held loses them. Records without the sealed flag, written
+by older versions, are still read.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from utils import metrics
+
+MAGIC = b"HSP1"
+VERSION = 1
+HEADER_SIZE = 4096
+_HEAD = struct.Struct("<4sIQH")
+_REC = struct.Struct("<IIB")
+FLAG_SEALED = 0x01
+AAD = b"mini_hids-spool-v1"
+
+
+class Spool:
+    def __init__(self, path, capacity_mb=64, master_key=None):
+        self.path = path
+        self.capacity = max(int(capacity_mb * 1024 * 1024), HEADER_SIZE * 2)
+        self._master_key = master_key   # callable returning the master key or None, must not block
+        self._lock = threading.Lock()
+        self._key_lock = threading.Lock()
+        self._aead = None
+        self._dirty = False
+        self.records = 0
+        self._held = []       # raw events waiting for the master key (never written unsealed)
+        self._held_bytes = 0
+        self._open()
+
+    # file handling
+
+    def _open(self):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = os.fstat(fd).st_size
+            if size < self.capacity:
+                os.ftruncate(fd, self.capacity)
+            else:
+                self.capacity = size
+            self._mm = mmap.mmap(fd, self.capacity)
+        finally:
+            os.close(fd)
+        magic, version, read_off, klen = _HEAD.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            read_off, klen = HEADER_SIZE, 0
+            _HEAD.pack_into(self._mm, 0, MAGIC, VERSION, read_off, 0)
+            struct.pack_into("<I", self._mm, HEADER_SIZE, 0)
+        self._wrapped = bytes(self._mm[_HEAD.size:_HEAD.size + klen]) if klen else None
+        self.read_off = read_off
+        self.write_off, self.records = self._scan(read_off)
+        if self.write_off + 4 <= self.capacity:
+            struct.pack_into("<I", self._mm, self.write_off, 0)
+        self._gauges()
+
+    def _scan(self, off):
+        """Find the end of the valid records starting at off."""
+        n = 0
+        mm = self._mm
+        while off + _REC.size <= self.capacity:
+            length, crc, _ = _REC.unpack_from(mm, off)
+            if length == 0 or off + 8 + length > self.capacity:
+                break
+            if zlib.crc32(mm[off + 8:off + 8 + length]) != crc:
+                break
+            off += 8 + length
+            n += 1
+        return off, n
+
+    def _save_header(self):
+        klen = len(self._wrapped) if self._wrapped else 0
+        _HEAD.pack_into(self._mm, 0, MAGIC, VERSION, self.read_off, klen)
+        if klen:
+            self._mm[_HEAD.size:_HEAD.size + klen] = self._wrapped
+        self._dirty = True
+
+    def sync(self):
+        """msync dirty pages (the replayer calls this periodically)."""
+        with self._lock:
+            if self._dirty:
+                self._mm.flush()
+                self._dirty = False
+
+    def close(self):
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+
+    def _gauges(self):
+        metrics.set_gauge("hids_spool_records", self.records)
+        metrics.set_gauge("hids_spool_bytes", self.write_off - self.read_off)
+        metrics.set_gauge("hids_spool_held_records", len(self._held))
+
+    # payload encryption
+
+    def _cipher(self):
+        if self._aead is not None:
+            return self._aead
+        from utils.crypto_utils import aead, new_data_key, wrap_key, unwrap_key
+        master = self._master_key() if self._master_key else None
+        if master is None:
+            return None
+        with self._key_lock:
+            if self._aead is None:
+                if self._wrapped:
+                    self._aead = aead(unwrap_key(self._wrapped, master))
+                else:
+                    dek = new_data_key()
+                    self._wrapped = wrap_key(dek, master)
+                    self._save_header()
+                    self._aead = aead(dek)
+        return self._aead
+
+    def _sealer(self):
+        try:
+            return self._cipher()
+        except Exception:
+            return None
+
+    @staticmethod
+    def _seal(aead, raw):
+        nonce = os.urandom(12)
+        return FLAG_SEALED, nonce + aead.encrypt(nonce, raw, AAD)
+
+    def _decode(self, flags, payload):
+        if flags & FLAG_SEALED:
+            aead = self._cipher()
+            if aead is None:
+                raise RuntimeError("spool is sealed and the master key is unavailable")
+            payload = aead.decrypt(payload[:12], payload[12:], AAD)
+        return payload
+
+    # writing
+
+    def _compact(self):
+        """Move unread records to the start of the data area."""
+        live = self.write_off - self.read_off
+        if self.read_off == HEADER_SIZE:
+            return False
+        if live:
+            self._mm.move(HEADER_SIZE, self.read_off, live)
+        self.read_off = HEADER_SIZE
+        self.write_off = HEADER_SIZE + live
+        struct.pack_into("<I", self._mm, self.write_off, 0)
+        self._save_header()
+        return True
+
+    def _hold(self, raws):
+        """Keep events in memory until they can be sealed; returns how many fit."""
+        kept = 0
+        with self._lock:
+            for raw in raws:
+                if self._held_bytes + len(raw) > self.capacity:
+                    metrics.inc("hids_spool_dropped_total", len(raws) - kept)
+                    break
+                self._held.append(raw)
+                self._held_bytes += len(raw)
+                kept += 1
+            self._gauges()
+        return kept
+
+    def _take_held(self):
+        with self._lock:
+            held, self._held, self._held_bytes = self._held, [], 0
+        return held
+
+    def append(self, raws):
+        """
+        Append JSON-encoded events. Returns how many were kept (the rest are
+        dropped when full). Without the master key they are held in memory.
+        """
+        aead = self._sealer()
+        if aead is None:
+            metrics.inc("hids_spool_held_total", len(raws))
+            return self._hold(raws)
+        if self._held:
+            raws = self._take_held() + list(raws)
+        encoded = [self._seal(aead, r) for r in raws]
+        stored = 0
+        with self._lock:
+            mm = self._mm
+            for flags, payload in encoded:
+                length = 1 + len(payload)
+                need = 8 + length + 4
+                if self.write_off + need > self.capacity:
+                    self._compact()
+                    if self.write_off + need > self.capacity:
+                        metrics.inc("hids_spool_dropped_total", len(encoded) - stored)
+                        break
+                off = self.write_off
+                body = bytes([flags]) + payload
+                mm[off + 8:off + 8 + length] = body
+                struct.pack_into("<I", mm, off + 8 + length, 0)
+                struct.pack_into("<II", mm, off, length, zlib.crc32(body))
+                self.write_off = off + 8 + length
+                self.records += 1
+                stored += 1
+            self._dirty = True
+            self._gauges()
+        metrics.inc("hids_spool_appended_total", stored)
+        return stored
+
+    # reading / replay
+
+    def __len__(self):
+        return self.records + len(self._held)
+
+    def peek(self, max_records=2000):
+        """Up to max_records decoded events from the head: ([event_dict], records consumed)."""
+        out = []
+        with self._lock:
+            off = self.read_off
+            mm = self._mm
+            n = 0
+            while off < self.write_off and n < max_records:
+                length, _, flags = _REC.unpack_from(mm, off)
+                payload = bytes(mm[off + _REC.size:off + 8 + length])
+                off += 8 + length
+                n += 1
+                try:
+                    raw = self._decode(flags, payload)
+                except RuntimeError:
+                    raise
+                except Exception:
+                    metrics.inc("hids_spool_dropped_total")   # undecryptable record
+                    continue
+                try:
+                    out.append(json.loads(raw))
+                except ValueError:
+                    metrics.inc("hids_spool_dropped_total")
+            return out, n
+
+    def commit(self, count):
+        """Mark the first `count` records as stored (offsets are re-walked: appends may have compacted)."""
+        with self._lock:
+            off = self.read_off
+            for _ in range(min(count, self.records)):
+                length = struct.unpack_from("<I", self._mm, off)[0]
+                off += 8 + length
+            self.read_off = off
+            self.records -= min(count, self.records)
+            if self.records == 0:
+                self.read_off = self.write_off = HEADER_SIZE
+                struct.pack_into("<I", self._mm, HEADER_SIZE, 0)
+            self._save_header()
+            self._gauges()
+
+    def replay(self, store, chunk=2000):
+        """Drain into store(events) chunk by chunk. Returns events replayed; raises if store fails."""
+        total = 0
+        held = self._take_held()
+        if held:
+            try:
+                store([json.loads(r) for r in held])
+            except BaseException:
+                self._hold(held)
+                raise
+            metrics.inc("hids_spool_replayed_total", len(held))
+            total += len(held)
+            self._gauges()
+        while self.records:
+            events, n = self.peek(chunk)
+            t0 = time.perf_counter()
+            if events:
+                store(events)
+            self.commit(n)
+            metrics.observe("hids_spool_replay_seconds", time.perf_counter() - t0)
+            metrics.inc("hids_spool_replayed_total", len(events))
+            total += len(events)
+        return total
+
+
+class Replayer:
+    """Background thread: drains the spool while the store accepts writes, backs off when it does not."""
+
+    def __init__(self, spool, store, on_replayed=None, interval=1.0, max_backoff=60.0):
+        self.spool = spool
+        self.store = store
+        self.on_replayed = on_replayed
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self._t = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self._t.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+
+    def _loop(self):
+        delay = self.interval
+        while not self.stop_event.is_set():
+            self.wake.wait(delay)
+            self.wake.clear()
+            try:
+                self.spool.sync()
+                if not len(self.spool):
+                    delay = self.interval
+                    continue
+                t0 = time.time()
+                n = self.spool.replay(self.store)
+                self.spool.sync()
+                delay = self.interval
+                if n and self.on_replayed:
+                    dt = max(time.time() - t0, 1e-6)
+                    self.on_replayed(n, round(n / dt, 1))
+            except Exception:
+                delay = min(max(delay * 2, self.interval), self.max_backoff)
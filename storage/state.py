@@ -0,0 +1,90 @@
+# storage/state.py
+"""
+Checkpoints of monitor state, so a restart can tell what changed while
+the HIDS was down.
+
+Each monitor saves a small JSON document every CHECKPOINT["interval"]
+seconds and when it stops, under <store dir>/<CHECKPOINT["dir"]>/<name>.json:
+
+    proc   sorted [pid, start time, name, user, ppid] rows
+    net    sorted connection and listener tuples
+    auth   auth log inode and byte offset
+
+Writes go to a temporary file that is fsynced and renamed over the old
+checkpoint, so a crash leaves either the old or the new one. Process and
+socket checkpoints also record the boot time: after a reboot every pid
+is different and the diff would be meaningless, so load() reports them
+as stale instead.
+
+Checkpoints are plaintext JSON, but they list process names, users and
+connections, so they are created owner-only (0600), like the credential
+store.
+"""
+
+import json
+import os
+import time
+
+from config import CHECKPOINT
+from storage import db
+from utils.helpers import ensure_dir, lazy_import
+
+psutil = lazy_import("psutil")
+
+
+def boot_time():
+    try:
+        return int(psutil.boot_time()) if psutil else None
+    except Exception:
+        return None
+
+
+def path(name):
+    return os.path.join(db.store_dir(), CHECKPOINT["dir"], f"{name}.json")
+
+
+def save(name, state, boot=True):
+    p = path(name)
+    ensure_dir(p)
+    doc = {"version": 1, "saved_at": time.time(), "boot": boot_time() if boot else None, "state": state}
+    tmp = p + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)   # a stale tmp file keeps its old mode otherwise
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(doc, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, p)
+
+
+def load(name, max_age=CHECKPOINT["max_age_hours"] * 3600):
+    """(state, saved_at), or (None, reason) if there is no usable checkpoint."""
+    try:
+        with open(path(name), "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        saved_at, boot = float(doc["saved_at"]), doc.get("boot")
+        state = doc["state"]
+    except FileNotFoundError:
+        return None, "missing"
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, "unreadable"
+    if max_age and time.time() - saved_at > max_age:
+        return None, "too_old"
+    if boot is not None and boot_time() not in (None, boot):
+        return None, "rebooted"
+    return state, saved_at
+
+
+class Every:
+    """Interval gate for periodic checkpoints: ready() is True once per interval."""
+
+    def __init__(self, interval=CHECKPOINT["interval"]):
+        self.interval = float(interval)
+        self._last = time.time()
+
+    def ready(self, now=None):
+        now = now or time.time()
+        if now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
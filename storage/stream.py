@@ -0,0 +1,200 @@
+# storage/stream.py
+"""
+Live event streaming over a local Unix-domain socket.
+
+Events are pushed straight from the store's commit path
+(storage.db.subscribe), so consumers like the GUI no longer need to poll
+get_events() and decrypt the latest rows on every refresh.
+
+Protocol (newline-delimited JSON):
+
+    client -> server   {"types": ["auth_failed", ...], "since": 1234}   (both optional)
+    server -> client   {"id": 1235, "ts": "...", "event": {...}}        one per event
+                       {"type": "stream_gap", "dropped": 17, "last_id": 1300}
+
+`since` replays stored events with a larger id before switching to live,
+so a reconnecting client resumes without gaps. Each client has a bounded
+buffer. A slow client loses its oldest buffered events and gets a
+stream_gap notice (reconnect with since=last_id to backfill). The
+sensors are never blocked.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections import deque
+
+from config import STREAM_SOCKET, STREAM_CLIENT_BUFFER
+import storage.db as db
+from utils import metrics
+
+
+class _Client:
+    __slots__ = ("types", "buf", "dropped", "cond", "_maxlen")
+
+    def __init__(self, types, maxlen):
+        self.types = set(types) if types else None
+        self.buf = deque()
+        self.dropped = 0
+        self.cond = threading.Condition()
+        self._maxlen = maxlen
+
+    def offer(self, line_rows):
+        """Called from the commit path: append without blocking, drop oldest on overflow."""
+        with self.cond:
+            for rid, etype, line in line_rows:
+                if self.types is not None and etype not in self.types:
+                    continue
+                if len(self.buf) >= self._maxlen:
+                    self.buf.popleft()
+                    self.dropped += 1
+                self.buf.append((rid, line))
+            self.cond.notify()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        srv = self.server.hub
+        try:
+            hello = json.loads(self.rfile.readline() or b"{}")
+        except ValueError:
+            hello = {}
+        types = hello.get("types") or None
+        since = hello.get("since")
+        client = _Client(types, srv.buffer_size)
+        srv.add(client)
+        try:
+            last_id = since if since is not None else -1
+            if since is not None:
+                last_id = self._replay(since, types)
+            self._live(client, last_id)
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            srv.remove(client)
+
+    def _send(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def _replay(self, since, types):
+        db.flush()
+        decrypt = db.row_decryptor()
+        last_id = since
+        for rid, ts, _, enc in db.iter_rows(types=types, newest_first=False, after_id=since):
+            self._send(_line(rid, ts, decrypt(enc)))
+            last_id = rid
+        return last_id
+
+    def _live(self, client, last_id):
+        hub = self.server.hub
+        while not hub.stopping:
+            with client.cond:
+                while not client.buf and not hub.stopping:
+                    client.cond.wait(1.0)
+                items = list(client.buf)
+                client.buf.clear()
+                dropped, client.dropped = client.dropped, 0
+            if dropped:
+                self._send((json.dumps({"type": "stream_gap", "dropped": dropped, "last_id": last_id}) + "\n").encode())
+            out = []
+            for rid, line in items:
+                if rid <= last_id:
+                    continue   # already sent during replay
+                out.append(line)
+                last_id = rid
+            if out:
+                self._send(b"".join(out))
+
+
+def _line(rid, ts, ev):
+    return (json.dumps({"id": rid, "ts": ts, "event": ev}, default=str) + "\n").encode()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class StreamServer:
+    def __init__(self, path=STREAM_SOCKET, buffer_size=STREAM_CLIENT_BUFFER):
+        self.path = path
+        self.buffer_size = int(buffer_size)
+        self.clients = []
+        self._lock = threading.Lock()
+        self.stopping = False
+        self._srv = None
+
+    def add(self, client):
+        with self._lock:
+            self.clients = self.clients + [client]
+        metrics.set_gauge("hids_stream_clients", len(self.clients))
+
+    def remove(self, client):
+        with self._lock:
+            self.clients = [c for c in self.clients if c is not client]
+        metrics.set_gauge("hids_stream_clients", len(self.clients))
+
+    def _on_rows(self, rows):
+        clients = self.clients
+        if not clients:
+            return
+        # serialize once, fan out to every client buffer
+        line_rows = [(rid, ev.get("type"), _line(rid, ts, ev)) for rid, ts, ev in rows]
+        for c in clients:
+            c.offer(line_rows)
+
+    def start(self):
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        old = os.umask(0o177)   # socket readable by the owner only
+        try:
+            self._srv = _Server(self.path, _Handler)
+        finally:
+            os.umask(old)
+        self._srv.hub = self
+        threading.Thread(target=self._srv.serve_forever, daemon=True).start()
+        db.subscribe(self._on_rows)
+        return self
+
+    def stop(self):
+        self.stopping = True
+        db.unsubscribe(self._on_rows)
+        for c in self.clients:
+            with c.cond:
+                c.cond.notify_all()
+        if self._srv is not None:
+            self._srv.shutdown()
+            self._srv.server_close()
+            self._srv = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def stream_events(types=None, since=None, path=STREAM_SOCKET):
+    """
+    Client helper: yields stream messages as dicts. Reconnect with
+    since=<last id seen> after a stream_gap or disconnect.
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(path)
+    try:
+        hello = {}
+        if types:
+            hello["types"] = list(types)
+        if since is not None:
+            hello["since"] = since
+        s.sendall((json.dumps(hello) + "\n").encode())
+        f = s.makefile("rb")
+        for line in f:
+            yield json.loads(line)
+    finally:
+        s.close()
@@ -0,0 +1,52 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.harness import install_stubs  # noqa: E402
+import storage.db as db  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path):
+    """A scratch event store with stubbed keyring / SMTP."""
+    root = str(tmp_path / "store")
+    os.makedirs(root)
+    install_stubs(root)
+    yield root
+    db.set_storage_root(root)   # drain folds / pending rows into this store, not the next one
+    db._close_spool()
+
+
+def _events(n, other="net_connection"):
+    for i in range(n):
+        yield {"ts": f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}", "type": "auth_failed", "user": f"u{i}"}
+        yield {"ts": "2026-01-01T00:00:00", "type": other, "n": i}
+
+
+@pytest.fixture
+def make_events():
+    """make_events(n, other): n auth_failed events interleaved with n events of type `other`."""
+    return _events
+
+
+@pytest.fixture
+def write_day(store):
+    """write_day(days_ago, events): store events in the segment of that UTC day; returns the day."""
+    from datetime import datetime, timedelta
+
+    def write(days_ago, events):
+        day = (datetime.utcnow() - timedelta(days=days_ago)).strftime("%Y%m%d")
+        real = db._utc_day
+        db._utc_day = lambda: day
+        try:
+            for ev in events:
+                db.add_event(ev, dedup=False)
+            db.flush()
+        finally:
+            db._utc_day = real
+        return day
+    return write
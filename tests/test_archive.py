@@ -0,0 +1,87 @@
+# tests/test_archive.py
+import os
+from collections import Counter
+
+import pytest
+
+import storage.archive as archive
+import storage.db as db
+from storage.retention import RetentionManager
+
+
+def test_round_trip(store, write_day, make_events):
+    n = archive.BLOCK_ROWS + 500   # 2 * n rows: three blocks
+    day = write_day(3, make_events(n, "process_start"))
+    path = db.segment_path(day)
+    live = [(rid, ev) for rid, _, ev in db.get_events(3 * n, include_archive=False)]
+
+    assert archive.archive_segment(day, path) == 2 * n
+    reader = archive.ArchiveReader(archive.archive_path(day))
+    assert len(reader.blocks) == 3
+
+    archived = list(archive.iter_archived())
+    assert [r[0] for r in archived] == [rid for rid, _ in live]   # newest first, across blocks
+    assert [r[2] for r in archived] == [ev for _, ev in live]
+    assert [r[0] for r in archive.iter_archived(newest_first=False)] == sorted(rid for rid, _ in live)
+    assert Counter(ev["type"] for _, _, ev in reader.scan(types=["process_start"])) == {"process_start": n}
+
+
+def test_decrypt_failure_keeps_segment(store, write_day, make_events):
+    day = write_day(10, make_events(20, "process_start"))
+    path = db.segment_path(day)
+    conn = db.connect(path)
+    with conn:
+        conn.execute("UPDATE events SET enc_event = ? WHERE id = (SELECT MIN(id) FROM events WHERE etype = ?)",
+                     (b"\x01" + os.urandom(40), "auth_failed"))
+    conn.close()
+
+    with pytest.raises(ValueError):
+        archive.archive_segment(day, path)
+    assert archive.list_archives() == []
+
+    summary = RetentionManager({"archive_after_days": 7}).enforce()
+    assert summary.get("archive_errors")
+    assert os.path.exists(path)
+    assert archive.list_archives() == []
+
+
+def test_type_ttls_apply_to_archives(store, write_day, make_events):
+    from datetime import datetime, timedelta
+
+    day = write_day(10, make_events(50, "process_start"))
+    policy = {"archive_after_days": 7, "default_days": 90, "type_days": {"process_start": 14}}
+    RetentionManager(policy).enforce()
+    assert not os.path.exists(db.segment_path(day))
+    types = Counter(ev["type"] for _, _, ev in archive.iter_archived())
+    assert types == {"auth_failed": 50, "process_start": 50}
+
+    later = datetime.utcnow().date() + timedelta(days=5)
+    assert RetentionManager(policy).enforce(today=later)["expired_rows"] == 50
+    assert Counter(ev["type"] for _, _, ev in archive.iter_archived()) == {"auth_failed": 50}
+
+    # archives live no longer than default_days unless archive_days is set
+    gone = RetentionManager(policy).enforce(today=datetime.utcnow().date() + timedelta(days=81))
+    assert day in gone.get("archives_dropped", [])
+
+
+def test_edited_footer_fails_closed(store, write_day, make_events):
+    import json
+    import struct
+
+    day = write_day(3, make_events(20, "process_start"))
+    archive.archive_segment(day, db.segment_path(day))
+    path = archive.archive_path(day)
+    with open(path, "rb") as f:
+        data = f.read()
+    (flen,) = struct.unpack("<I", data[-8:-4])
+    start = len(data) - 8 - 32 - flen
+    footer = json.loads(data[start:start + flen])
+    footer["blocks"][0]["types"] = ["auth_failed"]   # hide process_start from pushdown and TTL expiry
+    raw = json.dumps(footer, separators=(",", ":")).encode()
+    with open(path, "wb") as f:
+        f.write(data[:start] + raw + data[start + flen:-8] + struct.pack("<I", len(raw)) + data[-4:])
+
+    with pytest.raises(archive.ArchiveIntegrityError):
+        archive.ArchiveReader(path)
+    with pytest.raises(archive.ArchiveIntegrityError):
+        list(archive.iter_archived())
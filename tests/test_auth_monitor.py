@@ -0,0 +1,36 @@
+# tests/test_auth_monitor.py
+import storage.db as db
+from monitor import auth_monitor
+from monitor.auth_monitor import AuthMonitor, Throttle
+
+
+def _monitor(monkeypatch, tmp_path):
+    path = str(tmp_path / "auth_credentials.json")
+    monkeypatch.setattr(auth_monitor, "load_credential_store",
+                        lambda: auth_monitor.read_json(path, default=None))
+    mails = []
+    monkeypatch.setattr(auth_monitor, "send_email", lambda *a, **k: mails.append(a[0]))
+    return AuthMonitor(throttle=Throttle(free_attempts=1000)), path, mails
+
+
+def _types():
+    return [ev["type"] for _, _, ev in db.get_events(100) if ev["type"].startswith(("auth_", "login_"))]
+
+
+def test_no_password_set_is_logged_once_without_mail(store, monkeypatch, tmp_path):
+    mon, _, mails = _monitor(monkeypatch, tmp_path)
+    for i in range(5):
+        assert not mon.check_login("teacher", f"guess{i}", "10.0.0.5")
+    mon.flush()
+    assert mails == []
+    assert sorted(_types()) == ["auth_credentials_missing", "auth_not_configured"]
+
+
+def test_password_set_later_is_picked_up(store, monkeypatch, tmp_path):
+    mon, path, mails = _monitor(monkeypatch, tmp_path)
+    assert not mon.check_login("teacher", "secret")
+    auth_monitor.set_password("teacher", "secret", path)
+    assert mon.check_login("teacher", "secret")
+    assert not mon.check_login("teacher", "wrong")
+    mon.flush()
+    assert mails == ["ALERT: Wrong Password Attempt"]
@@ -0,0 +1,136 @@
+# tests/test_chain.py
+import keyring
+import pytest
+
+import storage.chain as chain
+import storage.db as db
+from config import CHAIN_SIGNING_KEY_NAME
+from storage.retention import RetentionManager
+
+
+def _errors(report):
+    return [e for seg in report["segments"] for e in seg["errors"]]
+
+
+def _prune(day, etype):
+    conn = db.connect(db.segment_path(day))
+    try:
+        with conn:
+            n = chain.record_prune(conn, "etype = ?", (etype,), day=day)
+            conn.execute("DELETE FROM events WHERE etype = ?", (etype,))
+        return n
+    finally:
+        conn.close()
+
+
+def test_untouched_store_verifies(store, write_day, make_events):
+    write_day(20, make_events(30))
+    db.add_event({"ts": "2026-01-01T00:00:00", "type": "hids_started"}, dedup=False)
+    db.flush()
+    ok, report = chain.verify_all()
+    assert ok, _errors(report)
+
+
+def test_retention_prune_is_signed_and_listed(store, write_day, make_events):
+    write_day(20, make_events(30))
+    assert RetentionManager({"archive_after_days": 0}).enforce()["expired_rows"] == 30
+    ok, report = chain.verify_all()
+    assert ok, _errors(report)
+    prunes = [p for seg in report["segments"] for p in seg["prunes"]]
+    assert len(prunes) == 1
+    assert prunes[0]["types"] == {"net_connection": 30}
+    assert prunes[0]["signed"] and prunes[0]["justified"]
+
+
+def test_unjustified_prune_fails(store, write_day, make_events):
+    day = write_day(20, make_events(30))
+    assert _prune(day, "auth_failed") == 30   # signed, but auth_failed has no TTL below default_days
+    ok, report = chain.verify_all()
+    assert not ok
+    assert any("not justified" in e for e in _errors(report))
+
+
+def test_unsigned_prune_fails(store, write_day, make_events):
+    day = write_day(20, make_events(30))
+    conn = db.connect(db.segment_path(day))
+    with conn:
+        # a prune link without its signature row, as a forger without the key would write it
+        chain.record_prune(conn, "etype = ?", ("net_connection",), day=day)
+        conn.execute("DELETE FROM chain_prune_sig")
+        conn.execute("DELETE FROM events WHERE etype = ?", ("net_connection",))
+    conn.close()
+    ok, report = chain.verify_all()
+    assert not ok
+    assert any("not signed" in e for e in _errors(report))
+
+
+def test_prune_without_key_deletes_nothing(store, write_day, make_events, monkeypatch):
+    day = write_day(20, make_events(10))
+
+    def locked(service, name):
+        raise RuntimeError("keyring locked")
+    monkeypatch.setattr(keyring, "get_password", locked)
+    with pytest.raises(RuntimeError):
+        _prune(day, "net_connection")
+    summary = RetentionManager({"archive_after_days": 0}).enforce()
+    assert summary["expired_rows"] == 0 and summary["expire_errors"]
+    monkeypatch.undo()
+    ok, report = chain.verify_all()
+    assert ok, _errors(report)
+
+
+def test_missing_keyring_key_fails_verification(store, write_day, make_events, monkeypatch):
+    write_day(20, make_events(10))
+    RetentionManager({"archive_after_days": 0}).enforce()
+    chain.checkpoint(chain.CHECKPOINT_FILE, force=True)
+    assert chain.verify_all()[0]
+
+    real = keyring.get_password
+    monkeypatch.setattr(keyring, "get_password",
+                        lambda s, name: None if name == CHAIN_SIGNING_KEY_NAME else real(s, name))
+    ok, report = chain.verify_all()
+    assert not ok
+    assert report["checkpoints"]["errors"]
+    assert any("no trusted signing key" in e for e in _errors(report))
+    assert keyring.get_password("mini_hids", CHAIN_SIGNING_KEY_NAME) is None   # verify created no key
+
+
+def test_tampered_row_fails(store, write_day, make_events):
+    day = write_day(20, make_events(5))
+    conn = db.connect(db.segment_path(day))
+    with conn:
+        conn.execute("DELETE FROM events WHERE id = (SELECT MIN(id) FROM events)")
+    conn.close()
+    assert not chain.verify_all()[0]
+
+
+def test_prune_checked_against_its_own_policy(store, write_day, make_events, monkeypatch):
+    day = write_day(20, make_events(10))
+    import config
+    policy = {"archive_after_days": 0, "type_days": dict(config.RETENTION["type_days"], auth_failed=15)}
+    assert RetentionManager(policy).enforce()["expired_rows"] == 20   # auth_failed and net_connection
+    ok, report = chain.verify_all()
+    assert ok, _errors(report)
+
+    # a later, longer TTL does not turn the old prune into a forgery
+    monkeypatch.setitem(config.RETENTION, "type_days", {"net_connection": 60})
+    ok, report = chain.verify_all()
+    assert ok, _errors(report)
+    (prune,) = [p for seg in report["segments"] for p in seg["prunes"]]
+    assert prune["policy"]["type_days"] == {"auth_failed": 15, "net_connection": 7}
+
+
+def test_unchained_segment_is_adopted_before_prune(store, write_day, make_events):
+    day = write_day(20, make_events(10))
+    conn = db.connect(db.segment_path(day))
+    with conn:
+        for table in ("chain", "chain_pruned", "chain_prune_sig"):
+            conn.execute(f"DROP TABLE {table}")
+    conn.close()
+    assert chain.verify_all()[1]["segments"][0]["unchained_rows"] == 20
+
+    assert RetentionManager({"archive_after_days": 0}).enforce()["expired_rows"] == 10
+    ok, report = chain.verify_all()
+    assert ok, _errors(report)
+    seg = report["segments"][0]
+    assert seg["rows"] == 10 and seg["unchained_rows"] == 0 and len(seg["prunes"]) == 1
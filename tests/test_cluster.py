@@ -0,0 +1,22 @@
+# tests/test_cluster.py
+import threading
+
+from cluster.agent import Agent
+from storage import db
+
+
+def test_agent_without_key_records_failure_and_returns(store, monkeypatch):
+    import keyring
+
+    from config import CLUSTER_KEY_NAME
+
+    monkeypatch.delenv("MINI_HIDS_CLUSTER_KEY", raising=False)
+    real = keyring.get_password
+    monkeypatch.setattr(keyring, "get_password",
+                        lambda service, name: None if name == CLUSTER_KEY_NAME else real(service, name))
+    t = threading.Thread(target=Agent("127.0.0.1:1").run_loop, args=(threading.Event(),), daemon=True)
+    t.start()
+    t.join(timeout=5)
+    assert not t.is_alive()
+    ((_, _, ev),) = db.get_events(10, types=["cluster_agent_failed"])
+    assert "no cluster key" in ev["error"]
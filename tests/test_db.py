@@ -0,0 +1,56 @@
+# tests/test_db.py
+import sqlite3
+
+import pytest
+
+import storage.db as db
+
+
+@pytest.mark.skipif(db.ENCRYPTION_MODE != "envelope", reason="fernet mode writes synchronously")
+def test_flush_keeps_events_when_store_and_spool_fail(store, monkeypatch):
+    def locked(path):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(db, "_writer", locked)
+    monkeypatch.setattr(db, "_spill", lambda items: False)
+    for i in range(5):
+        db.add_event({"ts": "2026-01-01T00:00:00", "type": "auth_failed", "user": f"u{i}"}, dedup=False)
+    with pytest.raises(sqlite3.OperationalError):
+        db.flush()
+    assert [it[3]["user"] for it in db._pending] == [f"u{i}" for i in range(5)]
+
+    monkeypatch.undo()
+    assert db.flush() == 5
+    assert {ev["user"] for _, _, ev in db.get_events(10, types=["auth_failed"])} == {f"u{i}" for i in range(5)}
+
+
+@pytest.mark.skipif(db.ENCRYPTION_MODE != "envelope", reason="batch keys are envelope mode only")
+def test_batch_key_found_in_own_segment_first(store, write_day, make_events, monkeypatch):
+    old = write_day(3, make_events(5))
+    write_day(1, make_events(5))
+    opened = []
+    real = sqlite3.connect
+    monkeypatch.setattr(sqlite3, "connect", lambda path, *a, **k: opened.append(path) or real(path, *a, **k))
+
+    decrypt = db.row_decryptor(segment=db.segment_path(old))
+    conn = real(db.segment_path(old))
+    enc = conn.execute("SELECT enc_event FROM events WHERE etype = 'auth_failed' LIMIT 1").fetchone()[0]
+    conn.close()
+    assert decrypt(enc)["type"] == "auth_failed"
+    assert opened == [db.segment_path(old)]
+
+
+def test_writer_connection_closed_when_thread_exits(store, monkeypatch):
+    import threading
+
+    opened = []
+    real = db.connect
+    monkeypatch.setattr(db, "connect", lambda path, **kw: opened.append(real(path, **kw)) or opened[-1])
+
+    def write():
+        db._writer(db.current_segment()).execute("SELECT 1")
+    t = threading.Thread(target=write)
+    t.start()
+    t.join()
+    (conn,) = opened
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
@@ -0,0 +1,73 @@
+# tests/test_dedup.py
+import json
+
+import pytest
+
+import storage.db as db
+from storage.dedup import Deduplicator
+
+CFG = {"window": 60, "max_keys": 3, "keys": {"file_modified": ["path"],
+                                             "alert_filtered_out": ["event.type", "event.user"]}}
+
+
+def _admit(d, ev, now):
+    return d.admit(ev, json.dumps(ev).encode(), now=now)
+
+
+def _mod(path, ts):
+    return {"ts": ts, "type": "file_modified", "path": path}
+
+
+def test_repeats_fold_into_one_row():
+    d = Deduplicator(CFG)
+    assert _admit(d, _mod("/etc/passwd", "t0"), 1000) == (True, [])   # first occurrence: stored now
+    for i in range(1, 5):
+        assert _admit(d, _mod("/etc/passwd", f"t{i}"), 1000 + i) == (False, [])
+    assert d.due(now=1059) == []
+    (row,) = d.due(now=1061)
+    assert row["count"] == 4 and row["first_ts"] == "t1" and row["last_ts"] == "t4"
+    assert row["ts"] == "t4" and row["path"] == "/etc/passwd"
+    assert len(d) == 0
+
+
+def test_single_occurrence_leaves_no_fold_row():
+    d = Deduplicator(CFG)
+    _admit(d, _mod("/a", "t0"), 1000)
+    assert d.due(now=2000) == [] and d.drain() == []
+
+
+def test_fingerprint_fields():
+    d = Deduplicator(CFG)
+    assert _admit(d, _mod("/a", "t0"), 1000)[0]
+    assert _admit(d, _mod("/b", "t1"), 1001)[0]                       # other path: its own window
+    assert _admit(d, {"ts": "t2", "type": "process_start"}, 1002)[0]  # type not configured
+    nested = {"ts": "t3", "type": "alert_filtered_out", "event": {"type": "login_failed", "user": "bob"}}
+    assert _admit(d, nested, 1003)[0]
+    assert not _admit(d, dict(nested, ts="t4"), 1004)[0]
+    assert _admit(d, dict(nested, event={"type": "login_failed", "user": "eve"}), 1005)[0]
+    assert _admit(d, dict(_mod("/a", "t6"), count=7), 1006)[0]        # already a fold row
+
+
+def test_full_table_closes_oldest_window():
+    d = Deduplicator(CFG)
+    _admit(d, _mod("/a", "t0"), 1000)
+    _admit(d, _mod("/a", "t1"), 1001)
+    _admit(d, _mod("/b", "t2"), 1002)
+    _admit(d, _mod("/c", "t3"), 1003)
+    keep, folds = _admit(d, _mod("/d", "t4"), 1004)
+    assert keep and [(r["path"], r["count"]) for r in folds] == [("/a", 1)]
+    assert len(d) == 3
+
+
+@pytest.mark.skipif(db._dedup is None, reason="MINI_HIDS_DEDUP=0")
+def test_store_counts_every_occurrence(store):
+    for i in range(50):
+        db.add_event(_mod("/var/log/app.log", f"2026-01-01T00:00:{i:02d}"))
+    db.add_event(_mod("/etc/hosts", "2026-01-01T00:01:00"))
+    db._write_folds(drain=True)
+    rows = [ev for _, _, ev in db.get_events(100, types=["file_modified"])]
+    app = [ev for ev in rows if ev["path"] == "/var/log/app.log"]
+    assert len(app) == 2 and sum(ev.get("count") or 1 for ev in app) == 50
+    folded = next(ev for ev in app if "count" in ev)
+    assert folded["first_ts"] == "2026-01-01T00:00:01" and folded["last_ts"] == "2026-01-01T00:00:49"
+    assert [ev.get("count") for ev in rows if ev["path"] == "/etc/hosts"] == [None]
@@ -0,0 +1,42 @@
+# tests/test_exe_hash.py
+import json
+import os
+
+from monitor.exe_hash import ExeHasher
+
+RULES = {"known_bad_sha256": [], "known_good_sha256": []}
+
+
+def _hasher(tmp_path):
+    return ExeHasher(cache_path=str(tmp_path / "cache.json"), cache_size=8, rules=RULES)
+
+
+def test_rewrite_with_restored_mtime_is_rehashed(tmp_path):
+    exe = tmp_path / "tool"
+    exe.write_bytes(b"A" * 64)
+    st = os.stat(exe)
+    h = _hasher(tmp_path)
+    first = h.hash_path(str(exe))
+    assert h.hash_path(str(exe)) == first
+
+    # same inode, same size, mtime put back: only ctime changed
+    with open(exe, "r+b") as f:
+        f.write(b"B" * 64)
+    os.utime(exe, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert h.hash_path(str(exe)) != first
+    assert len(h) == 1   # the stale entry for the inode is gone
+
+
+def test_cache_round_trip_and_old_format_ignored(tmp_path):
+    exe = tmp_path / "tool"
+    exe.write_bytes(b"A" * 64)
+    h = _hasher(tmp_path)
+    sha = h.hash_path(str(exe))
+    assert h.save()
+    assert len(_hasher(tmp_path)) == 1
+
+    st = os.stat(exe)
+    with open(tmp_path / "cache.json", "w") as f:
+        json.dump({"version": 1, "entries": [[st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size, "0" * 64]]}, f)
+    h = _hasher(tmp_path)
+    assert len(h) == 0 and h.hash_path(str(exe)) == sha
@@ -0,0 +1,45 @@
+# tests/test_listeners.py
+from monitor.listeners import ListenerInventory, save_approved
+
+SSH = (100, "0.0.0.0:22", "tcp")
+WEB = (200, "0.0.0.0:8080", "tcp")
+
+
+def _exe(pid):
+    return {100: "/usr/sbin/sshd", 200: "/usr/bin/python3"}[pid]
+
+
+def test_approval_is_picked_up_without_restart(store):
+    inv = ListenerInventory()
+    assert inv.approved is None
+    inv.seed([SSH], _exe, now=1000)
+    save_approved(inv.keys())
+    inv.reload_approved()
+
+    (ev,) = inv.update([WEB], [], _exe, now=1001)
+    assert ev["change"] == "added" and not ev["approved"]
+
+    # `mini_hids listeners --approve` from another process
+    save_approved(inv.keys())
+    (ev,) = inv.update([], [WEB], _exe, now=1002) + inv.update([], [], _exe, now=1002 + inv.grace)
+    assert ev["change"] == "removed" and ev["approved"]
+
+
+def test_explicit_baseline_is_not_reloaded(store):
+    save_approved({ListenerInventory.key(SSH, _exe(100))})
+    inv = ListenerInventory(approved=set())
+    inv.update([SSH], [], _exe, now=1000)
+    assert inv.approved == set()
+
+
+def test_checkpoints_are_owner_only(store):
+    import os
+    import stat
+
+    from storage import state
+
+    inv = ListenerInventory(approved=set())
+    inv.seed([SSH], _exe, now=1000)
+    assert inv.checkpoint(force=True)
+    assert stat.S_IMODE(os.stat(state.path("listeners")).st_mode) == 0o600
+    assert state.load("listeners", max_age=0)[0][0]["port"] == 22
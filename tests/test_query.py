@@ -0,0 +1,37 @@
+# tests/test_query.py
+import os
+
+import storage.archive as archive
+import storage.db as db
+from storage.query import query
+
+
+def test_counts_across_segments_and_archives(store, write_day, make_events):
+    old = write_day(5, make_events(30, "process_start"))
+    write_day(1, make_events(20, "process_start"))
+    archive.archive_segment(old, db.segment_path(old))
+    os.remove(db.segment_path(old))
+
+    report = query({"agg": "counts", "bucket": 86400}, jobs=1)
+    assert report["total"] == 100
+    live = len(db.list_segments())   # the day-1 segment, and today's if anything was logged
+    assert report["scanned"] == {"segments": live, "archives": 1, "jobs": 1, "failed": []}
+
+
+def test_failed_files_are_reported_not_counted(store, write_day, make_events):
+    old = write_day(5, make_events(30, "process_start"))
+    write_day(1, make_events(20, "process_start"))
+    archive.archive_segment(old, db.segment_path(old))
+    os.remove(db.segment_path(old))
+    with open(archive.archive_path(old), "r+b") as f:
+        f.seek(-40, os.SEEK_END)
+        f.write(b"\0" * 32)   # footer MAC
+
+    report = query({"agg": "top", "field": "user", "n": 5}, jobs=1)
+    sc = report["scanned"]
+    assert (sc["segments"], sc["archives"]) == (len(db.list_segments()), 0)
+    (failed,) = sc["failed"]
+    assert failed["kind"] == "archive" and failed["path"] == archive.archive_path(old)
+    assert "ArchiveIntegrityError" in failed["error"]
+    assert sum(r["count"] for r in report["rows"]) == 5   # the live day still counted (top 5 of 20 users)
+
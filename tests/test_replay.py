@@ -0,0 +1,45 @@
+# tests/test_replay.py
+from monitor import replay
+
+
+def _auth_log(path, n):
+    # one ip retrying every 10 s; chunk boundaries fall inside its correlation window
+    with open(path, "w") as f:
+        for i in range(n):
+            f.write(f"2026-01-01T00:{i // 6 % 60:02d}:{i % 6 * 10:02d}Z host sshd[{100 + i}]: "
+                    f"Failed password for root from 203.0.113.{i // 600} port {40000 + i} ssh2\n")
+
+
+def test_scores_do_not_depend_on_the_split(store, tmp_path):
+    log = str(tmp_path / "auth.log")
+    _auth_log(log, 1500)   # ~130 KB: three 64 KB tasks
+    whole = replay.replay([log], jobs=1, chunk_mb=1, top=2000)
+    split = replay.replay([log], jobs=1, chunk_mb=0, top=2000)
+    assert (whole["tasks"], split["tasks"]) == (1, 3)
+    assert split["alerts_by_level"] == whole["alerts_by_level"]
+    assert [ev["severity"] for ev in split["top_alerts"]] == [ev["severity"] for ev in whole["top_alerts"]]
+
+
+def test_alert_callback_errors_go_to_the_sink(monkeypatch):
+    sink = replay._Sink()
+    det = replay._Detectors(sink)
+    monkeypatch.setattr(det.auth, "alert_callback", lambda ev: 1 / 0)
+    det.auth_lines([b"2026-01-01T00:00:00Z host sshd[1]: Failed password for root from 198.51.100.1 port 1 ssh2\n"],
+                   2026, 12)
+    assert [ev["type"] for ev in sink.events] == ["auth_failed", "auth_alert_callback_failed"]
+
+
+def test_folded_rows_keep_their_count():
+    sink = replay._Sink()
+    det = replay._Detectors(sink)
+    det.events([
+        {"ts": "2026-01-01T00:01:00Z", "type": "file_modified", "path": "/srv/app.log", "user": "app",
+         "count": 12, "first_ts": "2026-01-01T00:00:02Z", "last_ts": "2026-01-01T00:01:00Z"},
+        {"ts": "2026-01-01T00:01:00Z", "type": "net_connection", "pid": 7, "status": "TIME_WAIT",
+         "local": "10.0.0.2:50000", "remote": "10.0.0.9:443", "count": 3},
+        {"ts": "2026-01-01T00:02:00Z", "type": "file_modified", "path": "/srv/app.log", "user": "app"},
+    ])
+    rows = [(ev["type"], ev.get("count"), ev.get("first_ts")) for ev in sink.events
+            if ev["type"] in ("file_modified", "net_connection")]
+    assert rows == [("file_modified", 12, "2026-01-01T00:00:02Z"), ("net_connection", 3, None),
+                    ("file_modified", None, None)]
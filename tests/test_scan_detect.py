@@ -0,0 +1,83 @@
+# tests/test_scan_detect.py
+from config import SCAN_DETECT
+from monitor.scan_detect import ScanDetector
+from monitor.sketches import SlidingHLL
+
+LISTEN = {22, 80, 443}
+
+
+def test_sliding_hll_accuracy():
+    h = SlidingHLL(window=60, buckets=6, p=10)
+    for i in range(5000):
+        h.add(f"10.0.{i // 256}.{i % 256}", 1000.0)
+    assert abs(h.estimate(1000.0) - 5000) / 5000 < 0.1
+    s = SlidingHLL(window=60, buckets=6, p=8)
+    for port in range(20):
+        s.add(port, 1000.0)
+    assert abs(s.estimate(1000.0) - 20) <= 2
+
+
+def test_sliding_hll_forgets_old_buckets():
+    h = SlidingHLL(window=60, buckets=6, p=8)
+    for i in range(30):
+        h.add(i, 1000.0)
+    for i in range(100, 105):
+        h.add(i, 1050.0)
+    assert abs(h.estimate(1050.0) - 35) <= 3
+    assert abs(h.estimate(1075.0) - 5) <= 1    # the first bucket left the window
+    assert h.estimate(1200.0) == 0.0
+
+
+def _det(**over):
+    return ScanDetector(dict(SCAN_DETECT, **over))
+
+
+def test_inbound_scan_on_ports_that_are_not_listening():
+    d = _det(inbound_port_threshold=6)
+    found = []
+    for i, port in enumerate([21, 23, 25, 110, 139, 445]):   # none in LISTEN
+        evs, _ = d.observe(0, f"192.168.1.5:{port}", f"203.0.113.9:{40000 + i}", LISTEN, now=1000 + i)
+        found += evs
+    (ev,) = found
+    assert ev["type"] == "port_scan" and ev["direction"] == "inbound"
+    assert ev["src"] == "203.0.113.9" and ev["distinct_ports"] == 6
+
+
+def test_outbound_connections_are_not_inbound_scans():
+    d = _det(inbound_port_threshold=6, port_threshold=1000, host_threshold=1000)
+    for i in range(50):
+        evs, drop = d.observe(42, f"192.168.1.5:{50000 + i}", "198.51.100.7:5432", LISTEN, now=1000 + i)
+        assert evs == [] and not drop
+
+
+def test_outbound_port_scan_and_fanout():
+    d = _det(port_threshold=20, host_threshold=30)
+    types = []
+    for port in range(1, 25):
+        evs, _ = d.observe(7, f"10.0.0.2:{50000 + port}", f"10.0.0.9:{port}", LISTEN, now=1000)
+        types += [e["type"] for e in evs]
+    for host in range(40):
+        evs, _ = d.observe(8, f"10.0.0.2:{51000 + host}", f"10.0.1.{host}:443", LISTEN, now=1000)
+        types += [e["type"] for e in evs]
+    assert types == ["port_scan", "connection_fanout"]
+
+
+def test_many_sources_on_one_port():
+    d = _det(source_threshold=100, suppress_flows=True)
+    found, dropped = [], 0
+    for i in range(150):
+        evs, drop = d.observe(0, "192.168.1.5:22", f"198.18.{i // 200}.{i % 200}:{40000 + i}", LISTEN, now=1000)
+        found += evs
+        dropped += drop
+    (ev,) = [e for e in found if e["type"] == "connection_fanin"]
+    assert ev["port"] == 22 and ev["distinct_sources"] == 100
+    assert dropped == 0   # clients of a busy service keep their rows
+
+
+def test_flag_suppresses_rows_then_reports():
+    d = _det(inbound_port_threshold=3, suppress_flows=True)
+    drops = [d.observe(0, f"192.168.1.5:{p}", "203.0.113.9:40000", LISTEN, now=1000)[1] for p in (22, 80, 443, 8080)]
+    assert drops == [False, False, True, True]
+    assert d.expired(now=1030) == []
+    (ev,) = d.expired(now=1061)
+    assert ev["type"] == "scan_flows_suppressed" and ev["rows"] == 2
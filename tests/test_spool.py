@@ -0,0 +1,110 @@
+# tests/test_spool.py
+import json
+import struct
+
+import pytest
+
+from storage.spool import Spool, HEADER_SIZE
+from utils.crypto_utils import new_data_key
+
+
+@pytest.fixture
+def key():
+    return new_data_key()
+
+
+def _raws(n, tag="e"):
+    return [json.dumps({"type": "auth_failed", "user": f"{tag}{i}", "secret": "s3cr3t"}).encode() for i in range(n)]
+
+
+def test_replay_after_crash(tmp_path, key):
+    path = str(tmp_path / "spool.bin")
+    sp = Spool(path, 1, master_key=lambda: key)
+    assert sp.append(_raws(100)) == 100
+    sp._mm.flush()   # process dies here: no close(), header offsets as last saved
+
+    reopened = Spool(path, 1, master_key=lambda: key)
+    assert len(reopened) == 100
+    got = []
+    assert reopened.replay(got.extend, chunk=30) == 100
+    assert [e["user"] for e in got] == [f"e{i}" for i in range(100)]
+    assert len(Spool(path, 1, master_key=lambda: key)) == 0
+
+
+def test_torn_record_is_ignored(tmp_path, key):
+    path = str(tmp_path / "spool.bin")
+    sp = Spool(path, 1, master_key=lambda: key)
+    sp.append(_raws(10))
+    last = sp.write_off
+    sp.append(_raws(1, "torn"))
+    # the crash hit while the last record was being written
+    length = struct.unpack_from("<I", sp._mm, last)[0]
+    sp._mm[last + 8 + length - 1] ^= 0xFF
+    sp._mm.flush()
+
+    got = []
+    Spool(path, 1, master_key=lambda: key).replay(got.extend)
+    assert [e["user"] for e in got] == [f"e{i}" for i in range(10)]
+
+
+def test_failed_store_keeps_records(tmp_path, key):
+    sp = Spool(str(tmp_path / "spool.bin"), 1, master_key=lambda: key)
+    sp.append(_raws(5))
+
+    def down(events):
+        raise OSError("database is locked")
+    with pytest.raises(OSError):
+        sp.replay(down)
+    assert len(sp) == 5
+    got = []
+    assert sp.replay(got.extend) == 5
+
+
+def test_never_written_in_the_clear(tmp_path, key):
+    path = str(tmp_path / "spool.bin")
+    master = {"key": None}
+    sp = Spool(path, 1, master_key=lambda: master["key"])
+    assert sp.append(_raws(3)) == 3   # held in memory
+    assert sp.records == 0 and len(sp) == 3
+    sp._mm.flush()
+    assert b"s3cr3t" not in open(path, "rb").read()
+
+    master["key"] = key
+    sp.append(_raws(1, "later"))
+    assert sp.records == 4
+    sp._mm.flush()
+    assert b"s3cr3t" not in open(path, "rb").read()[HEADER_SIZE:]
+
+    got = []
+    Spool(path, 1, master_key=lambda: key).replay(got.extend)
+    assert [e["user"] for e in got] == ["e0", "e1", "e2", "later0"]
+
+
+def test_held_events_replay_without_key(tmp_path):
+    sp = Spool(str(tmp_path / "spool.bin"), 1, master_key=lambda: None)
+    sp.append(_raws(2))
+    got = []
+    assert sp.replay(got.extend) == 2
+    assert len(sp) == 0 and len(got) == 2
+
+
+def test_store_failure_spills_and_replays(store, monkeypatch):
+    import sqlite3
+    import storage.db as db
+
+    db.warm_keys()
+
+    def locked(path):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(db, "_writer", locked)
+    for i in range(20):
+        db.add_event({"ts": "2026-01-01T00:00:00", "type": "auth_failed", "user": f"u{i}"}, dedup=False)
+    assert db.flush() == 0
+    sp = db._get_spool()
+    db._spool["replayer"].stop()   # replay by hand below
+    assert len(sp) == 20 and sp.records == 20   # master key loaded: sealed on disk
+
+    monkeypatch.undo()
+    assert sp.replay(db._replay_events) == 20
+    users = {ev["user"] for _, _, ev in db.get_events(100, types=["auth_failed"])}
+    assert users == {f"u{i}" for i in range(20)}
@@ -1,18 +1,76 @@
 # utils/crypto_utils.py
-from cryptography.fernet import Fernet
-import keyring
-from config import FERNET_KEY_NAME
+# cryptography and keyring (with its D-Bus backends) are imported on first use
+import base64
+import os
+from config import FERNET_KEY_NAME, MASTER_KEY_NAME
+
+KEYRING_SERVICE = "mini_hids"
+WRAP_AAD = b"mini_hids-dek-v1"
+
+_AESGCM = {"cls": None}
+
+def aead(key):
+    """AES-GCM cipher for a 256-bit key. The one place that imports cryptography's AESGCM (on first use)."""
+    cls = _AESGCM["cls"]
+    if cls is None:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM as cls
+        _AESGCM["cls"] = cls
+    return cls(key)
 
 def get_or_create_key():
+    import keyring
+    from cryptography.fernet import Fernet
     # Try to fetch from OS keyring (safer than storing plaintext)
-    key = keyring.get_password("mini_hids", FERNET_KEY_NAME)
+    key = keyring.get_password(KEYRING_SERVICE, FERNET_KEY_NAME)
     if key:
         return key.encode()
     new_key = Fernet.generate_key()
-    keyring.set_password("mini_hids", FERNET_KEY_NAME, new_key.decode())
+    keyring.set_password(KEYRING_SERVICE, FERNET_KEY_NAME, new_key.decode())
     return new_key
 
 def get_fernet():
+    from cryptography.fernet import Fernet
     key = get_or_create_key()
     return Fernet(key)
 
+def get_master_key():
+    """256-bit AES master key (key-encryption key) kept in the OS keyring."""
+    import keyring
+    key = keyring.get_password(KEYRING_SERVICE, MASTER_KEY_NAME)
+    if key:
+        return base64.urlsafe_b64decode(key.encode())
+    new_key = new_data_key()
+    keyring.set_password(KEYRING_SERVICE, MASTER_KEY_NAME, base64.urlsafe_b64encode(new_key).decode())
+    return new_key
+
+def new_data_key():
+    return os.urandom(32)   # what AESGCM.generate_key(bit_length=256) does
+
+def wrap_key(dek, master=None):
+    """Encrypt a data key under the master key: nonce(12) || AES-GCM(dek)."""
+    nonce = os.urandom(12)
+    return nonce + aead(master or get_master_key()).encrypt(nonce, dek, WRAP_AAD)
+
+def unwrap_key(blob, master=None):
+    return aead(master or get_master_key()).decrypt(blob[:12], blob[12:], WRAP_AAD)
+
+# Password hashing (monitor/auth_monitor.py credential store)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+def hash_password(password, salt=None, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """Salted scrypt hash as a JSON-friendly dict."""
+    import hashlib
+    salt = salt or os.urandom(16)
+    dk = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=32)
+    return {"kdf": "scrypt", "n": n, "r": r, "p": p,
+            "salt": base64.b64encode(salt).decode(), "hash": base64.b64encode(dk).decode()}
+
+def verify_password(password, record):
+    """Constant-time check of a password against a hash_password() record."""
+    import hashlib
+    import hmac
+    salt = base64.b64decode(record["salt"])
+    dk = hashlib.scrypt(password.encode(), salt=salt, n=record["n"], r=record["r"], p=record["p"], dklen=32)
+    return hmac.compare_digest(dk, base64.b64decode(record["hash"]))
@@ -1,8 +1,7 @@
 import os
-import smtplib
-from email.mime.text import MIMEText
 from storage.db import add_event
 from utils.helpers import now_iso
+from utils import metrics
 
 SMTP_USER = os.getenv("MINI_HIDS_SMTP_USER")
 SMTP_PASS = os.getenv("MINI_HIDS_SMTP_PASS")
@@ -28,10 +27,13 @@ def send_email(subject, body, rate_key=None, rate_seconds=30):
     if rate_key:
         last = RATE_LIMIT.get(rate_key, 0)
         if time.time() - last < rate_seconds:
+            metrics.inc("hids_emails_total", labels={"result": "rate_limited"})
             return True
         RATE_LIMIT[rate_key] = time.time()
 
-    # build email
+    # build email (smtplib/email are only imported when something is sent)
+    import smtplib
+    from email.mime.text import MIMEText
     msg = MIMEText(body)
     msg["Subject"] = subject
     msg["From"] = FROM_ADDR
@@ -39,16 +41,19 @@ def send_email(subject, body, rate_key=None, rate_seconds=30):
 
     try:
         # Gmail SMTP
-        s = smtplib.SMTP("smtp.gmail.com", 587)
-        s.starttls()
-        s.login(SMTP_USER, SMTP_PASS)
-        s.sendmail(FROM_ADDR, TO_ADDRS, msg.as_string())
-        s.quit()
+        with metrics.timed("hids_smtp_seconds"):
+            s = smtplib.SMTP("smtp.gmail.com", 587)
+            s.starttls()
+            s.login(SMTP_USER, SMTP_PASS)
+            s.sendmail(FROM_ADDR, TO_ADDRS, msg.as_string())
+            s.quit()
+        metrics.inc("hids_emails_total", labels={"result": "sent"})
 
         add_event({"ts": now_iso(), "type":"email_sent", "subject": subject})
         return True
 
     except Exception as e:
+        metrics.inc("hids_emails_total", labels={"result": "error"})
         add_event({
             "ts": now_iso(),
             "type": "email_error",
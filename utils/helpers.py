@@ -1,9 +1,47 @@
 # utils/helpers.py
 import hashlib
+import importlib
+import importlib.util
 import json
 import os
+import sys
+import threading
 from datetime import datetime
 
+
+class _LazyModule:
+    """Imports the real module on first attribute access (thread-safe)."""
+
+    def __init__(self, name):
+        self._name = name
+        self._mod = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        mod = self._mod
+        if mod is None:
+            with self._lock:
+                if self._mod is None:
+                    self._mod = importlib.import_module(self._name)
+                mod = self._mod
+        return getattr(mod, attr)
+
+
+def lazy_import(name):
+    """
+    Stand-in for `import name` that defers the import to first use, or None
+    if the package is not installed. Keeps heavy optional dependencies
+    (psutil, ...) off the startup path.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    try:
+        if importlib.util.find_spec(name) is None:
+            return None
+    except (ImportError, ValueError):
+        return None
+    return _LazyModule(name)
+
 def sha256_file(path):
     h = hashlib.sha256()
     with open(path, "rb") as f:
@@ -33,3 +71,15 @@ def write_json(path, obj):
     with open(path, "w", encoding="utf-8") as f:
         json.dump(obj, f, indent=2)
 
+def write_private_json(path, obj):
+    """write_json for secrets: owner-only (0600) from creation, atomic replace."""
+    ensure_dir(path)
+    tmp = path + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)   # a stale tmp file keeps its old mode otherwise
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
@@ -0,0 +1,314 @@
+# utils/metrics.py
+"""
+Self-instrumentation for mini_hids.
+
+Counters, gauges and histograms that the hot paths (add_event, monitor
+snapshots, SMTP) report into. Everything is a no-op unless metrics are
+enabled (MINI_HIDS_METRICS=1), so the disabled cost is one flag check.
+
+Exposed two ways when enabled:
+ - Prometheus text format on http://127.0.0.1:<METRICS_PORT>/metrics
+ - a periodic "hids_stats" event written through add_event
+"""
+
+import threading
+import time
+
+from config import METRICS_ENABLED, METRICS_PORT, METRICS_STATS_INTERVAL
+
+ENABLED = METRICS_ENABLED
+
+# seconds; tuned for sub-ms db writes up to multi-second SMTP sends
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}    # {(name, labels): value}
+_gauges = {}      # {(name, labels): value}
+_histograms = {}  # {(name, labels): _Histogram}
+_help = {}        # {name: (kind, help text)}
+
+
+def _key(name, labels):
+    if not labels:
+        return (name, ())
+    return (name, tuple(sorted(labels.items())))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Bucket upper bound containing quantile q (good enough for stats events)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for b, c in zip(self.buckets, self.counts):
+            seen += c
+            if seen >= target:
+                return b
+        return float("inf")
+
+
+def describe(name, kind, text):
+    """Register HELP/TYPE text for a metric (optional, only used by the exporter)."""
+    _help[name] = (kind, text)
+
+
+def enable(flag=True):
+    """Turn instrumentation on/off at runtime (e.g. from the benchmark harness)."""
+    global ENABLED
+    ENABLED = bool(flag)
+
+
+def inc(name, value=1, labels=None):
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def set_gauge(name, value, labels=None):
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _gauges[k] = value
+
+
+def observe(name, value, labels=None, buckets=DEFAULT_BUCKETS):
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = _Histogram(buckets)
+        h.observe(value)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.t0, self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name, labels=None):
+    """Context manager observing elapsed seconds into histogram `name`."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name, labels)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+# Export
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    parts = []
+    for k, v in items:
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_prometheus():
+    """Return all metrics in Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        hists = sorted((k, (h.buckets, list(h.counts), h.count, h.sum)) for k, h in _histograms.items())
+
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name in described:
+            return
+        described.add(name)
+        _, text = _help.get(name, (kind, ""))
+        if text:
+            lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), v in counters:
+        header(name, "counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {v}")
+    for (name, labels), v in gauges:
+        header(name, "gauge")
+        lines.append(f"{name}{_fmt_labels(labels)} {v}")
+    for (name, labels), (buckets, counts, count, total) in hists:
+        header(name, "histogram")
+        cum = 0
+        for b, c in zip(buckets, counts):
+            cum += c
+            lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', b))} {cum}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {count}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """Compact dict view of all metrics (used for hids_stats events)."""
+    def lbl(name, labels):
+        return name + _fmt_labels(labels)
+
+    with _lock:
+        out = {
+            "counters": {lbl(n, l): v for (n, l), v in _counters.items()},
+            "gauges": {lbl(n, l): v for (n, l), v in _gauges.items()},
+            "histograms": {
+                lbl(n, l): {
+                    "count": h.count,
+                    "sum": round(h.sum, 6),
+                    "p50": h.quantile(0.50),
+                    "p99": h.quantile(0.99),
+                }
+                for (n, l), h in _histograms.items()
+            },
+        }
+    return out
+
+
+# Background exporter + stats events
+
+_server = None
+_stats_thread = None
+_stop = threading.Event()
+
+
+def _start_http(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def _stats_loop(emit, interval):
+    last = {}
+    last_t = time.time()
+    while not _stop.wait(interval):
+        now = time.time()
+        elapsed = max(now - last_t, 1e-9)
+        snap = snapshot()
+        rates = {}
+        for k, v in snap["counters"].items():
+            if k.startswith("hids_events_total"):
+                rates[k] = round((v - last.get(k, 0)) / elapsed, 3)
+        last = dict(snap["counters"])
+        last_t = now
+        try:
+            emit({"ts": _now_iso(), "type": "hids_stats", "interval": interval,
+                  "events_per_sec": rates, "metrics": snap})
+        except Exception:
+            pass
+
+
+def _now_iso():
+    from utils.helpers import now_iso
+    return now_iso()
+
+
+def start(emit=None, port=METRICS_PORT, interval=METRICS_STATS_INTERVAL):
+    """
+    Start the localhost exporter and the periodic hids_stats emitter.
+    `emit` is called with each stats event (normally storage.db.add_event).
+    Does nothing when metrics are disabled.
+    """
+    global _server, _stats_thread
+    if not ENABLED:
+        return False
+    _stop.clear()
+    if _server is None and port:
+        _server = _start_http(port)
+    if _stats_thread is None and emit is not None and interval:
+        _stats_thread = threading.Thread(target=_stats_loop, args=(emit, interval), daemon=True)
+        _stats_thread.start()
+    return True
+
+
+def stop():
+    global _server, _stats_thread
+    _stop.set()
+    if _server is not None:
+        try:
+            _server.shutdown()
+            _server.server_close()
+        except Exception:
+            pass
+        _server = None
+    _stats_thread = None
+
+
+describe("hids_events_total", "counter", "Events stored, by event type")
+describe("hids_db_add_event_seconds", "histogram", "Wall time of add_event including encryption and commit")
+describe("hids_db_encrypt_seconds", "histogram", "Time spent encrypting a single event")
+describe("hids_snapshot_seconds", "histogram", "Per-tick snapshot time, by monitor")
+describe("hids_smtp_seconds", "histogram", "SMTP send latency")
+describe("hids_emails_total", "counter", "Email send attempts, by result")